@@ -7,6 +7,40 @@ import { JobStorage } from '@/utils/job-storage.util';
 const unlinkAsync = promisify(unlink);
 const statAsync = promisify(stat);
 
+function archiveFilename(playlistName: string, part?: string): string {
+  // Clean filename for download
+  const cleanPlaylistName = playlistName
+    .replace(/[^a-zA-Z0-9\s-_]/g, '') // Remove special chars
+    .replace(/\s+/g, '_') // Replace spaces with underscores
+    .substring(0, 100); // Limit length
+
+  return part
+    ? `${cleanPlaylistName}.part${part}.zip`
+    : `${cleanPlaylistName}.zip`;
+}
+
+// Pass the archive the Python service builds on the fly straight through,
+// without writing it to disk on either side
+async function proxyArchiveStream(jobId: string, playlistName: string) {
+  const upstream = await fetch(
+    `${process.env.VERCEL_URL}/api/python/download-playlist?jobId=${encodeURIComponent(jobId)}`,
+  );
+
+  if (!upstream.ok || !upstream.body) {
+    return NextResponse.json(
+      { error: 'File not found' },
+      { status: upstream.status === 404 ? 404 : 502 },
+    );
+  }
+
+  return new Response(upstream.body, {
+    headers: {
+      'Content-Type': 'application/zip',
+      'Content-Disposition': `attachment; filename="${archiveFilename(playlistName)}"`,
+    },
+  });
+}
+
 export async function GET(
   request: NextRequest,
   { params }: { params: Promise<{ jobId: string }> },
@@ -20,8 +54,21 @@ export async function GET(
       return NextResponse.json({ error: 'Job not found' }, { status: 404 });
     }
 
+    if (job.delivery === 'stream') {
+      return proxyArchiveStream(jobId, job.playlistName);
+    }
+
+    // Split archives are served one part at a time
+    const part = request.nextUrl.searchParams.get('part') ?? undefined;
+    if (part !== undefined && !/^[1-9]\d*$/.test(part)) {
+      return NextResponse.json({ error: 'Invalid part' }, { status: 400 });
+    }
+
     // Construct file path
-    const filePath = path.join('/tmp', `${jobId}.zip`);
+    const filePath = path.join(
+      '/tmp',
+      part ? `${jobId}.part${part}.zip` : `${jobId}.zip`,
+    );
 
     // Check if file exists
     try {
@@ -33,13 +80,7 @@ export async function GET(
     // Create readable stream
     const stream = createReadStream(filePath);
 
-    // Clean filename for download
-    const cleanPlaylistName = job.playlistName
-      .replace(/[^a-zA-Z0-9\s-_]/g, '') // Remove special chars
-      .replace(/\s+/g, '_') // Replace spaces with underscores
-      .substring(0, 100); // Limit length
-
-    const filename = `${cleanPlaylistName}.zip`;
+    const filename = archiveFilename(job.playlistName, part);
 
     // Convert Node.js stream to Web Stream
     const readableStream = new ReadableStream({
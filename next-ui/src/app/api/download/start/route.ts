@@ -2,9 +2,12 @@ import { NextRequest, NextResponse } from 'next/server';
 import { getEnhancedPlaylistWithTidal } from '@/utils/enhanced-playlist.util';
 import { JobStorage } from '@/utils/job-storage.util';
 
+const OUTPUT_PROFILES = ['original', 'aiff', 'mp3-320', 'alac'];
+
 export async function POST(request: NextRequest) {
   try {
-    const { playlistId } = await request.json();
+    const { playlistId, syncFrom, syncMode, syncManifest, profile, normalize } =
+      await request.json();
 
     if (!playlistId) {
       return NextResponse.json(
@@ -13,6 +16,20 @@ export async function POST(request: NextRequest) {
       );
     }
 
+    if (syncMode && syncMode !== 'delta' && syncMode !== 'full') {
+      return NextResponse.json(
+        { error: 'syncMode must be "delta" or "full"' },
+        { status: 400 },
+      );
+    }
+
+    if (profile && !OUTPUT_PROFILES.includes(profile)) {
+      return NextResponse.json(
+        { error: `profile must be one of ${OUTPUT_PROFILES.join(', ')}` },
+        { status: 400 },
+      );
+    }
+
     // Get playlist info to validate and get track count
     const enhancedPlaylist = await getEnhancedPlaylistWithTidal(playlistId);
 
@@ -42,6 +59,18 @@ export async function POST(request: NextRequest) {
       downloadableTracks.length,
     );
 
+    // The Python service reads these from the job and diffs against that job's tracks
+    if (syncFrom || syncManifest) {
+      JobStorage.update(job.id, {
+        syncFrom,
+        syncMode: syncMode ?? 'delta',
+        syncManifest,
+      });
+    }
+    if (profile) {
+      JobStorage.update(job.id, { profile, normalize: Boolean(normalize) });
+    }
+
     // Start the download process asynchronously
     startDownloadProcess(job.id);
 
@@ -64,18 +93,32 @@ async function startDownloadProcess(jobId: string) {
     // Update job status
     JobStorage.update(jobId, { status: 'downloading' });
 
-    // Call Python function (we'll implement this next)
-    const response = await fetch(
-      `${process.env.VERCEL_URL}/api/python/download-playlist`,
-      {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ jobId }),
-      },
-    );
+    // With a chunk budget set, each invocation only downloads what fits in it
+    // and hands back a continuation token for the next one
+    const timeBudget = process.env.DOWNLOAD_CHUNK_BUDGET
+      ? Number(process.env.DOWNLOAD_CHUNK_BUDGET)
+      : undefined;
+    let body: Record<string, unknown> = { jobId, timeBudget };
+
+    while (true) {
+      const response = await fetch(
+        `${process.env.VERCEL_URL}/api/python/download-playlist`,
+        {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify(body),
+        },
+      );
+
+      if (!response.ok) {
+        throw new Error(`Python function failed: ${response.status}`);
+      }
 
-    if (!response.ok) {
-      throw new Error(`Python function failed: ${response.status}`);
+      const result = await response.json();
+      if (!result.continuation || result.complete) {
+        break;
+      }
+      body = { continuation: result.continuation, timeBudget };
     }
   } catch (error) {
     console.error(`Download job ${jobId} failed:`, error);
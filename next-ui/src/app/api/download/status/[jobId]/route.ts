@@ -17,10 +17,20 @@ export async function GET(
       id: job.id,
       status: job.status,
       progress: job.progress,
+      estimate: job.estimate,
       downloadUrl: job.downloadUrl,
+      volumes: job.volumes,
+      analysis: job.analysis,
       error: job.error,
       failedTracks: job.failedTracks,
       playlistName: job.playlistName,
+      // Read back by the Python service when it picks the job up
+      playlistId: job.playlistId,
+      syncFrom: job.syncFrom,
+      syncMode: job.syncMode,
+      syncManifest: job.syncManifest,
+      profile: job.profile,
+      normalize: job.normalize,
     });
   } catch (error) {
     console.error('Failed to get job status:', error);
@@ -8,7 +8,60 @@ export interface DownloadJob {
     total: number;
     currentTrack?: string;
   };
+  // Preflight estimate for the tracks left to download, sent before downloads start
+  estimate?: {
+    tracks: number;
+    skipped: number;
+    bytes: number;
+    seconds: number;
+  };
   downloadUrl?: string;
+  // Split archives: each part is published as soon as it's sealed
+  volumes?: {
+    part: number;
+    url: string;
+    tracks: number;
+    bytes: number;
+  }[];
+  // 'stream' means the Python service builds the archive when it's fetched
+  delivery?: 'file' | 'stream';
+  // Re-download against an earlier job: 'delta' archives only the added tracks
+  syncFrom?: string;
+  syncMode?: 'delta' | 'full';
+  // Sync manifest of the earlier job, for when its Python instance is gone
+  syncManifest?: {
+    jobId?: string;
+    tracks: Record<
+      string,
+      { name: string; tidalId?: string; isrc?: string; files: string[] }
+    >;
+  };
+  // Format the tracks are transcoded to for DJ hardware; unset keeps OrpheusDL's output
+  profile?: 'original' | 'aiff' | 'mp3-320' | 'alac';
+  // Apply TIDAL's replay gain, limited by each track's peak
+  normalize?: boolean;
+  sync?: {
+    from: string | null;
+    mode: 'delta' | 'full';
+    added: number;
+    retained: number;
+    // Full mode only: retained tracks still in the track cache; the rest were downloaded again
+    cached?: number;
+    removed: string[];
+  };
+  // Per-track audio analysis, also shipped in the archive as analysis.json
+  analysis?: {
+    track: string;
+    isrc?: string;
+    tidalId?: string;
+    duration: number;
+    bpm: number | null;
+    key: string | null;
+    camelot: string | null;
+    lufs: number | null;
+    peak: number | null;
+    sections: number[];
+  }[];
   error?: string;
   createdAt: Date;
   completedAt?: Date;
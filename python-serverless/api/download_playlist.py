@@ -1,26 +1,2715 @@
+import time
+
+# Taken before the other imports so /metrics can show what a cold start costs
+_IMPORT_STARTED = time.perf_counter()
+
 import json
 import os
 import tempfile
 import zipfile
 import shutil
-from http.server import BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import requests
-from typing import Dict, List, Optional
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import random
 import subprocess
 import sys
+import uuid
+import threading
+import re
+import importlib.util
+import multiprocessing
+import fcntl
+import base64
+import queue
+import struct
+import zlib
+from collections import deque
+import io
+import math
+import codecs
+from urllib.parse import urlparse, parse_qs
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class NextJSClient:
+    """Pooled HTTP client for the Next.js API.
+    
+    One keep-alive session per downloader, with retries and backoff on
+    connection errors and 429/5xx responses, and a timeout on every call.
+    """
+    
+    def __init__(self, base_url: Optional[str] = None, timeout: Optional[float] = None,
+                 retries: Optional[int] = None):
+        self.base_url = base_url or os.getenv('NEXTJS_URL', 'http://localhost:3000')
+        self.timeout = timeout or float(os.getenv('NEXTJS_TIMEOUT', '10'))
+        retries = retries if retries is not None else int(os.getenv('NEXTJS_RETRIES', '3'))
+        
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            # Status updates overwrite job state, so retrying POSTs is safe
+            allowed_methods=frozenset({'GET', 'POST'}),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_maxsize=10, max_retries=retry)
+        
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    
+    def get(self, path: str, stream: bool = False) -> requests.Response:
+        if stream:
+            return self.session.get(f"{self.base_url}{path}", timeout=self.timeout, stream=True)
+        return self.session.get(f"{self.base_url}{path}", timeout=self.timeout)
+    
+    def post(self, path: str, data: Dict) -> requests.Response:
+        return self.session.post(f"{self.base_url}{path}", json=data, timeout=self.timeout)
+
+
+class ProgressReporter:
+    """Coalesces per-track progress into occasional status updates.
+    
+    An update is sent once `interval` seconds have passed or `every` more tracks
+    have completed since the last one; flush() sends whatever is still pending.
+    """
+    
+    def __init__(self, send: Callable[[int, int, Optional[str]], None],
+                 interval: Optional[float] = None, every: Optional[int] = None):
+        self.send = send
+        self.interval = interval if interval is not None else float(os.getenv('PROGRESS_INTERVAL', '2'))
+        self.every = max(1, every or int(os.getenv('PROGRESS_EVERY', '5')))
+        self._last_sent_at = None
+        self._last_sent_count = 0
+        self._pending = None
+        self._lock = threading.Lock()
+    
+    def update(self, current: int, total: int, current_track: Optional[str] = None):
+        with self._lock:
+            self._pending = (current, total, current_track)
+            now = time.monotonic()
+            due = (
+                self._last_sent_at is None
+                or now - self._last_sent_at >= self.interval
+                or current - self._last_sent_count >= self.every
+            )
+            if not due:
+                return
+            self._last_sent_at = now
+            self._last_sent_count = current
+            self._pending = None
+        
+        self.send(current, total, current_track)
+    
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                self._last_sent_at = time.monotonic()
+                self._last_sent_count = pending[0]
+        
+        if pending is not None:
+            self.send(*pending)
+
+
+class PipelineMetrics:
+    """Per-stage timings and failure counters for the download pipeline.
+    
+    Every timed stage is logged as a JSON line and aggregated into a histogram;
+    render_prometheus() exposes the histograms and counters in Prometheus text
+    format.
+    """
+    
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    
+    COUNTER_HELP = {
+        'download_jobs_total': 'Download jobs finished, by status',
+        'download_track_failures_total': 'Track downloads that failed',
+        'download_track_timeouts_total': 'Track downloads abandoned after TRACK_TIMEOUT',
+        'download_cache_hits_total': 'Tracks served from the track cache',
+        'download_bytes_total': 'Bytes of audio downloaded from TIDAL',
+        'download_attempts_total': 'Track download attempts, by outcome',
+        'download_track_retries_total': 'Track download attempts that were retries',
+        'download_throttle_backoffs_total': 'Times the download throttle cut concurrency and rate',
+        'tidal_logins_total': 'TIDAL logins and token refreshes',
+        'handler_starts_total': 'Invocations by whether the process was cold or warm',
+        'download_preflight_skipped_total': 'Tracks skipped by preflight before downloading, by reason',
+        'analysis_failures_total': 'Tracks whose audio analysis failed',
+        'download_coalesced_total': 'Track fetches shared with another job fetching the same track',
+        'transcode_failures_total': 'Tracks that could not be transcoded to their output profile',
+        'job_dirs_expired_total': 'Work dirs of failed or abandoned jobs deleted after JOB_TTL_SECONDS',
+        'sync_manifests_expired_total': 'Sync manifests of finished jobs deleted after JOB_TTL_SECONDS',
+    }
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+    
+    def log(self, event: str, **fields):
+        """Emit one structured log line"""
+        print(json.dumps({'event': event, 'ts': round(time.time(), 3), **fields}, default=str))
+    
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                stage, {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0}
+            )
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+    
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    @contextmanager
+    def stage(self, stage: str, **fields):
+        """Time a pipeline stage. The yielded dict can be filled with extra log fields."""
+        started = time.monotonic()
+        status = 'ok'
+        try:
+            yield fields
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            seconds = time.monotonic() - started
+            if fields.get('bytes') and seconds > 0:
+                fields['bytes_per_second'] = round(fields['bytes'] / seconds)
+            self.observe(stage, seconds)
+            self.log('stage', stage=stage, status=status, seconds=round(seconds, 3), **fields)
+    
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            lines.append('# HELP download_stage_seconds Time spent in each download pipeline stage')
+            lines.append('# TYPE download_stage_seconds histogram')
+            for stage, histogram in sorted(self._histograms.items()):
+                for bound, count in zip(self.BUCKETS, histogram['buckets']):
+                    lines.append(f'download_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'download_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'download_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+                lines.append(f'download_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+            
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f'# HELP {name} {self.COUNTER_HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} counter')
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name != name:
+                        continue
+                    label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide metrics, served by DownloadHandler at /metrics
+METRICS = PipelineMetrics()
+
+
+class DownloadThrottle:
+    """Process-wide token bucket and adaptive concurrency limit for TIDAL downloads.
+    
+    Throttling or an error spike halves the limit and rate; a run of successes slowly restores them.
+    """
+    
+    THROTTLE_PATTERN = re.compile(r'\b429\b|too many requests|rate.?limit|throttl', re.IGNORECASE)
+    WINDOW = 20
+    ERROR_SPIKE = 0.5
+    RECOVERY_STREAK = 10
+    COOLDOWN = 5.0
+    
+    def __init__(self, rate: Optional[float] = None, max_concurrency: Optional[int] = None,
+                 metrics: Optional[PipelineMetrics] = None):
+        # Download attempts per second and in flight across every job in the process
+        self.max_rate = rate or float(os.getenv('TIDAL_RATE_LIMIT', '4'))
+        self.max_concurrency = max(1, max_concurrency or int(os.getenv('TIDAL_MAX_CONCURRENCY', '8')))
+        self.metrics = metrics or METRICS
+        self.rate = self.max_rate
+        self.limit = self.max_concurrency
+        self.burst = max(1.0, self.max_rate)
+        self.tokens = self.burst
+        self.active = 0
+        self.paused_until = 0.0
+        self._outcomes = deque(maxlen=self.WINDOW)  # True for a failed attempt
+        self._streak = 0
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    @contextmanager
+    def slot(self):
+        """Wait for a token and a free slot, holding the slot for one download attempt"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.active >= self.limit:
+                    wait = None
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    break
+                self._cond.wait(wait)
+            
+            self.tokens -= 1
+            self.active += 1
+        
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+    
+    def hold(self, running: Future):
+        """Keep a slot taken until `running` finishes, for an abandoned download still talking to TIDAL"""
+        with self._cond:
+            self.active += 1
+        
+        def release(_):
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+        
+        running.add_done_callback(release)
+    
+    def classify(self, detail: Optional[str]) -> str:
+        """'throttled' when OrpheusDL output shows TIDAL rate limiting, otherwise 'error'"""
+        return 'throttled' if self.THROTTLE_PATTERN.search(detail or '') else 'error'
+    
+    def record(self, success: bool, detail: Optional[str] = None) -> str:
+        """Feed back the outcome of one attempt; returns 'ok', 'throttled' or 'error'"""
+        outcome = 'ok' if success else self.classify(detail)
+        
+        with self._cond:
+            self._outcomes.append(not success)
+            if outcome == 'throttled':
+                self._back_off(outcome)
+            elif outcome == 'error':
+                self._streak = 0
+                errors = sum(self._outcomes)
+                if len(self._outcomes) >= self.WINDOW // 2 and errors / len(self._outcomes) >= self.ERROR_SPIKE:
+                    self._back_off('error_spike')
+            else:
+                self._streak += 1
+                if self._streak >= self.RECOVERY_STREAK:
+                    self._streak = 0
+                    self._recover()
+            self._cond.notify_all()
+        
+        self.metrics.increment('download_attempts_total', outcome=outcome)
+        return outcome
+    
+    def _back_off(self, reason: str):
+        now = time.monotonic()
+        # Concurrent failures from the same burst only count once
+        if now < self.paused_until:
+            return
+        
+        self.limit = max(1, self.limit // 2)
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+        self.paused_until = now + self.COOLDOWN
+        self._outcomes.clear()
+        self._streak = 0
+        self.metrics.increment('download_throttle_backoffs_total', reason=reason)
+        self.metrics.log('throttle', action='back_off', reason=reason, limit=self.limit, rate=round(self.rate, 3))
+    
+    def _recover(self):
+        if self.limit >= self.max_concurrency and self.rate >= self.max_rate:
+            return
+        
+        self.limit = min(self.max_concurrency, self.limit + 1)
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+        self.metrics.log('throttle', action='recover', limit=self.limit, rate=round(self.rate, 3))
+
+
+_throttle: Optional[DownloadThrottle] = None
+_throttle_lock = threading.Lock()
+
+
+def get_download_throttle() -> DownloadThrottle:
+    """Process-wide download throttle, shared by every job hitting the same TIDAL account"""
+    global _throttle
+    with _throttle_lock:
+        if _throttle is None:
+            _throttle = DownloadThrottle()
+        return _throttle
+
+
+# Tells callers waiting on a failed coalesced fetch to run their own
+_RETRY = object()
+
+
+class _Coalesced:
+    """A track being fetched for one job that other jobs are waiting on"""
+    
+    def __init__(self):
+        self.followers: List[Tuple[Callable, Future]] = []
+
+
+class TrackScheduler:
+    """Shares one pool of track workers fairly between the jobs running in the process.
+    
+    Each job queues its tracks under its own id. An idle worker takes the next
+    track round-robin across the jobs that are below their concurrency cap, so
+    a short playlist submitted behind a long one starts straight away rather
+    than waiting for it to finish, and its progress moves from the start.
+    SCHEDULER_WORKERS bounds the process as a whole. Tracks several jobs want
+    at the same moment are fetched once; see coalesce().
+    """
+    
+    def __init__(self, workers: Optional[int] = None, metrics: Optional[PipelineMetrics] = None):
+        self.workers = max(1, workers or int(os.getenv(
+            'SCHEDULER_WORKERS',
+            str(int(os.getenv('DOWNLOAD_CONCURRENCY', '4')) * int(os.getenv('WORKER_MAX_JOBS', '2')))
+        )))
+        self.metrics = metrics or METRICS
+        # job id -> queued (future, fn, args); iteration order is the round-robin order
+        self._queues: 'OrderedDict[str, deque]' = OrderedDict()
+        self._running: Dict[str, int] = {}
+        self._caps: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._inflight: Dict[str, _Coalesced] = {}
+        self._inflight_lock = threading.Lock()
+    
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"track-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def submit(self, job_id: str, fn: Callable, *args, limit: Optional[int] = None) -> Future:
+        """Queue fn(*args) for a job; at most `limit` of the job's tasks run at once"""
+        future = Future()
+        with self._cond:
+            self._start()
+            if limit is not None:
+                self._caps[job_id] = max(1, limit)
+            self._queues.setdefault(job_id, deque()).append((future, fn, args))
+            self._cond.notify()
+        return future
+    
+    def _next(self) -> Tuple[str, Future, Callable, tuple]:
+        """Next task in round-robin order among jobs under their cap; call with _cond held"""
+        while True:
+            for job_id, tasks in self._queues.items():
+                if tasks and self._running.get(job_id, 0) < self._caps.get(job_id, self.workers):
+                    future, fn, args = tasks.popleft()
+                    # The job goes to the back of the rotation
+                    self._queues.move_to_end(job_id)
+                    if not tasks:
+                        del self._queues[job_id]
+                    self._running[job_id] = self._running.get(job_id, 0) + 1
+                    return job_id, future, fn, args
+            self._cond.wait()
+    
+    def _finish(self, job_id: str):
+        with self._cond:
+            self._running[job_id] -= 1
+            if not self._running[job_id]:
+                del self._running[job_id]
+                if job_id not in self._queues:
+                    self._caps.pop(job_id, None)
+            self._cond.notify_all()
+    
+    def _work(self):
+        while True:
+            with self._cond:
+                job_id, future, fn, args = self._next()
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            finally:
+                self._finish(job_id)
+    
+    def coalesce(self, key: str, produce: Callable[[], object], adopt: Callable[[object], object]):
+        """Run produce() once for every caller asking for `key` at the same time.
+        
+        Callers that arrive while it runs get what their adopt() returns for its result.
+        """
+        with self._inflight_lock:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                inflight = self._inflight[key] = _Coalesced()
+                leader = True
+            else:
+                follower = Future()
+                inflight.followers.append((adopt, follower))
+                leader = False
+        
+        if not leader:
+            self.metrics.increment('download_coalesced_total')
+            result = follower.result()
+            if result is _RETRY:
+                return self.coalesce(key, produce, adopt)
+            return result
+        
+        result = error = None
+        try:
+            result = produce()
+        except BaseException as e:
+            error = e
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            for follower_adopt, follower in inflight.followers:
+                if error is not None:
+                    follower.set_result(_RETRY)
+                    continue
+                try:
+                    follower.set_result(follower_adopt(result))
+                except Exception as e:
+                    follower.set_exception(e)
+        
+        if error is not None:
+            raise error
+        return result
+
+
+_scheduler: Optional[TrackScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_track_scheduler() -> TrackScheduler:
+    """Process-wide track scheduler, shared by every job this process runs"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TrackScheduler()
+        return _scheduler
+
+
+class TidalCredentials:
+    """TIDAL login shared by every OrpheusDL download in the process.
+    
+    Username and password come from TIDAL_USERNAME / TIDAL_PASSWORD. When
+    TIDAL_REFRESH_TOKEN is set an access token is requested from TIDAL's OAuth
+    endpoint and refreshed shortly before it expires; password logins are
+    treated as valid for ORPHEUS_SESSION_TTL seconds. Every refresh bumps
+    `generation`, so sessions and config files built from an older login know
+    to re-authenticate instead of logging in again per track.
+    """
+    
+    TOKEN_URL = 'https://auth.tidal.com/v1/oauth2/token'
+    # Refresh this many seconds before the token actually expires
+    REFRESH_MARGIN = 60
+    
+    def __init__(self, username: Optional[str] = None, password: Optional[str] = None,
+                 refresh_token: Optional[str] = None, client_id: Optional[str] = None,
+                 session_ttl: Optional[float] = None, metrics: Optional[PipelineMetrics] = None):
+        self.username = username or os.getenv('TIDAL_USERNAME')
+        self.password = password or os.getenv('TIDAL_PASSWORD')
+        self.refresh_token = refresh_token or os.getenv('TIDAL_REFRESH_TOKEN')
+        self.client_id = client_id or os.getenv('TIDAL_CLIENT_ID')
+        self.session_ttl = session_ttl or float(os.getenv('ORPHEUS_SESSION_TTL', '3600'))
+        self.metrics = metrics or METRICS
+        self.access_token: Optional[str] = None
+        self.expires_at = 0.0
+        self.generation = 0
+        self._lock = threading.Lock()
+    
+    def _refresh(self):
+        if self.refresh_token:
+            with self.metrics.stage('tidal_token_refresh'):
+                response = requests.post(self.TOKEN_URL, data={
+                    'grant_type': 'refresh_token',
+                    'refresh_token': self.refresh_token,
+                    'client_id': self.client_id,
+                    'scope': 'r_usr w_usr',
+                }, timeout=10)
+                response.raise_for_status()
+            payload = response.json()
+            self.access_token = payload['access_token']
+            self.refresh_token = payload.get('refresh_token', self.refresh_token)
+            self.expires_at = time.time() + float(payload.get('expires_in', self.session_ttl))
+        else:
+            # OrpheusDL performs password logins itself; just bound how long they are reused
+            self.expires_at = time.time() + self.session_ttl
+        
+        self.generation += 1
+        self.metrics.increment('tidal_logins_total')
+    
+    def current(self) -> Tuple[int, Dict]:
+        """Generation and OrpheusDL module settings for a valid login, refreshing when due"""
+        with self._lock:
+            if time.time() >= self.expires_at - self.REFRESH_MARGIN:
+                self._refresh()
+            
+            settings = {
+                'username': self.username,
+                'password': self.password,
+                'access_token': self.access_token,
+                'refresh_token': self.refresh_token,
+            }
+            if self.access_token:
+                settings['expires'] = int(self.expires_at)
+            return self.generation, {key: value for key, value in settings.items() if value}
+    
+    def invalidate(self):
+        """Force a fresh login on next use, e.g. after TIDAL rejected the token"""
+        with self._lock:
+            self.expires_at = 0.0
+
+
+_credentials: Optional[TidalCredentials] = None
+_credentials_lock = threading.Lock()
+
+
+def get_tidal_credentials() -> TidalCredentials:
+    """Process-wide TIDAL credentials, so warm invocations reuse the login"""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials = TidalCredentials()
+        return _credentials
+
+
+class OrpheusConfigFile:
+    """OrpheusDL command line config shared by every subprocess download.
+    
+    The file is written once per quality and login generation and replaced
+    atomically when the login is refreshed. Output goes to the subprocess's
+    working directory, so the same file serves any number of concurrent tracks.
+    """
+    
+    def __init__(self, config_dir: str, quality: str, module: str = 'tidal',
+                 credentials: Optional[TidalCredentials] = None):
+        self.config_dir = config_dir
+        self.quality = quality
+        self.module = module
+        self.credentials = credentials or get_tidal_credentials()
+        self._path: Optional[str] = None
+        self._generation = None
+        self._lock = threading.Lock()
+    
+    def path(self) -> str:
+        """Path of an up to date config file, (re)writing it when the login changed"""
+        generation, settings = self.credentials.current()
+        
+        with self._lock:
+            if self._path is not None and self._generation == generation and os.path.exists(self._path):
+                return self._path
+            
+            config = {
+                "global": {
+                    "module": self.module,
+                    "quality": self.quality,
+                    "output": ".",
+                    "filename": "{artist} - {title}.{ext}"
+                },
+                self.module: settings
+            }
+            
+            os.makedirs(self.config_dir, exist_ok=True)
+            path = os.path.join(self.config_dir, f'orpheus-config-{self.module}-{self.quality}.json')
+            temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(config, f)
+            # Holds credentials, so keep it private to this user
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, path)
+            
+            self._path = path
+            self._generation = generation
+            return path
+
+
+class OrpheusSessionError(Exception):
+    """Raised when an in-process OrpheusDL session can't be created or logged in"""
+
+
+class OrpheusSessionTimeout(OrpheusSessionError):
+    """Raised when an in-process download outlives its timeout and is abandoned"""
+    
+    def __init__(self, message: str, running: Future):
+        super().__init__(message)
+        # Finishes when the abandoned download finally returns
+        self.running = running
+
+
+class OrpheusSessionPool:
+    """In-process OrpheusDL sessions shared by download workers across jobs.
+    
+    OrpheusDL is imported once and the first session performs the TIDAL login.
+    Further sessions are only created when several workers need one at the same
+    time, and they are handed back to the pool after every track. Sessions are
+    retired once the shared credentials are refreshed, so the next checkout logs
+    in with the new token.
+    """
+    
+    def __init__(self, module: str = 'tidal', quality: str = 'hifi', metrics: Optional[PipelineMetrics] = None,
+                 credentials: Optional[TidalCredentials] = None):
+        self.metrics = metrics or METRICS
+        # Raises ImportError when OrpheusDL isn't importable in this interpreter
+        with self.metrics.stage('orpheus_import'):
+            import orpheus.core
+        self._core = orpheus.core
+        self.module = module
+        self.quality = quality
+        self.credentials = credentials or get_tidal_credentials()
+        self.failed = False
+        self._idle = []  # (generation, session)
+        self._lock = threading.Lock()
+        self._login_lock = threading.Lock()
+    
+    def _create_session(self, settings: Dict):
+        """Create an OrpheusDL instance and log in to the download module"""
+        try:
+            orpheus = self._core.Orpheus()
+            orpheus.settings['global']['general']['download_quality'] = self.quality
+            
+            module_settings = orpheus.settings.setdefault('modules', {}).setdefault(self.module, {})
+            module_settings.update(settings)
+            
+            # Loading the module is what performs the login
+            with self.metrics.stage('orpheus_login', module=self.module):
+                orpheus.load_module(self.module)
+            return orpheus
+        except Exception as e:
+            self.failed = True
+            raise OrpheusSessionError(str(e)) from e
+    
+    @contextmanager
+    def session(self):
+        """Check out a logged-in session for the duration of one download"""
+        try:
+            generation, settings = self.credentials.current()
+        except Exception as e:
+            raise OrpheusSessionError(f"TIDAL login refresh failed: {e}") from e
+        
+        orpheus = None
+        with self._lock:
+            # Sessions from an older login are dropped rather than reused
+            self._idle = [(gen, idle) for gen, idle in self._idle if gen == generation]
+            if self._idle:
+                orpheus = self._idle.pop()[1]
+        
+        if orpheus is None:
+            # Serialise logins so later sessions can reuse OrpheusDL's stored login
+            with self._login_lock:
+                # A login that finished while we waited (e.g. the prewarm) can be used straight away
+                with self._lock:
+                    if self._idle and self._idle[-1][0] == generation:
+                        orpheus = self._idle.pop()[1]
+                if orpheus is None:
+                    orpheus = self._create_session(settings)
+        
+        abandoned = False
+        try:
+            yield orpheus
+        except OrpheusSessionTimeout:
+            # Still busy with the abandoned download, so it's never handed out again
+            abandoned = True
+            raise
+        finally:
+            if not abandoned:
+                with self._lock:
+                    self._idle.append((generation, orpheus))
+    
+    def warm(self):
+        """Log in one session ahead of the first download"""
+        with self.session():
+            pass
+    
+    def download(self, tidal_track: Dict, download_dir: str, timeout: Optional[float] = None) -> bool:
+        """Download a single TIDAL track into download_dir.
+        
+        With a timeout, the download runs on its own thread into a private temp dir,
+        and is abandoned along with its session when it overruns.
+        """
+        track_id = str(tidal_track.get('id') or tidal_track['url'].rstrip('/').split('/')[-1])
+        
+        with self.session() as orpheus:
+            media = self._core.MediaIdentification(
+                media_type=self._core.DownloadTypeEnum.track,
+                media_id=track_id
+            )
+            if timeout is None:
+                self._core.orpheus_core_download(orpheus, {self.module: [media]}, {}, {}, download_dir)
+                return True
+            
+            # Outside the job dir, so a late write from an abandoned download can't end up in it
+            target_dir = tempfile.mkdtemp(prefix='orpheus-session-')
+            abandoned = threading.Event()
+            outcome = Future()
+            
+            def run():
+                try:
+                    self._core.orpheus_core_download(orpheus, {self.module: [media]}, {}, {}, target_dir)
+                    outcome.set_result(True)
+                except BaseException as e:
+                    outcome.set_exception(e)
+                finally:
+                    if abandoned.is_set():
+                        shutil.rmtree(target_dir, ignore_errors=True)
+            
+            threading.Thread(target=run, name=f'orpheus-download-{track_id}', daemon=True).start()
+            try:
+                outcome.result(timeout)
+            except FutureTimeoutError:
+                abandoned.set()
+                shutil.rmtree(target_dir, ignore_errors=True)
+                raise OrpheusSessionTimeout(f"Download of track {track_id} timed out after {timeout}s", outcome)
+            except BaseException:
+                shutil.rmtree(target_dir, ignore_errors=True)
+                raise
+            
+            for entry in os.listdir(target_dir):
+                shutil.move(os.path.join(target_dir, entry), os.path.join(download_dir, entry))
+            os.rmdir(target_dir)
+        
+        return True
+    
+    def close(self):
+        """Drop all idle sessions"""
+        with self._lock:
+            self._idle.clear()
+
+
+_session_pools: Dict[Tuple[str, str], OrpheusSessionPool] = {}
+_session_pools_lock = threading.Lock()
+
+
+def get_session_pool(module: str = 'tidal', quality: str = 'hifi',
+                     metrics: Optional[PipelineMetrics] = None) -> OrpheusSessionPool:
+    """Process-wide session pool per module and quality, replaced after a failed login"""
+    with _session_pools_lock:
+        pool = _session_pools.get((module, quality))
+        if pool is None or pool.failed:
+            pool = OrpheusSessionPool(module=module, quality=quality, metrics=metrics)
+            _session_pools[(module, quality)] = pool
+        return pool
+
+
+def tree_size(path: str) -> int:
+    """Total size of the files under path"""
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, dirs, files in os.walk(path)
+        for file in files
+    )
+
+
+class TrackCache:
+    """On-disk cache of downloaded track files keyed by TIDAL id / ISRC and quality.
+    
+    Each entry is a directory holding the files OrpheusDL produced for one track.
+    Entries are built in a staging directory and renamed into place, so readers
+    never see a half-written entry. Once the cache grows past max_bytes the least
+    recently used entries are evicted.
+    """
+    
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir or os.getenv(
+            'TRACK_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'track-cache')
+        )
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.getenv('TRACK_CACHE_MAX_BYTES', str(self._default_max_bytes(self.cache_dir)))
+        )
+        self._index: Optional[OrderedDict] = None  # key -> entry size, oldest first
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _default_max_bytes(cache_dir: str) -> int:
+        """A quarter of the cache's filesystem, up to 2 GiB, leaving job files the rest of a small /tmp"""
+        path = cache_dir
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        try:
+            total = shutil.disk_usage(path).total
+        except OSError:
+            return 256 * 1024 ** 2
+        return min(2 * 1024 ** 3, total // 4)
+    
+    @classmethod
+    def from_env(cls) -> Optional['TrackCache']:
+        """Cache configured from the environment, or None when disabled with a zero size cap"""
+        cache = cls()
+        return cache if cache.max_bytes > 0 else None
+    
+    @staticmethod
+    def key(tidal_track: Dict, isrc: Optional[str], quality: str) -> Optional[str]:
+        """Cache key for a track, preferring the TIDAL id over the ISRC"""
+        if tidal_track.get('id'):
+            raw_key = f"tidal-{tidal_track['id']}-{quality}"
+        elif isrc or tidal_track.get('isrc'):
+            raw_key = f"isrc-{isrc or tidal_track['isrc']}-{quality}"
+        else:
+            return None
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', raw_key)
+    
+    @staticmethod
+    def _link_or_copy(src: str, dst: str):
+        """Hardlink src to dst, copying when linking isn't possible (e.g. across filesystems)"""
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    
+    @classmethod
+    def link_tree(cls, source_dir: str, dest_dir: str):
+        """Link (or copy) every file under source_dir to the same relative path under dest_dir"""
+        for root, dirs, files in os.walk(source_dir):
+            target_root = os.path.join(dest_dir, os.path.relpath(root, source_dir))
+            os.makedirs(target_root, exist_ok=True)
+            for file in files:
+                cls._link_or_copy(os.path.join(root, file), os.path.join(target_root, file))
+    
+    def _load_index(self) -> OrderedDict:
+        """Build the LRU index from the entries on disk, ordered by last use"""
+        if self._index is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                entry_dir = os.path.join(self.cache_dir, name)
+                if name.startswith('.') or not os.path.isdir(entry_dir):
+                    continue
+                entries.append((os.path.getmtime(entry_dir), name, tree_size(entry_dir)))
+            self._index = OrderedDict((name, size) for _, name, size in sorted(entries))
+        return self._index
+    
+    def warm(self):
+        """Build the LRU index ahead of the first lookup"""
+        with self._lock:
+            self._load_index()
+    
+    def contains(self, key: str) -> bool:
+        """Whether key has an entry, without counting as a use"""
+        with self._lock:
+            return key in self._load_index()
+    
+    def fetch(self, key: str, dest_dir: str) -> bool:
+        """Link a cached entry's files into dest_dir. Returns False on a cache miss."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        
+        with self._lock:
+            index = self._load_index()
+            if key not in index or not os.path.isdir(entry_dir):
+                index.pop(key, None)
+                return False
+            index.move_to_end(key)
+            os.utime(entry_dir)
+        
+        try:
+            self.link_tree(entry_dir, dest_dir)
+            return True
+        except OSError as e:
+            # Entry evicted underneath us; treat as a miss
+            print(f"Track cache read failed for {key}: {e}")
+            return False
+    
+    def insert(self, key: str, source_dir: str):
+        """Atomically add the files in source_dir as the entry for key"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        staging_dir = os.path.join(self.cache_dir, f'.tmp-{uuid.uuid4().hex}')
+        entry_dir = os.path.join(self.cache_dir, key)
+        
+        try:
+            self.link_tree(source_dir, staging_dir)
+            
+            size = tree_size(staging_dir)
+            
+            with self._lock:
+                index = self._load_index()
+                try:
+                    os.rename(staging_dir, entry_dir)
+                except OSError:
+                    # Another worker cached this track first
+                    return
+                index[key] = size
+                index.move_to_end(key)
+                self._evict(index)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    def _evict(self, index: OrderedDict):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        total = sum(index.values())
+        while total > self.max_bytes and len(index) > 1:
+            key, size = index.popitem(last=False)
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= size
+            print(f"Evicted {key} from track cache")
+    
+    def shrink(self, nbytes: int) -> int:
+        """Evict least recently used entries totalling at least nbytes, returning how much went.
+        
+        Entries whose files are still linked into a job dir free less than their size.
+        """
+        freed = 0
+        with self._lock:
+            index = self._load_index()
+            while freed < nbytes and index:
+                key, size = index.popitem(last=False)
+                shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+                freed += size
+                print(f"Evicted {key} from track cache to free disk space")
+        return freed
+
+
+class PlaylistTrack(Mapping):
+    """Compact record of a playlist track, keeping only what the pipeline reads.
+    
+    An enhanced playlist item carries full Spotify track objects and TIDAL
+    album and cover payloads; holding that tree for the whole job costs several
+    kilobytes per track. A record keeps the handful of fields the download
+    pipeline needs in slots, and still reads like the item's 'track' mapping
+    ('tidal', 'spotify', 'isrc', 'matchStatus'), building those small views on
+    access.
+    """
+    
+    __slots__ = ('tidal_id', 'url', 'isrc', 'artist', 'title', 'duration', 'match_status',
+                 'audio_quality', 'allow_streaming', 'stream_ready', 'replay_gain', 'peak')
+    
+    def __init__(self, tidal_id: Optional[str] = None, url: Optional[str] = None, isrc: Optional[str] = None,
+                 artist: Optional[str] = None, title: Optional[str] = None, duration: Optional[float] = None,
+                 match_status: Optional[str] = None, audio_quality: Optional[str] = None,
+                 allow_streaming: Optional[bool] = None, stream_ready: Optional[bool] = None,
+                 replay_gain: Optional[float] = None, peak: Optional[float] = None):
+        self.tidal_id = tidal_id
+        self.url = url
+        self.isrc = isrc
+        self.artist = artist
+        self.title = title
+        self.duration = duration
+        # Repeated across every track, so share one string per value
+        self.match_status = sys.intern(match_status) if match_status else None
+        self.audio_quality = sys.intern(audio_quality) if audio_quality else None
+        self.allow_streaming = allow_streaming
+        self.stream_ready = stream_ready
+        self.replay_gain = replay_gain
+        self.peak = peak
+    
+    @classmethod
+    def from_track(cls, track: Dict) -> 'PlaylistTrack':
+        """Record for the 'track' of an enhanced playlist item"""
+        spotify_track = track.get('spotify') or {}
+        tidal_track = track.get('tidal') or {}
+        artists = spotify_track.get('artists') or []
+        duration = tidal_track.get('duration')
+        if duration is None and spotify_track.get('duration_ms') is not None:
+            duration = spotify_track['duration_ms'] / 1000
+        return cls(
+            tidal_id=str(tidal_track['id']) if tidal_track.get('id') else None,
+            url=tidal_track.get('url'),
+            isrc=track.get('isrc') or tidal_track.get('isrc'),
+            artist=artists[0].get('name') if artists else None,
+            title=spotify_track.get('name') or tidal_track.get('title'),
+            duration=duration,
+            match_status=track.get('matchStatus'),
+            audio_quality=tidal_track.get('audioQuality'),
+            allow_streaming=tidal_track.get('allowStreaming'),
+            stream_ready=tidal_track.get('streamReady'),
+            replay_gain=tidal_track.get('replayGain'),
+            peak=tidal_track.get('peak'),
+        )
+    
+    def _tidal(self) -> Optional[Dict]:
+        if not self.tidal_id and not self.url:
+            return None
+        fields = {
+            'id': self.tidal_id,
+            'url': self.url,
+            'isrc': self.isrc,
+            'duration': self.duration,
+            'audioQuality': self.audio_quality,
+            'allowStreaming': self.allow_streaming,
+            'streamReady': self.stream_ready,
+            'replayGain': self.replay_gain,
+            'peak': self.peak,
+        }
+        return {key: value for key, value in fields.items() if value is not None}
+    
+    def _spotify(self) -> Optional[Dict]:
+        if self.title is None and self.artist is None:
+            return None
+        return {'name': self.title, 'artists': [{'name': self.artist}] if self.artist else []}
+    
+    _VIEWS = {
+        'tidal': _tidal,
+        'spotify': _spotify,
+        'isrc': lambda self: self.isrc,
+        'matchStatus': lambda self: self.match_status,
+    }
+    
+    def __getitem__(self, key: str):
+        view = self._VIEWS.get(key)
+        value = view(self) if view is not None else None
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def __iter__(self):
+        return (key for key, view in self._VIEWS.items() if view(self) is not None)
+    
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class _JSONStream:
+    """Pulls JSON values one at a time off a stream of text chunks.
+    
+    Only the value being decoded is buffered, so a large document can be walked
+    without holding all of it in memory.
+    """
+    
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+    
+    def _fill(self) -> bool:
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer = self._buffer[self._pos:] + chunk
+                self._pos = 0
+                return True
+        self._eof = True
+        return False
+    
+    def peek(self) -> str:
+        """Next non-whitespace character, or '' at the end of the stream"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return self._buffer[self._pos:self._pos + 1]
+    
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in JSON stream, found {found!r}")
+        self._pos += 1
+    
+    def skip_comma(self):
+        if self.peek() == ',':
+            self._pos += 1
+    
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number ending the buffer may continue in the next chunk
+            if end == len(self._buffer) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def read_playlist(chunks: Iterable[str]) -> Dict:
+    """Parse an enhanced playlist from a stream of JSON text chunks.
+    
+    Items under tracks.items are decoded one at a time and reduced to
+    PlaylistTrack records as they arrive; every other field is kept as is.
+    """
+    stream = _JSONStream(chunks)
+    
+    def read_object(on_key: Callable[[str], object]) -> Dict:
+        result = {}
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.value()
+            stream.expect(':')
+            result[key] = on_key(key)
+            stream.skip_comma()
+        stream.expect('}')
+        return result
+    
+    def read_items() -> List[Dict]:
+        items = []
+        stream.expect('[')
+        while stream.peek() != ']':
+            item = stream.value()
+            items.append({'track': PlaylistTrack.from_track(item.get('track') or {})})
+            stream.skip_comma()
+        stream.expect(']')
+        return items
+    
+    def read_tracks_field(key: str):
+        return read_items() if key == 'items' and stream.peek() == '[' else stream.value()
+    
+    def read_playlist_field(key: str):
+        if key == 'tracks' and stream.peek() == '{':
+            return read_object(read_tracks_field)
+        return stream.value()
+    
+    return read_object(read_playlist_field)
+
+
+def track_key(track: Dict) -> str:
+    """Stable identity of a track across jobs: TIDAL id, then ISRC, then TIDAL URL"""
+    tidal_track = track.get('tidal') or {}
+    if tidal_track.get('id'):
+        return f"tidal:{tidal_track['id']}"
+    isrc = track.get('isrc') or tidal_track.get('isrc')
+    if isrc:
+        return f"isrc:{isrc}"
+    return f"url:{tidal_track.get('url')}"
+
+
+def diff_tracks(tracks: List[Dict], previous: Dict) -> Tuple[List[Dict], Dict[str, Dict], List[str]]:
+    """Diff playlist items against a previous job's sync manifest by TIDAL id, then ISRC.
+    
+    Returns the items that are new, the previous entries of retained items keyed
+    by their current track_key, and the names of tracks that were dropped.
+    """
+    previous_tracks = previous.get('tracks', {})
+    by_id, by_isrc = {}, {}
+    for key, entry in previous_tracks.items():
+        if entry.get('tidalId'):
+            by_id[str(entry['tidalId'])] = key
+        if entry.get('isrc'):
+            by_isrc[entry['isrc']] = key
+    
+    added, retained, matched = [], {}, set()
+    for item in tracks:
+        track = item['track']
+        tidal_track = track.get('tidal') or {}
+        isrc = track.get('isrc') or tidal_track.get('isrc')
+        
+        previous_key = by_id.get(str(tidal_track['id'])) if tidal_track.get('id') else None
+        if previous_key is None and isrc:
+            previous_key = by_isrc.get(isrc)
+        
+        # A duplicate in the new playlist counts as added, so it isn't matched twice
+        if previous_key is None or previous_key in matched:
+            added.append(item)
+        else:
+            matched.add(previous_key)
+            retained[track_key(track)] = previous_tracks[previous_key]
+    
+    removed = [entry['name'] for key, entry in previous_tracks.items() if key not in matched]
+    return added, retained, removed
+
+
+class SyncPlan:
+    """How a sync job relates to the job it syncs from.
+    
+    In 'delta' mode only the added tracks are downloaded and archived; in 'full'
+    mode every track is archived. The previous job's files are deleted when it
+    completes, so retained tracks come from the track cache, and any it has
+    since evicted are downloaded again; `cached` counts the ones it still held.
+    """
+    
+    MODES = ('delta', 'full')
+    
+    def __init__(self, previous_job: Optional[str], mode: str, added: List[Dict], retained: Dict[str, Dict],
+                 removed: List[str]):
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid sync mode: {mode}")
+        self.previous_job = previous_job
+        self.mode = mode
+        self.added = added
+        self.retained = retained
+        self.removed = removed
+        self.cached: Optional[int] = None
+    
+    def summary(self) -> Dict:
+        """Sync details reported with the job's completion"""
+        summary = {
+            'from': self.previous_job,
+            'mode': self.mode,
+            'added': len(self.added),
+            'retained': len(self.retained),
+            'removed': self.removed
+        }
+        if self.cached is not None:
+            summary['cached'] = self.cached
+        return summary
+
+
+class PreflightReport:
+    """Outcome of checking a batch of tracks before downloading them.
+    
+    `order` lists the indexes of tracks worth downloading, longest first, and
+    `skipped` maps the index of every doomed track to the reason it was skipped.
+    """
+    
+    def __init__(self, order: List[int], skipped: Dict[int, str], estimated_bytes: int, estimated_seconds: float):
+        self.order = order
+        self.skipped = skipped
+        self.estimated_bytes = estimated_bytes
+        self.estimated_seconds = estimated_seconds
+    
+    def summary(self) -> Dict:
+        """Estimate reported with the job's first progress update"""
+        return {
+            'tracks': len(self.order),
+            'skipped': len(self.skipped),
+            'bytes': self.estimated_bytes,
+            'seconds': round(self.estimated_seconds)
+        }
+
+
+class TrackPreflight:
+    """Skips tracks TIDAL won't serve before any download starts, and orders the rest longest first.
+    
+    Tracks are probed against TIDAL's track endpoint when TIDAL_REFRESH_TOKEN is set.
+    """
+    
+    PROBE_URL = 'https://api.tidal.com/v1/tracks/{id}'
+    
+    # Typical bitrate (bits per second) of each TIDAL audioQuality, for size estimates
+    BITRATES = {
+        'LOW': 96_000,
+        'HIGH': 320_000,
+        'LOSSLESS': 1_000_000,
+        'HI_RES': 2_500_000,
+        'HI_RES_LOSSLESS': 2_500_000,
+    }
+    # Best audioQuality each OrpheusDL quality setting downloads
+    QUALITY_CEILING = {
+        'minimum': 'LOW',
+        'low': 'LOW',
+        'medium': 'HIGH',
+        'high': 'HIGH',
+        'lossless': 'LOSSLESS',
+        'hifi': 'HI_RES_LOSSLESS',
+    }
+    QUALITY_RANK = ['LOW', 'HIGH', 'LOSSLESS', 'HI_RES', 'HI_RES_LOSSLESS']
+    
+    def __init__(self, quality: str = 'hifi', workers: Optional[int] = None, probe: Optional[bool] = None,
+                 bandwidth: Optional[float] = None, track_overhead: Optional[float] = None,
+                 credentials: Optional[TidalCredentials] = None, country_code: Optional[str] = None):
+        self.quality = quality
+        self.workers = max(1, workers or int(os.getenv('PREFLIGHT_CONCURRENCY', '16')))
+        self.probe = probe if probe is not None else os.getenv('PREFLIGHT_PROBE', '1').lower() in ('1', 'true', 'yes')
+        # Expected download speed per worker (bytes/s) and fixed cost per track, for time estimates
+        self.bandwidth = bandwidth or float(os.getenv('PREFLIGHT_BANDWIDTH', str(4 * 1024 * 1024)))
+        self.track_overhead = track_overhead if track_overhead is not None else float(
+            os.getenv('PREFLIGHT_TRACK_OVERHEAD', '2')
+        )
+        self.credentials = credentials
+        self.country_code = country_code or os.getenv('TIDAL_COUNTRY_CODE', 'US')
+    
+    @staticmethod
+    def duration(track: Dict) -> float:
+        """Track length in seconds from the TIDAL payload, falling back to Spotify's"""
+        tidal_track = track.get('tidal') or {}
+        if tidal_track.get('duration'):
+            return float(tidal_track['duration'])
+        spotify_track = track.get('spotify') or {}
+        return float(spotify_track.get('duration_ms') or 0) / 1000
+    
+    def estimate_bytes(self, track: Dict) -> int:
+        ceiling = self.QUALITY_CEILING.get(self.quality, 'HI_RES_LOSSLESS')
+        available = (track.get('tidal') or {}).get('audioQuality') or ceiling
+        ranks = [self.QUALITY_RANK.index(q) if q in self.QUALITY_RANK else len(self.QUALITY_RANK) - 1
+                 for q in (ceiling, available)]
+        bitrate = self.BITRATES[self.QUALITY_RANK[min(ranks)]]
+        return int(self.duration(track) * bitrate / 8)
+    
+    @staticmethod
+    def static_check(tidal_track: Dict) -> Optional[str]:
+        """Reason the matched payload rules the track out, or None"""
+        if not tidal_track.get('url') and not tidal_track.get('id'):
+            return 'no TIDAL match'
+        if tidal_track.get('allowStreaming') is False:
+            return 'not streamable on TIDAL'
+        if tidal_track.get('streamReady') is False:
+            return 'not stream ready on TIDAL'
+        return None
+    
+    def _access_token(self) -> Optional[str]:
+        credentials = self.credentials or get_tidal_credentials()
+        if not credentials.refresh_token:
+            return None
+        _, settings = credentials.current()
+        return settings.get('access_token')
+    
+    def probe_track(self, session: requests.Session, tidal_track: Dict, token: str) -> Optional[str]:
+        """Reason TIDAL currently refuses the track, or None when it's available or the probe is inconclusive"""
+        track_id = tidal_track.get('id')
+        if not track_id:
+            return None
+        try:
+            response = session.get(
+                self.PROBE_URL.format(id=track_id),
+                params={'countryCode': self.country_code},
+                headers={'Authorization': f'Bearer {token}'},
+                timeout=5
+            )
+        except requests.RequestException:
+            return None
+        if response.status_code == 404:
+            return 'no longer available on TIDAL'
+        if response.status_code != 200:
+            return None
+        try:
+            return self.static_check({**tidal_track, **response.json()})
+        except ValueError:
+            return None
+    
+    def run(self, tracks: List[Dict]) -> PreflightReport:
+        """Check track items ({'track': {...}}) and plan their download order"""
+        skipped: Dict[int, str] = {}
+        candidates = []
+        for i, item in enumerate(tracks):
+            reason = self.static_check(item['track'].get('tidal') or {})
+            if reason:
+                skipped[i] = reason
+            else:
+                candidates.append(i)
+        
+        token = self._access_token() if self.probe and candidates else None
+        if token:
+            with requests.Session() as session, ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {
+                    executor.submit(self.probe_track, session, tracks[i]['track']['tidal'], token): i
+                    for i in candidates
+                }
+                for future in as_completed(futures):
+                    reason = future.result()
+                    if reason:
+                        skipped[futures[future]] = reason
+            candidates = [i for i in candidates if i not in skipped]
+        
+        order = sorted(candidates, key=lambda i: self.duration(tracks[i]['track']), reverse=True)
+        estimated_bytes = sum(self.estimate_bytes(tracks[i]['track']) for i in order)
+        estimated_seconds = estimated_bytes / self.bandwidth + self.track_overhead * len(order)
+        return PreflightReport(order, skipped, estimated_bytes, estimated_seconds)
+
+
+def encode_continuation(job_id: str, start: int, end: int) -> str:
+    """Opaque token telling a follow-up invocation which tracks are left to process"""
+    payload = json.dumps({'jobId': job_id, 'start': start, 'end': end}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_continuation(token: str) -> Tuple[str, int, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return payload['jobId'], int(payload['start']), int(payload['end'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid continuation token: {e}") from e
+
+
+class JobManifest:
+    """Durable record of the tracks a job has finished, used to resume it.
+    
+    Lives as manifest.json in the job's work dir. Each update re-reads the file
+    under an exclusive file lock and atomically replaces it, so several
+    invocations working on the same job don't lose each other's progress.
+    """
+    
+    def __init__(self, job_dir: str):
+        self.job_dir = job_dir
+        self.path = os.path.join(job_dir, 'manifest.json')
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.job_dir, exist_ok=True)
+        with self._lock, open(f"{self.path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _read(self) -> Dict:
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {}
+        manifest.setdefault('tracks', {})
+        manifest.setdefault('failed', {})
+        return manifest
+    
+    def _write(self, manifest: Dict):
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+    
+    def load(self) -> Dict:
+        with self._locked():
+            return self._read()
+    
+    def record_track(self, key: str, track_name: str, base_dir: str, files: List[str]):
+        """Record a finished track and its files (relative to base_dir)"""
+        entry = {
+            'name': track_name,
+            'files': [
+                {'path': file, 'size': os.path.getsize(os.path.join(base_dir, file))}
+                for file in files
+            ]
+        }
+        
+        with self._locked():
+            manifest = self._read()
+            manifest['tracks'][key] = entry
+            manifest['failed'].pop(key, None)
+            self._write(manifest)
+    
+    def record_failure(self, key: str, track_name: str):
+        """Record a track that couldn't be downloaded, so chunked runs don't retry it forever"""
+        with self._locked():
+            manifest = self._read()
+            manifest['failed'][key] = track_name
+            self._write(manifest)
+    
+    def failed_keys(self) -> set:
+        return set(self.load()['failed'])
+    
+    def claim_finalize(self) -> bool:
+        """Claim the right to assemble the job's archive; only the first caller gets it"""
+        try:
+            os.makedirs(self.job_dir, exist_ok=True)
+            os.mkdir(os.path.join(self.job_dir, '.finalizing'))
+            return True
+        except FileExistsError:
+            return False
+    
+    def completed_tracks(self, base_dir: str) -> Dict[str, List[str]]:
+        """Finished tracks whose files are still on disk, as key -> relative file paths"""
+        completed = {}
+        for key, entry in self.load()['tracks'].items():
+            files = entry['files']
+            if all(
+                os.path.isfile(os.path.join(base_dir, f['path']))
+                and os.path.getsize(os.path.join(base_dir, f['path'])) == f['size']
+                for f in files
+            ):
+                completed[key] = [f['path'] for f in files]
+        return completed
+
+
+class DiskBudgetExceeded(Exception):
+    """Raised when a job can't stay within its disk budget or the disk is nearly full"""
+
+
+class DiskBudget:
+    """Keeps a job's work dir under max_bytes and the disk above min_free_bytes.
+    
+    reserve() is held around every download. It checks the work dir's current
+    size plus an estimate for each download in flight, the estimate being the
+    largest track seen so far. When there isn't room it waits up to `wait`
+    seconds for packed tracks to be deleted, then raises DiskBudgetExceeded so
+    the job fails with a clear error instead of ENOSPC part way through a write.
+    A track cache on the same disk gives up its least recently used entries
+    before the disk counts as full.
+    """
+    
+    def __init__(self, path: str, max_bytes: Optional[int] = None, min_free_bytes: Optional[int] = None,
+                 track_estimate: Optional[int] = None, wait: Optional[float] = None,
+                 cache: Optional[TrackCache] = None):
+        self.path = path
+        self.cache = cache
+        # 0 leaves the work dir unbounded; free space is still checked
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('DISK_BUDGET_BYTES', '0'))
+        self.min_free_bytes = min_free_bytes if min_free_bytes is not None else int(
+            os.getenv('DISK_MIN_FREE_BYTES', str(64 * 1024 ** 2))
+        )
+        self.track_estimate = track_estimate or int(os.getenv('DISK_TRACK_ESTIMATE_BYTES', str(64 * 1024 ** 2)))
+        self.wait = wait if wait is not None else float(os.getenv('DISK_WAIT_SECONDS', '30'))
+        self.exhausted: Optional[str] = None
+        self._observed = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+    
+    @property
+    def limited(self) -> bool:
+        return self.max_bytes > 0
+    
+    def _shortfall(self, needed: int) -> Optional[str]:
+        """Why `needed` more bytes don't fit, or None when they do"""
+        if self.max_bytes:
+            used = tree_size(self.path)
+            if used + needed > self.max_bytes:
+                return f"Disk budget exceeded: {used + needed} bytes needed, budget is {self.max_bytes}"
+        
+        free = shutil.disk_usage(self.path).free
+        if free - needed < self.min_free_bytes and self._shares_disk_with_cache():
+            if self.cache.shrink(needed + self.min_free_bytes - free):
+                free = shutil.disk_usage(self.path).free
+        if free - needed < self.min_free_bytes:
+            return f"Not enough free disk space: {free} bytes free, {needed + self.min_free_bytes} needed"
+        return None
+    
+    def _shares_disk_with_cache(self) -> bool:
+        if self.cache is None:
+            return False
+        try:
+            return os.stat(self.cache.cache_dir).st_dev == os.stat(self.path).st_dev
+        except OSError:
+            return False
+    
+    def ensure_room(self, needed: int):
+        """Raise DiskBudgetExceeded straight away unless `needed` bytes fit"""
+        shortfall = self._shortfall(needed)
+        if shortfall:
+            raise DiskBudgetExceeded(shortfall)
+    
+    @contextmanager
+    def reserve(self):
+        """Hold room for one track download, waiting for space to be freed if needed"""
+        deadline = time.monotonic() + self.wait
+        with self._cond:
+            while True:
+                if self.exhausted:
+                    raise DiskBudgetExceeded(self.exhausted)
+                
+                estimate = self._observed or self.track_estimate
+                shortfall = self._shortfall((self._in_flight + 1) * estimate)
+                if shortfall is None:
+                    break
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Every other waiting download would hit the same wall
+                    self.exhausted = shortfall
+                    self._cond.notify_all()
+                    raise DiskBudgetExceeded(shortfall)
+                # Space can also be freed outside this budget, so poll as well as wait
+                self._cond.wait(min(remaining, 1.0))
+            
+            self._in_flight += 1
+        
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+    
+    def record_track(self, size: int):
+        """Learn from a finished download how much room the next ones need"""
+        with self._cond:
+            self._observed = max(self._observed, size)
+    
+    def released(self):
+        """Wake downloads waiting for room after files were deleted"""
+        with self._cond:
+            self._cond.notify_all()
+
+
+# Analysis results shipped in the archive, unlike the other JSON files in a tracks dir
+ANALYSIS_MANIFEST = 'analysis.json'
+
+
+def is_config_file(name: str) -> bool:
+    """Whether a file in a tracks dir is config (e.g. OrpheusDL's) that stays out of the archive"""
+    return name.endswith('.json') and name != ANALYSIS_MANIFEST
+
+
+# Formats that are already compressed; deflating them costs CPU for next to no gain
+STORED_EXTENSIONS = {
+    '.flac', '.mp3', '.m4a', '.mp4', '.aac', '.ogg', '.opus', '.jpg', '.jpeg', '.png', '.webp'
+}
+
+
+class CompressionPolicy:
+    """Per-extension choice between storing and deflating zip entries, and at which level.
+    
+    ZIP_COMPRESSION_POLICY overrides the defaults with comma separated rules such
+    as "wav=deflate:1,cue=deflate:9,flac=store"; "*" sets the fallback rule.
+    """
+    
+    def __init__(self, rules: Optional[Dict[str, Tuple[int, int]]] = None,
+                 default: Tuple[int, int] = (zipfile.ZIP_DEFLATED, 6)):
+        self.rules = {ext: (zipfile.ZIP_STORED, 0) for ext in STORED_EXTENSIONS}
+        self.rules.update(rules or {})
+        self.default = default
+    
+    @staticmethod
+    def parse_rule(rule: str) -> Tuple[int, int]:
+        method, _, level = rule.strip().lower().partition(':')
+        if method == 'store':
+            return zipfile.ZIP_STORED, 0
+        if method == 'deflate':
+            return zipfile.ZIP_DEFLATED, int(level) if level else 6
+        raise ValueError(f"Unknown zip compression rule: {rule}")
+    
+    @classmethod
+    def from_env(cls) -> 'CompressionPolicy':
+        rules = {}
+        default = (zipfile.ZIP_DEFLATED, 6)
+        for item in filter(None, os.getenv('ZIP_COMPRESSION_POLICY', '').split(',')):
+            ext, _, rule = item.partition('=')
+            ext = ext.strip().lower()
+            if ext == '*':
+                default = cls.parse_rule(rule)
+            else:
+                rules[ext if ext.startswith('.') else f'.{ext}'] = cls.parse_rule(rule)
+        return cls(rules, default)
+    
+    def for_file(self, filename: str) -> Tuple[int, int]:
+        """(zip method, deflate level) for a file, based on its extension"""
+        return self.rules.get(os.path.splitext(filename)[1].lower(), self.default)
+
+
+class _ZipEntry:
+    """A file ready to be written to an archive: CRC, sizes and (for deflate) its compressed bytes"""
+    
+    def __init__(self, source_path: str, arcname: str, method: int, crc: int, size: int,
+                 compressed_size: int, data=None):
+        self.source_path = source_path
+        self.arcname = arcname
+        self.method = method
+        self.crc = crc
+        self.size = size
+        self.compressed_size = compressed_size
+        # Spooled raw deflate stream, or None to copy the source file as is
+        self.data = data
+
+
+def compress_zip_entry(source_path: str, arcname: str, policy: CompressionPolicy,
+                       block_size: int = 1024 * 1024) -> _ZipEntry:
+    """Compress one file into a raw deflate stream, ready for RawZipWriter.
+    
+    zlib releases the GIL while compressing and checksumming, so calling this
+    from several threads compresses entries in parallel. Entries that don't
+    shrink are stored instead.
+    """
+    method, level = policy.for_file(arcname)
+    crc = 0
+    size = 0
+    
+    if method == zipfile.ZIP_STORED:
+        with open(source_path, 'rb') as src:
+            for block in iter(lambda: src.read(block_size), b''):
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+        return _ZipEntry(source_path, arcname, zipfile.ZIP_STORED, crc, size, size)
+    
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    with open(source_path, 'rb') as src:
+        for block in iter(lambda: src.read(block_size), b''):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            data.write(compressor.compress(block))
+    data.write(compressor.flush())
+    compressed_size = data.tell()
+    
+    if compressed_size >= size:
+        data.close()
+        return _ZipEntry(source_path, arcname, zipfile.ZIP_STORED, crc, size, size)
+    
+    data.seek(0)
+    return _ZipEntry(source_path, arcname, zipfile.ZIP_DEFLATED, crc, size, compressed_size, data)
+
+
+class RawZipWriter:
+    """Writes a ZIP archive from entries compressed ahead of time.
+    
+    zipfile can only compress entries itself, one at a time, so this writes the
+    local headers, central directory and ZIP64 records directly. Sizes are known
+    up front, so no data descriptors are needed.
+    """
+    
+    # Sizes/offsets from ZIP64_LIMIT and entry counts from ZIP64_COUNT_LIMIT need ZIP64 records
+    ZIP64_LIMIT = 0xFFFFFFFF
+    ZIP64_COUNT_LIMIT = 0xFFFF
+    
+    def __init__(self, path: str):
+        self._file = open(path, 'wb')
+        self._central = []
+    
+    @property
+    def size(self) -> int:
+        """Bytes written so far, not counting the central directory"""
+        return self._file.tell()
+    
+    @staticmethod
+    def _dos_datetime(timestamp: float) -> Tuple[int, int]:
+        t = time.localtime(timestamp)
+        if t.tm_year < 1980:
+            return 0, (1 << 5) | 1
+        return (
+            (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+        )
+    
+    def write_entry(self, entry: _ZipEntry):
+        stat = os.stat(entry.source_path)
+        dos_time, dos_date = self._dos_datetime(stat.st_mtime)
+        name = entry.arcname.replace(os.sep, '/').encode('utf-8')
+        flags = 0x800 if not entry.arcname.isascii() else 0
+        offset = self._file.tell()
+        
+        # The local header only carries sizes; a large offset is recorded in the central directory
+        zip64 = entry.size >= self.ZIP64_LIMIT or entry.compressed_size >= self.ZIP64_LIMIT
+        version = 45 if zip64 else 20
+        extra = struct.pack('<HHQQ', 0x0001, 16, entry.size, entry.compressed_size) if zip64 else b''
+        
+        self._file.write(struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, flags, entry.method, dos_time, dos_date, entry.crc,
+            0xFFFFFFFF if zip64 else entry.compressed_size,
+            0xFFFFFFFF if zip64 else entry.size,
+            len(name), len(extra)
+        ))
+        self._file.write(name)
+        self._file.write(extra)
+        
+        source = entry.data if entry.data is not None else open(entry.source_path, 'rb')
+        try:
+            shutil.copyfileobj(source, self._file, 1024 * 1024)
+        finally:
+            source.close()
+        
+        self._central.append((entry, name, flags, dos_time, dos_date, offset, stat.st_mode))
+    
+    def close(self):
+        if self._file.closed:
+            return
+        
+        cd_offset = self._file.tell()
+        for entry, name, flags, dos_time, dos_date, offset, mode in self._central:
+            zip64_fields = []
+            size, compressed_size, header_offset = entry.size, entry.compressed_size, offset
+            if size >= self.ZIP64_LIMIT:
+                zip64_fields.append(size)
+                size = 0xFFFFFFFF
+            if compressed_size >= self.ZIP64_LIMIT:
+                zip64_fields.append(compressed_size)
+                compressed_size = 0xFFFFFFFF
+            if header_offset >= self.ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            
+            extra = b''
+            if zip64_fields:
+                extra = struct.pack(f'<HH{len(zip64_fields)}Q', 0x0001, 8 * len(zip64_fields), *zip64_fields)
+            version = 45 if zip64_fields else 20
+            
+            self._file.write(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, flags, entry.method,
+                dos_time, dos_date, entry.crc, compressed_size, size, len(name), len(extra), 0, 0, 0,
+                (mode & 0xFFFF) << 16, header_offset
+            ))
+            self._file.write(name)
+            self._file.write(extra)
+        
+        cd_size = self._file.tell() - cd_offset
+        count = len(self._central)
+        
+        if count >= self.ZIP64_COUNT_LIMIT or cd_offset >= self.ZIP64_LIMIT or cd_size >= self.ZIP64_LIMIT:
+            zip64_end_offset = self._file.tell()
+            self._file.write(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset
+            ))
+            self._file.write(struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1))
+            self._file.write(struct.pack(
+                '<IHHHHIIH', 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0
+            ))
+        else:
+            self._file.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0))
+        
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_zip_parallel(zip_path: str, base_dir: str, files: List[str],
+                       policy: Optional[CompressionPolicy] = None, workers: Optional[int] = None,
+                       delete_sources: bool = False):
+    """Write files (relative to base_dir) to zip_path, compressing entries on a thread pool.
+    
+    Entries are written in the given order; only a bounded number of compressed
+    entries are held ahead of the writer. With delete_sources each file is
+    removed once its entry is written, so the tracks and the archive never
+    both sit on disk in full.
+    """
+    policy = policy or CompressionPolicy.from_env()
+    workers = max(1, workers or int(os.getenv('ZIP_WORKERS', str(os.cpu_count() or 1))))
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor, RawZipWriter(zip_path) as writer:
+        pending = deque()
+        for arcname in files:
+            pending.append(executor.submit(
+                compress_zip_entry, os.path.join(base_dir, arcname), arcname, policy
+            ))
+            if len(pending) >= workers * 2:
+                _write_zip_entry(writer, pending.popleft().result(), delete_sources)
+        while pending:
+            _write_zip_entry(writer, pending.popleft().result(), delete_sources)
+
+
+def _write_zip_entry(writer: 'RawZipWriter', entry: _ZipEntry, delete_source: bool):
+    writer.write_entry(entry)
+    if delete_source:
+        os.remove(entry.source_path)
+
+
+class StreamingZipPackager:
+    """Zip archive that tracks are appended to as soon as each one is downloaded.
+    
+    Download workers call add_files concurrently. Each worker compresses its own
+    files outside the lock, so only appending the finished bytes is serialised.
+    Closing the packager writes the central directory.
+    """
+    
+    def __init__(self, zip_path: str, policy: Optional[CompressionPolicy] = None):
+        self.zip_path = zip_path
+        self.policy = policy or CompressionPolicy.from_env()
+        self._writer = RawZipWriter(zip_path)
+        self._arcnames = set()
+        self._lock = threading.Lock()
+    
+    def add_files(self, base_dir: str, files: List[str]):
+        """Add files (relative to base_dir) to the archive under their relative paths"""
+        for arcname in files:
+            # Skip config files
+            if is_config_file(arcname):
+                continue
+            
+            with self._lock:
+                if arcname in self._arcnames:
+                    print(f"Skipping duplicate zip entry: {arcname}")
+                    continue
+                self._arcnames.add(arcname)
+            
+            entry = compress_zip_entry(os.path.join(base_dir, arcname), arcname, self.policy)
+            with self._lock:
+                self._writer.write_entry(entry)
+            print(f"Added to zip: {arcname}")
+    
+    def close(self):
+        with self._lock:
+            self._writer.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class VolumeSplitter:
+    """Rule for splitting an archive into standalone volumes at track boundaries.
+    
+    A new volume starts before a track that would take the current one past
+    max_bytes, or once it holds max_tracks tracks. A single track larger than
+    max_bytes still gets a volume of its own rather than being split.
+    """
+    
+    def __init__(self, max_bytes: int = 0, max_tracks: int = 0):
+        self.max_bytes = max_bytes
+        self.max_tracks = max_tracks
+    
+    @classmethod
+    def from_env(cls) -> Optional['VolumeSplitter']:
+        """Splitter from ARCHIVE_VOLUME_BYTES / ARCHIVE_VOLUME_TRACKS, or None for a single archive"""
+        splitter = cls(int(os.getenv('ARCHIVE_VOLUME_BYTES', '0')), int(os.getenv('ARCHIVE_VOLUME_TRACKS', '0')))
+        return splitter if splitter.max_bytes > 0 or splitter.max_tracks > 0 else None
+    
+    def starts_new_volume(self, volume_bytes: int, volume_tracks: int, track_bytes: int) -> bool:
+        """Whether a track of track_bytes goes into a new volume rather than the current one"""
+        if volume_tracks == 0:
+            return False
+        if self.max_tracks and volume_tracks >= self.max_tracks:
+            return True
+        return bool(self.max_bytes) and volume_bytes + track_bytes > self.max_bytes
+    
+    def group(self, tracks: List[Tuple[List[str], int]]) -> List[Tuple[List[str], int]]:
+        """Split (files, bytes) per track into (files, track count) per volume, keeping track order"""
+        volumes: List[Tuple[List[str], int]] = []
+        volume_bytes = volume_tracks = 0
+        for files, track_bytes in tracks:
+            if not volumes or self.starts_new_volume(volume_bytes, volume_tracks, track_bytes):
+                volumes.append(([], 0))
+                volume_bytes = volume_tracks = 0
+            volume_bytes += track_bytes
+            volume_tracks += 1
+            volumes[-1] = (volumes[-1][0] + files, volume_tracks)
+        return volumes
+
+
+class VolumePackager:
+    """StreamingZipPackager counterpart that splits the archive into volumes.
+    
+    A track's files always land in the same volume. When the next track starts a
+    new volume the current one is sealed, and on_sealed(part, path, tracks) is
+    called with it, in part order, so it can be published while later tracks are
+    still downloading.
+    """
+    
+    def __init__(self, path_for_part: Callable[[int], str], splitter: VolumeSplitter,
+                 on_sealed: Callable[[int, str, int], None], policy: Optional[CompressionPolicy] = None):
+        self.path_for_part = path_for_part
+        self.splitter = splitter
+        self.on_sealed = on_sealed
+        self.policy = policy or CompressionPolicy.from_env()
+        self.parts = 0
+        self._writer: Optional[RawZipWriter] = None
+        self._volume_tracks = 0
+        self._arcnames = set()
+        self._sealed = deque()
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+    
+    def _seal(self):
+        self._writer.close()
+        self._sealed.append((self.parts, self.path_for_part(self.parts), self._volume_tracks))
+        self._writer = None
+        self._volume_tracks = 0
+    
+    def _publish_sealed(self):
+        # Sealed volumes are queued under _lock, so draining in order keeps parts in order
+        with self._publish_lock:
+            while self._sealed:
+                self.on_sealed(*self._sealed.popleft())
+    
+    def add_files(self, base_dir: str, files: List[str], track: bool = True):
+        """Add one track's files (relative to base_dir) to the current volume.
+        
+        With track=False the files (e.g. the analysis manifest) join the current
+        volume without counting as a track or starting a new volume.
+        """
+        entries = []
+        for arcname in files:
+            # Skip config files
+            if is_config_file(arcname):
+                continue
+            
+            with self._lock:
+                if arcname in self._arcnames:
+                    print(f"Skipping duplicate zip entry: {arcname}")
+                    continue
+                self._arcnames.add(arcname)
+            
+            entries.append(compress_zip_entry(os.path.join(base_dir, arcname), arcname, self.policy))
+        
+        if not entries:
+            return
+        
+        track_bytes = sum(entry.compressed_size for entry in entries)
+        with self._lock:
+            if track and self._writer is not None and self.splitter.starts_new_volume(
+                self._writer.size, self._volume_tracks, track_bytes
+            ):
+                self._seal()
+            if self._writer is None:
+                self.parts += 1
+                self._writer = RawZipWriter(self.path_for_part(self.parts))
+            
+            for entry in entries:
+                self._writer.write_entry(entry)
+                print(f"Added to zip part {self.parts}: {entry.arcname}")
+            if track:
+                self._volume_tracks += 1
+        
+        self._publish_sealed()
+    
+    def close(self):
+        """Seal and publish the last volume"""
+        with self._lock:
+            if self._writer is not None:
+                self._seal()
+        self._publish_sealed()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # A failed job doesn't publish its last, partial volume
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write-only file that collects zip output until it is drained"""
+    
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(base_dir: str, chunk_size: int = 1024 * 1024,
+               policy: Optional[CompressionPolicy] = None) -> Iterator[bytes]:
+    """Yield a zip archive of every file under base_dir, built on the fly.
+    
+    Nothing is written to disk: entries use data descriptors, so the archive can
+    be produced front to back while it is being sent.
+    """
+    policy = policy or CompressionPolicy.from_env()
+    sink = _ChunkSink()
+    
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for root, dirs, files in os.walk(base_dir):
+            # Skip in-progress staging dirs; sort for a stable entry order
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.track-'))
+            for file in sorted(files):
+                # Skip config files
+                if is_config_file(file):
+                    continue
+                
+                file_path = os.path.join(root, file)
+                zinfo = zipfile.ZipInfo.from_file(file_path, os.path.relpath(file_path, base_dir))
+                zinfo.compress_type = policy.for_file(file)[0]
+                
+                with open(file_path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                    while True:
+                        data = src.read(chunk_size)
+                        if not data:
+                            break
+                        dest.write(data)
+                        chunk = sink.drain()
+                        if chunk:
+                            yield chunk
+                
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+    
+    # Central directory
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+
+def _decode_audio(path: str, sample_rate: int = 22050):
+    """Decode an audio file to a (channels, samples) float32 array and its sample rate.
+    
+    WAV is read with the standard library at its own rate; everything else goes
+    through ffmpeg (FFMPEG_PATH), downmixed to stereo at sample_rate.
+    """
+    import numpy as np
+    
+    if path.lower().endswith('.wav'):
+        import wave
+        with wave.open(path, 'rb') as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            raw = wav.readframes(wav.getnframes())
+        if width == 3:
+            # Widen packed 24-bit samples to 32-bit by prepending a zero low byte
+            packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+            raw = np.concatenate([np.zeros((len(packed), 1), dtype=np.uint8), packed], axis=1).tobytes()
+            width = 4
+        if width == 1:
+            samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+        else:
+            dtype = {2: '<i2', 4: '<i4'}[width]
+            samples = np.frombuffer(raw, dtype=dtype).astype(np.float32) / float(2 ** (8 * width - 1))
+        return samples.reshape(-1, channels).T, rate
+    
+    result = subprocess.run(
+        [os.getenv('FFMPEG_PATH', 'ffmpeg'), '-v', 'error', '-i', path,
+         '-f', 'f32le', '-ac', '2', '-ar', str(sample_rate), '-'],
+        capture_output=True, check=True
+    )
+    return np.frombuffer(result.stdout, dtype='<f4').reshape(-1, 2).T, sample_rate
+
+
+def _biquad_response(b, a, frequencies, sample_rate: int):
+    """Magnitude response of a biquad at the given frequencies"""
+    import numpy as np
+    z = np.exp(-1j * 2 * np.pi * frequencies / sample_rate)
+    return np.abs((b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2))
+
+
+def _k_weighting(frequencies, sample_rate: int):
+    """Power response of the ITU-R BS.1770 K-weighting filter at any sample rate.
+    
+    The shelf and high-pass are rederived for sample_rate the way libebur128
+    does, matching the standard's 48 kHz coefficients exactly.
+    """
+    import numpy as np
+    # Shelf: +4 dB above ~1.7 kHz
+    gain, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    k = np.tan(np.pi * fc / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = _biquad_response(
+        ((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0),
+        (1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0),
+        frequencies, sample_rate
+    )
+    # High-pass around 38 Hz
+    q, fc = 0.5003270373238773, 38.13547087602444
+    k = np.tan(np.pi * fc / sample_rate)
+    a0 = 1 + k / q + k * k
+    high_pass = _biquad_response(
+        (1, -2, 1),
+        (1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0),
+        frequencies, sample_rate
+    )
+    return (shelf * high_pass) ** 2
+
+
+def integrated_loudness(samples, sample_rate: int) -> Optional[float]:
+    """Gated integrated loudness (LUFS) per ITU-R BS.1770-4.
+    
+    K-weighting is applied per 400 ms block in the frequency domain, so the
+    whole measurement is a handful of batched FFTs. Returns None for silence.
+    """
+    import numpy as np
+    block, hop = int(0.4 * sample_rate), int(0.1 * sample_rate)
+    if samples.shape[1] < block:
+        return None
+    
+    weights = _k_weighting(np.fft.rfftfreq(block, 1 / sample_rate), sample_rate)
+    # One-sided spectrum: every bin but DC (and Nyquist) stands for two
+    weights[1:] *= 2
+    if block % 2 == 0:
+        weights[-1] /= 2
+    
+    power = np.zeros(1 + (samples.shape[1] - block) // hop)
+    for channel in samples:
+        blocks = np.lib.stride_tricks.sliding_window_view(channel, block)[::hop]
+        for start in range(0, len(blocks), 512):
+            spectrum = np.fft.rfft(blocks[start:start + 512], axis=1)
+            power[start:start + 512] += (np.abs(spectrum) ** 2 * weights).sum(axis=1) / block ** 2
+    
+    def loudness(z):
+        return -0.691 + 10 * np.log10(z)
+    
+    with np.errstate(divide='ignore'):
+        gated = power[loudness(power) > -70]
+        if not len(gated):
+            return None
+        gated = gated[loudness(gated) > loudness(gated.mean()) - 10]
+    return round(float(loudness(gated.mean())), 1)
+
+
+def _spectral_features(mono, sample_rate: int):
+    """Onset strength envelope, per-frame chroma and the frame rate of both"""
+    import numpy as np
+    n_fft = 2048 if sample_rate > 32000 else 1024
+    hop = n_fft // 4
+    frequencies = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+    
+    # Fold 65 Hz - 2.1 kHz onto the 12 pitch classes, C = 0
+    in_range = (frequencies >= 65) & (frequencies <= 2100)
+    pitch_class = (np.round(12 * np.log2(frequencies[in_range] / 440)).astype(int) + 9) % 12
+    folding = np.zeros((in_range.sum(), 12), dtype=np.float32)
+    folding[np.arange(len(pitch_class)), pitch_class] = 1
+    
+    window = np.hanning(n_fft).astype(np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(mono, n_fft)[::hop]
+    onset, chroma = [], []
+    previous = None
+    for start in range(0, len(frames), 1024):
+        magnitude = np.abs(np.fft.rfft(frames[start:start + 1024] * window, axis=1)).astype(np.float32)
+        log_magnitude = np.log1p(100 * magnitude)
+        shifted = np.vstack([log_magnitude[:1] if previous is None else previous, log_magnitude[:-1]])
+        # Spectral flux: summed increase in log magnitude
+        onset.append(np.maximum(log_magnitude - shifted, 0).sum(axis=1))
+        chroma.append(magnitude[:, in_range] @ folding)
+        previous = log_magnitude[-1:]
+    
+    if not onset:
+        return np.zeros(0), np.zeros((0, 12)), sample_rate / hop
+    return np.concatenate(onset), np.vstack(chroma), sample_rate / hop
+
+
+def estimate_tempo(onset, frame_rate: float, min_bpm: float = 60, max_bpm: float = 200) -> Optional[float]:
+    """Tempo in BPM from the autocorrelation of the onset envelope.
+    
+    Each candidate tempo on a 0.1 BPM grid is scored by the autocorrelation at
+    its first four beat lags, so the estimate isn't limited to whole-frame
+    lags. Scores are weighted towards 120 BPM on a log scale, which settles the
+    usual half/double tempo ambiguity the way most DJ software does. Returns
+    None when nothing repeats strongly enough to call a beat.
+    """
+    import numpy as np
+    max_lag = 4 * 60 * frame_rate / min_bpm
+    if len(onset) < 2 * max_lag:
+        return None
+    
+    envelope = onset - onset.mean()
+    size = 1 << int(np.ceil(np.log2(2 * len(envelope))))
+    spectrum = np.fft.rfft(envelope, size)
+    lags = np.arange(int(np.ceil(max_lag)) + 2)
+    # Unbiased: longer lags overlap fewer frames
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:len(lags)] / (len(envelope) - lags)
+    if autocorrelation[0] <= 0:
+        return None
+    
+    bpms = np.arange(min_bpm, max_bpm + 0.05, 0.1)
+    beat_lags = 60 * frame_rate / bpms
+    score = sum(np.interp(beats * beat_lags, lags, autocorrelation) for beats in range(1, 5))
+    prior = np.exp(-0.5 * np.log2(bpms / 120) ** 2)
+    best = np.argmax(score * prior)
+    # Without a clear pulse (ambient, spoken word) any tempo would be a guess
+    if score[best] < 4 * 0.3 * autocorrelation[0]:
+        return None
+    return round(float(bpms[best]), 1)
+
+
+# Krumhansl-Kessler key profiles, starting at the tonic
+MAJOR_PROFILE = (6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88)
+MINOR_PROFILE = (6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17)
+PITCH_CLASSES = ('C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B')
+
+
+def camelot(tonic: int, mode: str) -> str:
+    """Camelot wheel code for a key, e.g. (9, 'minor') -> '8A'"""
+    if mode == 'minor':
+        return f"{camelot((tonic + 3) % 12, 'major')[:-1]}A"
+    return f"{(7 * tonic + 7) % 12 + 1}B"
+
+
+def estimate_key(chroma) -> Optional[Tuple[str, str]]:
+    """Key name and Camelot code from the track's summed chroma"""
+    import numpy as np
+    profile = chroma.sum(axis=0)
+    if not profile.any():
+        return None
+    
+    best = None
+    for mode, template in (('major', MAJOR_PROFILE), ('minor', MINOR_PROFILE)):
+        for tonic in range(12):
+            score = np.corrcoef(profile, np.roll(template, tonic))[0, 1]
+            if best is None or score > best[0]:
+                best = (score, tonic, mode)
+    
+    _, tonic, mode = best
+    return f"{PITCH_CLASSES[tonic]} {mode}", camelot(tonic, mode)
+
+
+def find_sections(onset, chroma, frame_rate: float, kernel_seconds: int = 8) -> List[float]:
+    """Section start times (seconds) from peaks in self-similarity novelty.
+    
+    Chroma and energy are pooled per second, compared with each other, and a
+    checkerboard kernel slid along the diagonal scores how much the music
+    before each second differs from the music after it (Foote novelty).
+    """
+    import numpy as np
+    per_second = max(1, int(round(frame_rate)))
+    seconds = len(onset) // per_second
+    if seconds < 4 * kernel_seconds:
+        return [0.0]
+    
+    pooled_chroma = chroma[:seconds * per_second].reshape(seconds, per_second, 12).mean(axis=1)
+    energy = np.log1p(onset[:seconds * per_second].reshape(seconds, per_second).mean(axis=1))
+    features = np.hstack([
+        pooled_chroma / (np.linalg.norm(pooled_chroma, axis=1, keepdims=True) + 1e-9),
+        ((energy - energy.mean()) / (energy.std() + 1e-9))[:, None] / 2,
+    ])
+    features /= np.linalg.norm(features, axis=1, keepdims=True) + 1e-9
+    similarity = features @ features.T
+    
+    half = kernel_seconds
+    offsets = np.arange(-half, half) + 0.5
+    taper = np.exp(-0.5 * (offsets / (half / 2)) ** 2)
+    kernel = np.outer(np.sign(offsets), np.sign(offsets)) * np.outer(taper, taper)
+    padded = np.pad(similarity, half, mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, (2 * half, 2 * half))
+    diagonal = np.arange(seconds)
+    novelty = np.einsum('ijk,jk->i', windows[diagonal, diagonal], kernel)
+    
+    threshold = novelty.mean() + novelty.std()
+    peaks = [
+        i for i in range(half, seconds - half)
+        if novelty[i] > threshold and novelty[i] == novelty[i - half:i + half + 1].max()
+    ]
+    return [0.0] + [float(i) for i in peaks]
+
+
+def analyse_audio(path: str) -> Dict:
+    """Tempo, key, loudness and section boundaries of one audio file.
+    
+    Runs in an analysis worker process; needs NumPy, and ffmpeg for anything
+    but WAV.
+    """
+    import numpy as np
+    samples, sample_rate = _decode_audio(path)
+    mono = samples.mean(axis=0)
+    onset, chroma, frame_rate = _spectral_features(mono, sample_rate)
+    key = estimate_key(chroma)
+    
+    return {
+        'duration': round(samples.shape[1] / sample_rate, 2),
+        'bpm': estimate_tempo(onset, frame_rate),
+        'key': key[0] if key else None,
+        'camelot': key[1] if key else None,
+        'lufs': integrated_loudness(samples, sample_rate),
+        'peak': round(float(np.abs(samples).max()), 4) if samples.size else None,
+        'sections': find_sections(onset, chroma, frame_rate),
+    }
+
+
+def analysis_key(track: Dict) -> str:
+    """Cache key for a track's analysis: its ISRC, so one recording is analysed once"""
+    tidal_track = track.get('tidal') or {}
+    isrc = track.get('isrc') or tidal_track.get('isrc')
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', f"isrc-{isrc}" if isrc else track_key(track))
+
+
+class AudioAnalyzer:
+    """Analyses downloaded tracks on a process pool, caching results on disk.
+    
+    Tracks are submitted as soon as they're downloaded, so analysis overlaps
+    with the rest of the job. Results are cached as one JSON file per ISRC
+    under ANALYSIS_CACHE_DIR, so a recording is only ever analysed once.
+    Where the platform can't start worker processes (no /dev/shm), analysis
+    runs on threads instead; NumPy's FFTs release the GIL.
+    """
+    
+    # Bump when the analysis changes, so older cached results are recomputed
+    VERSION = 1
+    AUDIO_EXTENSIONS = ('.flac', '.m4a', '.mp4', '.mp3', '.wav', '.aif', '.aiff', '.ogg', '.opus')
+    
+    def __init__(self, cache_dir: str, workers: Optional[int] = None,
+                 analyse: Callable[[str], Dict] = analyse_audio, metrics: Optional[PipelineMetrics] = None):
+        self.cache_dir = cache_dir
+        self.workers = max(1, workers or int(os.getenv('ANALYSIS_WORKERS', str(os.cpu_count() or 1))))
+        self.analyse = analyse
+        self.metrics = metrics or METRICS
+        self._executor = None
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_env(cls, work_dir: str) -> Optional['AudioAnalyzer']:
+        """Analyzer unless ANALYSIS=0, or NumPy or ffmpeg isn't installed"""
+        if os.getenv('ANALYSIS', '1').lower() not in ('1', 'true', 'yes'):
+            return None
+        # Checked without importing, so NumPy stays off the cold start path
+        if importlib.util.find_spec('numpy') is None:
+            print("NumPy not installed, audio analysis disabled")
+            return None
+        # Only WAV decodes without it, and OrpheusDL never produces WAV
+        if not Transcoder.available():
+            print("ffmpeg not found, audio analysis disabled")
+            return None
+        return cls(os.getenv('ANALYSIS_CACHE_DIR', os.path.join(work_dir, '.analysis')))
+    
+    def _pool(self):
+        if self._executor is None:
+            try:
+                # Spawned rather than forked: the pool starts while HTTP and download threads
+                # hold locks, which a forked child would inherit locked
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            except (OSError, NotImplementedError) as e:
+                print(f"Process pool unavailable, analysing on threads: {e}")
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analysis')
+        return self._executor
+    
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.json')
+    
+    def cached(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._cache_path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry.get('analysis') if entry.get('version') == self.VERSION else None
+    
+    def _store(self, key: str, future: Future, stored: Future):
+        analysis = None
+        try:
+            analysis = future.result()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f'{self._cache_path(key)}.{uuid.uuid4().hex}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'version': self.VERSION, 'analysis': analysis}, f)
+            os.replace(temp_path, self._cache_path(key))
+        except Exception as e:
+            print(f"Audio analysis failed for {key}: {e}")
+            self.metrics.increment('analysis_failures_total')
+            analysis = None
+        finally:
+            # Only once the cache is written, so result() never sees neither
+            with self._lock:
+                self._pending.pop(key, None)
+            stored.set_result(analysis)
+    
+    def submit(self, key: str, base_dir: str, files: List[str]):
+        """Queue a track's audio file for analysis unless it's cached or already queued"""
+        audio = [f for f in files if f.lower().endswith(self.AUDIO_EXTENSIONS)]
+        if not audio:
+            return
+        
+        with self._lock:
+            if key in self._pending:
+                return
+        if self.cached(key) is not None:
+            return
+        
+        with self._lock:
+            if key in self._pending:
+                return
+            future = self._pool().submit(self.analyse, os.path.join(base_dir, audio[0]))
+            # Waiters are woken before done callbacks run, so result() waits for the
+            # cache write through its own future rather than the pool's
+            stored = Future()
+            self._pending[key] = stored
+        # Runs straight away if the analysis already finished
+        future.add_done_callback(lambda done: self._store(key, done, stored))
+    
+    def result(self, key: str, timeout: Optional[float] = None) -> Optional[Dict]:
+        """Analysis for a key, waiting for it when it's still running; None if it failed"""
+        with self._lock:
+            future = self._pending.get(key)
+        if future is None:
+            return self.cached(key)
+        return future.result(timeout)
+    
+    def when_done(self, key: str, callback: Callable[[], None]):
+        """Call callback once the analysis for key is settled, straight away when it isn't running"""
+        with self._lock:
+            future = self._pending.get(key)
+        if future is None:
+            callback()
+        else:
+            future.add_done_callback(lambda _: callback())
+    
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class OutputProfile:
+    """Audio format a job's tracks are delivered in, for DJ hardware that can't play FLAC.
+    
+    Tracks are downloaded as usual and transcoded with ffmpeg (FFMPEG_PATH),
+    keeping their tags and embedded artwork. Sample rates above what the format
+    or common players handle are halved until they fit, which keeps 88.2 and
+    176.4 kHz masters in the 44.1 kHz family. With normalize set, TIDAL's
+    replayGain is applied, limited by the track's peak so nothing clips.
+    """
+    
+    # name -> (extension, codec by source bit depth, highest sample rate)
+    PROFILES = {
+        'aiff': ('.aiff', {16: 'pcm_s16be', 24: 'pcm_s24be'}, 48000),
+        'mp3-320': ('.mp3', {16: 'libmp3lame'}, 48000),
+        'alac': ('.m4a', {16: 'alac'}, 96000),
+    }
+    CODEC_ARGS = {
+        # AIFF carries tags and artwork as an ID3v2 chunk
+        'aiff': ['-write_id3v2', '1', '-id3v2_version', '3'],
+        'mp3-320': ['-b:a', '320k', '-id3v2_version', '3'],
+        'alac': [],
+    }
+    
+    def __init__(self, name: str, normalize: bool = False):
+        if name not in self.PROFILES:
+            raise ValueError(f"Unknown output profile: {name}")
+        self.name = name
+        self.normalize = normalize
+        self.extension, self._codecs, self.max_sample_rate = self.PROFILES[name]
+    
+    @classmethod
+    def from_job(cls, job_details: Dict) -> Optional['OutputProfile']:
+        """Profile requested by the job (profile / normalize), or None to keep OrpheusDL's output"""
+        name = (job_details.get('profile') or 'original').lower()
+        if name == 'original':
+            return None
+        return cls(name, bool(job_details.get('normalize')))
+    
+    @property
+    def cache_suffix(self) -> str:
+        """Distinguishes this profile's transcodes in the track cache"""
+        return f"{self.name}-rg" if self.normalize else self.name
+    
+    def gain_db(self, tidal_track: Dict) -> Optional[float]:
+        """Gain to apply, from TIDAL's replayGain capped at the headroom left by its peak"""
+        if not self.normalize or tidal_track.get('replayGain') is None:
+            return None
+        gain = float(tidal_track['replayGain'])
+        if tidal_track.get('peak'):
+            gain = min(gain, -20 * math.log10(float(tidal_track['peak'])))
+        return round(gain, 2)
+    
+    def command(self, source: str, target: str, sample_rate: Optional[int] = None,
+                bits: Optional[int] = None, gain_db: Optional[float] = None) -> List[str]:
+        codec = self._codecs[24] if bits and bits > 16 and 24 in self._codecs else self._codecs[16]
+        command = [
+            os.getenv('FFMPEG_PATH', 'ffmpeg'), '-v', 'error', '-y', '-i', source,
+            # First audio stream plus any cover art, with the source's tags
+            '-map', '0:a:0', '-map', '0:v?', '-map_metadata', '0',
+            '-c:v', 'copy', '-disposition:v', 'attached_pic',
+            '-c:a', codec, *self.CODEC_ARGS[self.name]
+        ]
+        if sample_rate and sample_rate > self.max_sample_rate:
+            while sample_rate > self.max_sample_rate:
+                sample_rate //= 2
+            command += ['-ar', str(sample_rate)]
+        if gain_db:
+            command += ['-af', f'volume={gain_db}dB']
+        command.append(target)
+        return command
+
+
+class Transcoder:
+    """Transcodes downloaded tracks into a job's output profile.
+    
+    Every transcode is its own ffmpeg process, so capping how many run at once
+    (TRANSCODE_WORKERS, one per core by default) is enough to spread them over
+    the cores. A track's transcode runs as soon as it is downloaded, while the
+    job's other tracks keep downloading.
+    """
+    
+    def __init__(self, workers: Optional[int] = None, timeout: Optional[float] = None,
+                 metrics: Optional[PipelineMetrics] = None):
+        self.workers = max(1, workers or int(os.getenv('TRANSCODE_WORKERS', str(os.cpu_count() or 1))))
+        self.timeout = timeout or float(os.getenv('TRANSCODE_TIMEOUT', '300'))
+        self.metrics = metrics or METRICS
+        self._slots = threading.BoundedSemaphore(self.workers)
+    
+    @staticmethod
+    def available() -> bool:
+        return shutil.which(os.getenv('FFMPEG_PATH', 'ffmpeg')) is not None
+    
+    @staticmethod
+    def probe(path: str) -> Tuple[Optional[int], Optional[int]]:
+        """Sample rate and bit depth of a file's first audio stream, where ffprobe can tell"""
+        try:
+            result = subprocess.run(
+                [os.getenv('FFPROBE_PATH', 'ffprobe'), '-v', 'error', '-select_streams', 'a:0',
+                 '-show_entries', 'stream=sample_rate,bits_per_raw_sample', '-of', 'json', path],
+                capture_output=True, text=True, timeout=30, check=True
+            )
+            stream = json.loads(result.stdout)['streams'][0]
+        except (OSError, subprocess.SubprocessError, ValueError, KeyError, IndexError):
+            return None, None
+        
+        def number(value) -> Optional[int]:
+            return int(value) if str(value).isdigit() else None
+        
+        return number(stream.get('sample_rate')), number(stream.get('bits_per_raw_sample'))
+    
+    def transcode(self, staging_dir: str, tidal_track: Dict, profile: OutputProfile, track_name: str) -> bool:
+        """Replace the audio files in staging_dir with the profile's format; False if ffmpeg failed"""
+        audio = [
+            os.path.join(root, file)
+            for root, dirs, files in os.walk(staging_dir)
+            for file in files
+            if file.lower().endswith(AudioAnalyzer.AUDIO_EXTENSIONS)
+        ]
+        gain_db = profile.gain_db(tidal_track)
+        
+        with self._slots, self.metrics.stage('transcode', track=track_name, profile=profile.name):
+            for source in audio:
+                stem = os.path.splitext(source)[0]
+                # Written beside the source first, in case both share an extension
+                temp_path = f"{stem}.transcoding{profile.extension}"
+                sample_rate, bits = self.probe(source)
+                try:
+                    subprocess.run(
+                        profile.command(source, temp_path, sample_rate, bits, gain_db),
+                        capture_output=True, text=True, timeout=self.timeout, check=True
+                    )
+                except (OSError, subprocess.SubprocessError) as e:
+                    detail = getattr(e, 'stderr', None) or e
+                    print(f"Transcoding {track_name} to {profile.name} failed: {detail}")
+                    self.metrics.increment('transcode_failures_total', profile=profile.name)
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    return False
+                os.remove(source)
+                os.replace(temp_path, f"{stem}{profile.extension}")
+        return True
+
 
 class PlaylistDownloader:
     """Business logic for downloading playlists, separated from HTTP handling"""
     
-    def __init__(self):
-        pass
+    def __init__(self, max_workers: Optional[int] = None, track_timeout: Optional[float] = None,
+                 cache: Optional[TrackCache] = None, client: Optional[NextJSClient] = None,
+                 metrics: Optional[PipelineMetrics] = None, throttle: Optional[DownloadThrottle] = None,
+                 scheduler: Optional[TrackScheduler] = None):
+        # Number of a job's tracks allowed to download at the same time
+        self.max_workers = max(1, max_workers or int(os.getenv('DOWNLOAD_CONCURRENCY', '4')))
+        # Seconds a single track download may take before it is abandoned
+        self.track_timeout = track_timeout or float(os.getenv('TRACK_TIMEOUT', '120'))
+        # Extra attempts for a failed track, spaced by exponential backoff with full jitter
+        self.retries = int(os.getenv('DOWNLOAD_RETRIES', '2'))
+        self.retry_base_delay = float(os.getenv('RETRY_BASE_DELAY', '1'))
+        self.retry_max_delay = float(os.getenv('RETRY_MAX_DELAY', '30'))
+        # 'session' keeps OrpheusDL loaded in-process, 'subprocess' runs it once per track
+        self.engine = os.getenv('ORPHEUS_ENGINE', 'session')
+        self.quality = os.getenv('ORPHEUS_QUALITY', 'hifi')
+        # 'file' writes /tmp/{job_id}.zip, 'stream' keeps the tracks and zips them on request
+        self.delivery_mode = os.getenv('DELIVERY_MODE', 'file')
+        # Per-job dirs holding tracks and manifests, kept until the job completes so it can resume
+        self.work_dir = os.getenv('DOWNLOAD_WORK_DIR', os.path.join(tempfile.gettempdir(), 'so-you-made-a-mix'))
+        # Job dirs untouched for this long are deleted; Next.js forgets a job after an hour anyway
+        self.job_ttl = float(os.getenv('JOB_TTL_SECONDS', str(6 * 3600)))
+        self._last_sweep: Optional[float] = None
+        # Shared across jobs so overlapping playlists reuse earlier downloads
+        self.cache = cache if cache is not None else TrackCache.from_env()
+        # Split archives into volumes published one by one; None for a single archive
+        self.volume_splitter = VolumeSplitter.from_env()
+        # Delete tracks once they're in the archive; on by default when DISK_BUDGET_BYTES is set.
+        # A resumed job then downloads those tracks again.
+        self.delete_packed = os.getenv(
+            'DELETE_PACKED_TRACKS', '1' if int(os.getenv('DISK_BUDGET_BYTES', '0')) > 0 else '0'
+        ).lower() in ('1', 'true', 'yes')
+        self.client = client or NextJSClient()
+        self.metrics = metrics or METRICS
+        # Written once and reused by every subprocess download
+        self.orpheus_config = OrpheusConfigFile(self.work_dir, self.quality)
+        # Paces attempts and adapts concurrency to TIDAL throttling
+        self.throttle = throttle or get_download_throttle()
+        # Runs every job's tracks on one worker pool, taking turns between jobs
+        self.scheduler = scheduler or get_track_scheduler()
+        # Skips unavailable tracks and orders the rest longest first
+        self.preflight = TrackPreflight(self.quality)
+        # BPM, key, loudness and sections of every track; None when disabled or NumPy is missing
+        self.analyzer = AudioAnalyzer.from_env(self.work_dir)
+        # Converts tracks for jobs that asked for an output profile
+        self.transcoder = Transcoder(metrics=self.metrics)
+        # Failure detail (OrpheusDL stderr or exception) of the current thread's last attempt
+        self._attempt = threading.local()
     
     def get_job_details(self, job_id: str) -> Optional[Dict]:
         """Get job details from Next.js API"""
         try:
-            nextjs_url = os.getenv('NEXTJS_URL', 'http://localhost:3000')
-            response = requests.get(f"{nextjs_url}/api/download/status/{job_id}")
+            response = self.client.get(f"/api/download/status/{job_id}")
             if response.status_code == 200:
                 return response.json()
             return None
@@ -29,18 +2718,24 @@ class PlaylistDownloader:
             return None
     
     def get_playlist_data(self, playlist_id: str) -> Optional[Dict]:
-        """Get enhanced playlist data from Next.js API"""
+        """Get enhanced playlist data from Next.js API.
+        
+        The response is parsed as it streams in, with each track reduced to a
+        PlaylistTrack, so the full JSON tree is never held in memory.
+        """
         try:
-            nextjs_url = os.getenv('NEXTJS_URL', 'http://localhost:3000')
-            response = requests.get(f"{nextjs_url}/api/playlist/{playlist_id}")
-            if response.status_code == 200:
-                return response.json()
-            return None
+            response = self.client.get(f"/api/playlist/{playlist_id}", stream=True)
+            with response:
+                if response.status_code != 200:
+                    return None
+                chunks = response.iter_content(chunk_size=64 * 1024)
+                return read_playlist(codecs.iterdecode(chunks, response.encoding or 'utf-8'))
         except Exception as e:
             print(f"Failed to get playlist data: {e}")
             return None
     
-    def update_job_status(self, job_id: str, status: str, current: int, total: int, current_track: str = None, error: str = None):
+    def update_job_status(self, job_id: str, status: str, current: int, total: int, current_track: str = None,
+                          error: str = None, estimate: Optional[Dict] = None):
         """Update job status via Next.js API"""
         try:
             data = {
@@ -53,58 +2748,88 @@ class PlaylistDownloader:
             }
             if error:
                 data['error'] = error
+            if estimate:
+                data['estimate'] = estimate
             
-            nextjs_url = os.getenv('NEXTJS_URL', 'http://localhost:3000')
-            response = requests.post(
-                f"{nextjs_url}/api/download/update-status/{job_id}",
-                json=data,
-                timeout=10
-            )
+            response = self.client.post(f"/api/download/update-status/{job_id}", data)
             print(f"Status update response: {response.status_code}")
                 
         except Exception as e:
             print(f"Failed to update job status: {e}")
     
-    def update_job_completion(self, job_id: str, download_url: str, failed_tracks: List[str]):
+    def update_job_completion(self, job_id: str, download_url: str, failed_tracks: List[str],
+                              delivery: str = 'file', sync: Optional[Dict] = None,
+                              volumes: Optional[List[Dict]] = None, analysis: Optional[List[Dict]] = None):
         """Mark job as completed"""
         try:
-            nextjs_url = os.getenv('NEXTJS_URL', 'http://localhost:3000')
-            response = requests.post(
-                f"{nextjs_url}/api/download/update-status/{job_id}",
-                json={
-                    'status': 'completed',
-                    'downloadUrl': download_url,
-                    'failedTracks': failed_tracks
-                },
-                timeout=10
-            )
+            data = {
+                'status': 'completed',
+                'downloadUrl': download_url,
+                'failedTracks': failed_tracks
+            }
+            if delivery != 'file':
+                data['delivery'] = delivery
+            if sync is not None:
+                data['sync'] = sync
+            if volumes is not None:
+                data['volumes'] = volumes
+            if analysis is not None:
+                data['analysis'] = analysis
+            
+            response = self.client.post(f"/api/download/update-status/{job_id}", data)
             print(f"Completion update response: {response.status_code}")
         except Exception as e:
             print(f"Failed to update job completion: {e}")
     
-    def download_single_track(self, tidal_track: Dict, download_dir: str, spotify_track: Dict) -> bool:
+    def update_job_volumes(self, job_id: str, volumes: List[Dict]):
+        """Publish the archive volumes sealed so far, while the job is still running"""
+        try:
+            response = self.client.post(f"/api/download/update-status/{job_id}", {'volumes': volumes})
+            print(f"Volume update response: {response.status_code}")
+        except Exception as e:
+            print(f"Failed to update job volumes: {e}")
+    
+    def open_session_pool(self) -> Optional[OrpheusSessionPool]:
+        """Shared in-process OrpheusDL sessions for a job, or None to use subprocesses"""
+        if self.engine != 'session':
+            return None
+        
+        try:
+            return get_session_pool(quality=self.quality, metrics=self.metrics)
+        except ImportError as e:
+            print(f"OrpheusDL not importable, falling back to subprocess engine: {e}")
+            return None
+    
+    def download_single_track(self, tidal_track: Dict, download_dir: str, spotify_track: Dict,
+                              sessions: Optional[OrpheusSessionPool] = None) -> bool:
+        """Download a single track, through the job's OrpheusDL sessions when available.
+        
+        Both engines are held to the per-track timeout; an in-process download
+        that runs over fails the attempt and keeps its throttle slot until it exits.
+        """
+        if sessions is not None and not sessions.failed:
+            try:
+                return sessions.download(tidal_track, download_dir, timeout=self.track_timeout)
+            except OrpheusSessionTimeout as e:
+                print(f"Download timeout for track: {e}")
+                self.throttle.hold(e.running)
+                self.metrics.increment('download_track_timeouts_total')
+                self._attempt.detail = 'timeout'
+                return False
+            except OrpheusSessionError as e:
+                print(f"OrpheusDL session unavailable, falling back to subprocess: {e}")
+            except Exception as e:
+                print(f"Download failed with exception: {e}")
+                self._attempt.detail = str(e)
+                return False
+        
+        return self.download_with_subprocess(tidal_track, download_dir)
+    
+    def download_with_subprocess(self, tidal_track: Dict, download_dir: str) -> bool:
         """Download a single track using OrpheusDL command line"""
         try:
-            # Create OrpheusDL config for this download
-            config = {
-                "global": {
-                    "module": "tidal",
-                    "quality": "hifi",
-                    "output": download_dir,
-                    "filename": "{artist} - {title}.{ext}"
-                },
-                "tidal": {
-                    # You'll need to set these up based on OrpheusDL's TIDAL module requirements
-                    "username": os.getenv('TIDAL_USERNAME'),
-                    "password": os.getenv('TIDAL_PASSWORD'),
-                    # Or use token-based auth if available
-                }
-            }
-            
-            # Create temporary config file
-            config_path = os.path.join(download_dir, 'temp_config.json')
-            with open(config_path, 'w') as f:
-                json.dump(config, f)
+            # One config file shared by every track; the subprocess writes into its cwd
+            config_path = self.orpheus_config.path()
             
             # Build OrpheusDL command
             tidal_url = tidal_track['url']
@@ -121,127 +2846,669 @@ class PlaylistDownloader:
                 cmd, 
                 capture_output=True, 
                 text=True, 
-                timeout=120,  # 2 minute timeout per track
+                timeout=self.track_timeout,
                 cwd=download_dir
             )
             
-            # Clean up config file
-            try:
-                os.remove(config_path)
-            except:
-                pass
-            
             if result.returncode == 0:
                 print(f"OrpheusDL output: {result.stdout}")
                 return True
             else:
                 print(f"OrpheusDL error: {result.stderr}")
+                self._attempt.detail = result.stderr
+                return False
+            
+        except subprocess.TimeoutExpired:
+            print(f"Download timeout for track")
+            self.metrics.increment('download_track_timeouts_total')
+            self._attempt.detail = 'timeout'
+            return False
+        except Exception as e:
+            print(f"Download failed with exception: {e}")
+            self._attempt.detail = str(e)
+            return False
+    
+    def retry_delay(self, attempt: int) -> float:
+        """Seconds to wait before retry number `attempt` (1-based), with full jitter"""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1)))
+    
+    def download_with_retries(self, tidal_track: Dict, download_dir: str, spotify_track: Dict,
+                              sessions: Optional[OrpheusSessionPool] = None) -> Tuple[bool, int]:
+        """Download a track through the throttle, retrying failed attempts.
+        
+        Returns whether the track downloaded and how many attempts it took.
+        Partial files of a failed attempt are removed before the next one.
+        """
+        attempts = 0
+        while True:
+            attempts += 1
+            self._attempt.detail = None
+            with self.throttle.slot():
+                success = self.download_single_track(tidal_track, download_dir, spotify_track, sessions=sessions)
+            outcome = self.throttle.record(success, self._attempt.detail)
+            
+            if success or attempts > self.retries:
+                return success, attempts
+            
+            for entry in os.listdir(download_dir):
+                path = os.path.join(download_dir, entry)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+            
+            delay = self.retry_delay(attempts)
+            print(f"Retrying in {delay:.1f}s after {outcome} (attempt {attempts + 1} of {self.retries + 1})")
+            self.metrics.increment('download_track_retries_total', outcome=outcome)
+            time.sleep(delay)
+    
+    def _track_name(self, track_item: Dict, index: int) -> str:
+        """Human readable "Artist - Title" name for a playlist track item"""
+        try:
+            spotify_track = track_item['track']['spotify']
+            return f"{spotify_track['artists'][0]['name']} - {spotify_track['name']}"
+        except (KeyError, IndexError, TypeError):
+            return f"Track {index + 1}"
+    
+    def _download_track_item(self, track_item: Dict, download_dir: str, track_name: str,
+                             sessions: Optional[OrpheusSessionPool] = None,
+                             budget: Optional[DiskBudget] = None,
+                             profile: Optional[OutputProfile] = None) -> Optional[List[str]]:
+        """Download one playlist track item into download_dir.
+        
+        Returns the files the track produced, relative to download_dir, or None
+        when the download failed. Only raises DiskBudgetExceeded, which ends the job.
+        """
+        try:
+            files = self._fetch_track_files(track_item['track'], download_dir, track_name, sessions, budget, profile)
+            
+            if files is not None:
+                print(f"✓ Successfully downloaded: {track_name}")
+            else:
+                print(f"✗ Failed to download: {track_name}")
+                self.metrics.increment('download_track_failures_total')
+            return files
+            
+        except DiskBudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Exception downloading {track_name}: {e}")
+            self.metrics.increment('download_track_failures_total')
+            return None
+    
+    def _fetch_track_files(self, track: Dict, download_dir: str, track_name: str,
+                           sessions: Optional[OrpheusSessionPool] = None,
+                           budget: Optional[DiskBudget] = None,
+                           profile: Optional[OutputProfile] = None) -> Optional[List[str]]:
+        """Serve a track from the cache or download it, staging it in its own dir.
+        
+        Staging tells us exactly which files belong to the track, and means files
+        only appear in download_dir once they are complete. When another job is
+        fetching the same track at the same time, its files are linked in rather
+        than downloading the track twice.
+        """
+        staging_dir = os.path.join(download_dir, f'.track-{uuid.uuid4().hex}')
+        os.makedirs(staging_dir)
+        
+        def adopt(source_dir: Optional[str]) -> bool:
+            # Another job fetched this track at the same moment; take a copy of its files
+            if source_dir is None:
                 return False
+            print(f"Sharing concurrent download: {track_name}")
+            TrackCache.link_tree(source_dir, staging_dir)
+            return True
+        
+        try:
+            fetched = self.scheduler.coalesce(
+                f"{self.quality}:{profile.cache_suffix if profile else 'original'}:{track_key(track)}",
+                lambda: staging_dir if self._fill_staging(
+                    track, staging_dir, track_name, sessions, budget, profile
+                ) else None,
+                adopt
+            )
+            if not fetched:
+                return None
             
-        except subprocess.TimeoutExpired:
-            print(f"Download timeout for track")
+            # OrpheusDL can exit cleanly without writing anything
+            files = []
+            for root, dirs, filenames in os.walk(staging_dir):
+                target_root = os.path.join(download_dir, os.path.relpath(root, staging_dir))
+                os.makedirs(target_root, exist_ok=True)
+                for file in filenames:
+                    target_path = os.path.join(target_root, file)
+                    os.replace(os.path.join(root, file), target_path)
+                    files.append(os.path.relpath(target_path, download_dir))
+            if not files:
+                print(f"No files were produced for {track_name}")
+                return None
+            return files
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    def _fill_staging(self, track: Dict, staging_dir: str, track_name: str,
+                      sessions: Optional[OrpheusSessionPool] = None, budget: Optional[DiskBudget] = None,
+                      profile: Optional[OutputProfile] = None) -> bool:
+        """Put a track's files in staging_dir from the cache or TIDAL; False if the download failed.
+        
+        With a profile, the files are transcoded and the transcode is cached
+        alongside the original, so either can be served next time.
+        """
+        tidal_track = track['tidal']
+        cache_key = TrackCache.key(tidal_track, track.get('isrc'), self.quality) if self.cache else None
+        profile_key = None
+        if self.cache and profile:
+            # Transcodes are keyed by ISRC, so re-releases of a recording share one
+            isrc = track.get('isrc') or tidal_track.get('isrc')
+            profile_key = TrackCache.key({} if isrc else tidal_track, isrc, f"{self.quality}-{profile.cache_suffix}")
+        
+        if profile_key and self.cache.fetch(profile_key, staging_dir):
+            print(f"Track cache hit ({profile.name}): {track_name}")
+            self.metrics.increment('download_cache_hits_total')
+            return True
+        
+        if not self._fill_original(tidal_track, cache_key, staging_dir, track_name, track['spotify'],
+                                   sessions, budget):
             return False
-        except Exception as e:
-            print(f"Download failed with exception: {e}")
+        
+        if profile is None:
+            return True
+        # The transcode sits next to its source until it replaces it, so it needs room of its own
+        with budget.reserve() if budget is not None else nullcontext():
+            transcoded = self.transcoder.transcode(staging_dir, tidal_track, profile, track_name)
+        if not transcoded:
+            return False
+        if profile_key:
+            self.cache.insert(profile_key, staging_dir)
+        return True
+    
+    def _fill_original(self, tidal_track: Dict, cache_key: Optional[str], staging_dir: str, track_name: str,
+                       spotify_track: Dict, sessions: Optional[OrpheusSessionPool] = None,
+                       budget: Optional[DiskBudget] = None) -> bool:
+        """Put the track as OrpheusDL downloads it in staging_dir, caching it under cache_key"""
+        if cache_key and self.cache.fetch(cache_key, staging_dir):
+            print(f"Track cache hit: {track_name}")
+            self.metrics.increment('download_cache_hits_total')
+            return True
+        
+        with budget.reserve() if budget is not None else nullcontext(), \
+                self.metrics.stage('track_download', track=track_name) as fields:
+            success, fields['attempts'] = self.download_with_retries(
+                tidal_track, staging_dir, spotify_track, sessions=sessions
+            )
+            fields['success'] = success
+            if success:
+                size = tree_size(staging_dir)
+                fields['bytes'] = size
+                self.metrics.increment('download_bytes_total', size)
+                if budget is not None:
+                    budget.record_track(size)
+        if not success:
             return False
+        
+        # An empty download fails the track later on; don't serve it to other jobs
+        if cache_key and os.listdir(staging_dir):
+            self.cache.insert(cache_key, staging_dir)
+        return True
     
-    def download_tracks(self, tracks: List[Dict], download_dir: str, job_id: str) -> tuple[List[str], List[str]]:
-        """Download tracks using OrpheusDL command line"""
-        successful_downloads = []
-        failed_tracks = []
+    def _download_and_package(self, track_item: Dict, download_dir: str, track_name: str,
+                               sessions: Optional[OrpheusSessionPool] = None,
+                               packager: Optional['StreamingZipPackager'] = None,
+                               manifest: Optional[JobManifest] = None,
+                               resumed: Optional[Dict[str, List[str]]] = None,
+                               deadline: Optional[float] = None,
+                               budget: Optional[DiskBudget] = None,
+                               profile: Optional[OutputProfile] = None) -> Optional[bool]:
+        """Worker task: download one track, record it and append its files to the archive.
+        
+        Returns None without downloading when the deadline passed before the track started.
+        The track is queued for audio analysis straight away. With delete_packed set, the
+        track's files are deleted once they're in the archive and the analysis is done with them.
+        """
+        key = track_key(track_item['track'])
+        files = resumed.get(key) if resumed else None
         
-        for i, track_item in enumerate(tracks):
-            track = track_item['track']
-            spotify_track = track['spotify']
-            tidal_track = track['tidal']
+        if files is not None:
+            print(f"Resuming with already downloaded track: {track_name}")
+        else:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            
+            files = self._download_track_item(track_item, download_dir, track_name, sessions, budget, profile)
+            if files is None:
+                if manifest is not None:
+                    manifest.record_failure(key, track_name)
+                return False
             
+            if manifest is not None:
+                manifest.record_track(key, track_name, download_dir, files)
+        
+        if self.analyzer is not None:
+            self.analyzer.submit(analysis_key(track_item['track']), download_dir, files)
+        
+        if packager is not None:
             try:
-                track_name = f"{spotify_track['artists'][0]['name']} - {spotify_track['name']}"
-                print(f"Downloading track {i+1}/{len(tracks)}: {track_name}")
-                
-                # Update progress
-                self.update_job_status(
-                    job_id, 
-                    'downloading', 
-                    i, 
-                    len(tracks),
-                    track_name
-                )
-                
-                # Use OrpheusDL to download the track
-                success = self.download_single_track(tidal_track, download_dir, spotify_track)
+                with self.metrics.stage('zip', track=track_name):
+                    packager.add_files(download_dir, files)
+            except Exception as e:
+                print(f"Failed to add {track_name} to zip: {e}")
+                return False
+            
+            if self.delete_packed:
+                def delete_files():
+                    for file in files:
+                        try:
+                            os.remove(os.path.join(download_dir, file))
+                        except OSError:
+                            pass
+                    if budget is not None:
+                        budget.released()
                 
-                if success:
-                    successful_downloads.append(track_name)
-                    print(f"✓ Successfully downloaded: {track_name}")
+                if self.analyzer is not None:
+                    # Analysis reads the files too; deleting them when it finishes keeps the worker free
+                    self.analyzer.when_done(analysis_key(track_item['track']), delete_files)
                 else:
-                    failed_tracks.append(track_name)
-                    print(f"✗ Failed to download: {track_name}")
-                    
-            except Exception as e:
-                print(f"Exception downloading {track_name}: {e}")
-                failed_tracks.append(track_name)
-                continue
+                    delete_files()
+        return True
+    
+    def download_tracks(self, tracks: List[Dict], download_dir: str, job_id: str,
+                        packager: Optional['StreamingZipPackager'] = None,
+                        manifest: Optional[JobManifest] = None,
+                        deadline: Optional[float] = None,
+                        budget: Optional[DiskBudget] = None,
+                        profile: Optional[OutputProfile] = None,
+                        progress_base: int = 0,
+                        progress_total: Optional[int] = None) -> tuple[List[str], List[str]]:
+        """Download tracks on the shared track scheduler, at most max_workers at a time.
+        
+        Results are reported in playlist order regardless of completion order.
+        When a packager is given, each track is added to the archive by its worker
+        as soon as it finishes downloading. Tracks the manifest already records as
+        finished are not downloaded again. Tracks that haven't started by the
+        deadline (a time.monotonic() value) are left out of both lists. When the
+        disk budget runs out, tracks not yet started are cancelled and
+        DiskBudgetExceeded is raised. Tracks preflight finds unavailable fail
+        without a download attempt, and the rest start longest first. With a
+        profile, each track is transcoded as soon as it is downloaded. A chunk of a
+        larger playlist passes progress_base (tracks settled outside it) and
+        progress_total so status updates count against the whole playlist.
+        """
+        total = len(tracks)
+        track_names = [self._track_name(track_item, i) for i, track_item in enumerate(tracks)]
+        results: List[Optional[bool]] = [None] * total
+        resumed = manifest.completed_tracks(download_dir) if manifest is not None else {}
+        
+        # Resumed tracks are already settled; only the rest need checking
+        pending = [i for i, track_item in enumerate(tracks) if track_key(track_item['track']) not in resumed]
+        with self.metrics.stage('preflight', tracks=len(pending)) as fields:
+            report = self.preflight.run([tracks[i] for i in pending])
+            fields.update(skipped=len(report.skipped), estimated_bytes=report.estimated_bytes,
+                          estimated_seconds=round(report.estimated_seconds))
+        for j, reason in report.skipped.items():
+            i = pending[j]
+            print(f"Skipping {track_names[i]}: {reason}")
+            results[i] = False
+            self.metrics.increment('download_preflight_skipped_total', reason=reason)
+            if manifest is not None:
+                manifest.record_failure(track_key(tracks[i]['track']), track_names[i])
+        order = [i for i in range(total) if track_key(tracks[i]['track']) in resumed] + [pending[j] for j in report.order]
+        completed = len(report.skipped)
+        
+        print(f"Downloading {len(order)} tracks with up to {self.max_workers} workers")
+        reported_total = progress_total if progress_total is not None else total
+        self.update_job_status(job_id, 'downloading', progress_base + completed, reported_total, None,
+                               estimate=report.summary())
+        
+        # Imported and logged in once for the whole job
+        sessions = self.open_session_pool()
+        progress = ProgressReporter(
+            lambda current, _, current_track: self.update_job_status(
+                job_id, 'downloading', progress_base + current, reported_total, current_track
+            )
+        )
+        
+        futures = {
+            self.scheduler.submit(
+                job_id, self._download_and_package, tracks[i], download_dir, track_names[i],
+                sessions, packager, manifest, resumed, deadline, budget, profile, limit=self.max_workers
+            ): i
+            for i in order
+        }
+        
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if results[i] is None:
+                    continue
+                completed += 1
+                
+                # Update progress
+                progress.update(completed, total, track_names[i])
+        except BaseException:
+            # Drop the tracks that haven't started and let the running ones finish
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
+        
+        progress.flush()
+        
+        successful_downloads = [name for name, success in zip(track_names, results) if success]
+        failed_tracks = [name for name, success in zip(track_names, results) if success is False]
         
         return successful_downloads, failed_tracks
     
-    def create_zip(self, successful_downloads: List[str], temp_dir: str, playlist_name: str) -> str:
-        """Create zip file from downloaded tracks"""
+    def _zip_filename(self, playlist_name: str) -> str:
+        """Archive filename for a playlist"""
         # Clean playlist name for filename
         clean_name = playlist_name.replace(' ', '_').replace('/', '_')
-        zip_filename = f"{clean_name}-{int(time.time())}.zip"
+        return f"{clean_name}-{int(time.time())}.zip"
+    
+    def create_zip(self, successful_downloads: List[str], temp_dir: str, playlist_name: str) -> str:
+        """Create zip file from downloaded tracks, compressing entries in parallel"""
+        zip_filename = self._zip_filename(playlist_name)
         zip_path = os.path.join(temp_dir, zip_filename)
         
         download_dir = os.path.join(temp_dir, 'tracks')
         
         print(f"Creating zip file: {zip_filename}")
         
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(download_dir):
-                for file in files:
-                    # Skip config files
-                    if file.endswith('.json'):
-                        continue
-                        
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, download_dir)
-                    zipf.write(file_path, arcname)
-                    print(f"Added to zip: {arcname}")
+        files = []
+        for root, dirs, filenames in os.walk(download_dir):
+            for file in filenames:
+                # Skip config files
+                if is_config_file(file):
+                    continue
+                files.append(os.path.relpath(os.path.join(root, file), download_dir))
+        
+        write_zip_parallel(zip_path, download_dir, files)
         
         print(f"Zip created successfully: {zip_path}")
         return zip_path
     
-    def process_download(self, job_id: str) -> Dict:
-        """Main download processing logic"""
+    def sweep_stale_jobs(self) -> int:
+        """Delete the work dirs and sync manifests of jobs untouched for job_ttl seconds, returning how many went.
+        
+        Failed and abandoned jobs keep their dirs so they can resume, and stream
+        delivery keeps a finished job's tracks for repeat fetches; this is what
+        eventually frees them. Runs on prewarm and at most once per job_ttl after.
+        """
+        self._last_sweep = time.monotonic()
+        cutoff = time.time() - self.job_ttl
         try:
-            print(f"Starting download process for job {job_id}")
+            names = os.listdir(self.work_dir)
+        except FileNotFoundError:
+            return 0
+        
+        removed = 0
+        for name in names:
+            # Skips .sync, .analysis and the shared OrpheusDL config
+            job_dir = os.path.join(self.work_dir, name)
+            if not re.fullmatch(r'[A-Za-z0-9_-]+', name) or not os.path.isdir(job_dir):
+                continue
+            # The manifest and tracks dir change with every finished track
+            paths = (job_dir, os.path.join(job_dir, 'manifest.json'), os.path.join(job_dir, 'tracks'))
+            try:
+                touched = max(os.path.getmtime(path) for path in paths if os.path.exists(path))
+            except (OSError, ValueError):
+                continue
+            if touched < cutoff:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                self.metrics.increment('job_dirs_expired_total')
+                removed += 1
+        
+        sync_dir = os.path.join(self.work_dir, '.sync')
+        try:
+            manifests = os.listdir(sync_dir)
+        except FileNotFoundError:
+            manifests = []
+        expired_manifests = 0
+        for name in manifests:
+            path = os.path.join(sync_dir, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            self.metrics.increment('sync_manifests_expired_total')
+            expired_manifests += 1
+        
+        if removed or expired_manifests:
+            print(f"Deleted {removed} expired job dirs and {expired_manifests} sync manifests")
+        return removed + expired_manifests
+    
+    def job_work_dir(self, job_id: str) -> str:
+        """Work dir holding a job's tracks and manifest"""
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', job_id):
+            raise ValueError(f"Invalid job id: {job_id}")
+        return os.path.join(self.work_dir, job_id)
+    
+    def job_tracks_dir(self, job_id: str) -> str:
+        """Directory a job's tracks are downloaded into"""
+        return os.path.join(self.job_work_dir(job_id), 'tracks')
+    
+    def _prepare_job_dir(self, job_id: str) -> str:
+        """Create the job's tracks dir, clearing staging dirs left by an interrupted run"""
+        download_dir = self.job_tracks_dir(job_id)
+        os.makedirs(download_dir, exist_ok=True)
+        
+        for name in os.listdir(download_dir):
+            if name.startswith('.track-'):
+                shutil.rmtree(os.path.join(download_dir, name), ignore_errors=True)
+        return download_dir
+    
+    def stream_archive(self, job_id: str) -> Iterator[bytes]:
+        """Yield the job's zip archive built from its kept tracks.
+        
+        The tracks stay until the job dir expires (see sweep_stale_jobs), so the
+        download link works more than once.
+        """
+        tracks_dir = self.job_tracks_dir(job_id)
+        if not os.path.isdir(tracks_dir):
+            raise FileNotFoundError(f"No tracks for job {job_id}")
+        
+        yield from stream_zip(tracks_dir)
+        print(f"Streamed archive for job {job_id}")
+    
+    def sync_manifest_path(self, job_id: str) -> str:
+        """Where a finished job's sync manifest is kept; '.sync' can't clash with a job id"""
+        self.job_work_dir(job_id)  # validates the id
+        return os.path.join(self.work_dir, '.sync', f'{job_id}.json')
+    
+    def load_sync_manifest(self, job_id: str) -> Optional[Dict]:
+        """Sync manifest of a finished job, or None when there isn't one"""
+        try:
+            with open(self.sync_manifest_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _sync_plan(self, job_details: Dict, downloadable_tracks: List[Dict]) -> Optional[SyncPlan]:
+        """Diff against the job named by syncFrom (or an inline syncManifest), if any"""
+        previous = job_details.get('syncManifest')
+        previous_job = job_details.get('syncFrom')
+        if previous is None and previous_job:
+            previous = self.load_sync_manifest(previous_job)
+            if previous is None:
+                print(f"No sync manifest for job {previous_job}, downloading every track")
+        if previous is None:
+            return None
+        
+        added, retained, removed = diff_tracks(downloadable_tracks, previous)
+        plan = SyncPlan(previous_job or previous.get('jobId'), job_details.get('syncMode', 'delta'),
+                        added, retained, removed)
+        print(f"Sync against {plan.previous_job}: {len(added)} added, {len(retained)} retained, "
+              f"{len(removed)} removed")
+        
+        if plan.mode == 'full':
+            # The previous job's files are gone, so retained tracks the cache lost are downloaded again
+            plan.cached = 0
+            for item in downloadable_tracks:
+                track = item['track']
+                if track_key(track) not in retained or self.cache is None:
+                    continue
+                if self.cache.contains(TrackCache.key(track['tidal'], track.get('isrc'), self.quality)):
+                    plan.cached += 1
+            if plan.cached < len(retained):
+                print(f"{len(retained) - plan.cached} retained tracks are no longer cached and will be downloaded "
+                      "again")
+        return plan
+    
+    def _write_analysis(self, job_id: str, downloadable_tracks: List[Dict], download_dir: str,
+                        manifest: JobManifest) -> Optional[List[Dict]]:
+        """Collect the analysis of every finished track into ANALYSIS_MANIFEST in download_dir.
+        
+        Analyses still running are waited for, and tracks finished by an earlier
+        chunk are analysed now. Returns None when analysis is disabled.
+        """
+        if self.analyzer is None:
+            return None
+        
+        recorded = manifest.load()['tracks']
+        finished = [
+            (i, track_item) for i, track_item in enumerate(downloadable_tracks)
+            if track_key(track_item['track']) in recorded
+        ]
+        
+        with self.metrics.stage('analysis', job_id=job_id, tracks=len(finished)):
+            for _, track_item in finished:
+                files = [
+                    f['path'] for f in recorded[track_key(track_item['track'])]['files']
+                    if os.path.exists(os.path.join(download_dir, f['path']))
+                ]
+                self.analyzer.submit(analysis_key(track_item['track']), download_dir, files)
             
-            # Get job details from Next.js API
+            analysis = []
+            for i, track_item in finished:
+                result = self.analyzer.result(analysis_key(track_item['track']))
+                if result is None:
+                    continue
+                tidal_track = track_item['track'].get('tidal') or {}
+                analysis.append({
+                    'track': self._track_name(track_item, i),
+                    'isrc': track_item['track'].get('isrc') or tidal_track.get('isrc'),
+                    'tidalId': tidal_track.get('id'),
+                    **result
+                })
+        
+        path = os.path.join(download_dir, ANALYSIS_MANIFEST)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'tracks': analysis}, f, indent=2)
+        os.replace(temp_path, path)
+        return analysis
+    
+    def _record_sync_manifest(self, job_id: str, downloadable_tracks: List[Dict], download_dir: str,
+                              manifest: JobManifest, sync_plan: Optional[SyncPlan]):
+        """Save which tracks the finished job covers, so a later job can sync from it.
+        
+        A delta job carries over the retained entries of the job it synced from,
+        so the manifest always describes the whole playlist.
+        """
+        # Recorded tracks, whether or not their files were already deleted after packing
+        completed = {key: [f['path'] for f in entry['files']] for key, entry in manifest.load()['tracks'].items()}
+        tracks = dict(sync_plan.retained) if sync_plan is not None and sync_plan.mode == 'delta' else {}
+        
+        for i, track_item in enumerate(downloadable_tracks):
+            key = track_key(track_item['track'])
+            if key not in completed:
+                continue
+            tidal_track = track_item['track'].get('tidal') or {}
+            tracks[key] = {
+                'name': self._track_name(track_item, i),
+                'tidalId': tidal_track.get('id'),
+                'isrc': track_item['track'].get('isrc') or tidal_track.get('isrc'),
+                'files': completed[key]
+            }
+        
+        path = self.sync_manifest_path(job_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'jobId': job_id, 'quality': self.quality, 'tracks': tracks}, f)
+        os.replace(temp_path, path)
+    
+    def _load_job(self, job_id: str) -> Tuple[Dict, List[Dict], Optional[SyncPlan], Optional[OutputProfile]]:
+        """Fetch the job's playlist, the tracks to process, its sync plan and its output profile.
+        
+        The tracks are the TIDAL matched ones, narrowed to the added tracks for a
+        delta sync job.
+        """
+        # Get job details from Next.js API
+        with self.metrics.stage('fetch_job', job_id=job_id):
             job_details = self.get_job_details(job_id)
-            if not job_details:
-                raise Exception("Job not found")
-            
-            # Get enhanced playlist data
+        if not job_details:
+            raise Exception("Job not found")
+        
+        profile = OutputProfile.from_job(job_details)
+        if profile is not None and not Transcoder.available():
+            raise Exception(f"ffmpeg is required for the {profile.name} output profile")
+        
+        # Get enhanced playlist data
+        with self.metrics.stage('fetch_playlist', job_id=job_id):
             playlist_data = self.get_playlist_data(job_details['playlistId'])
-            if not playlist_data:
-                raise Exception("Playlist not found")
+        if not playlist_data:
+            raise Exception("Playlist not found")
+        
+        # Filter downloadable tracks (TIDAL matches only)
+        downloadable_tracks = [
+            item for item in playlist_data['tracks']['items']
+            if item['track']['matchStatus'] == 'matched'
+        ]
+        
+        print(f"Found {len(downloadable_tracks)} downloadable tracks")
+        
+        sync_plan = self._sync_plan(job_details, downloadable_tracks)
+        if sync_plan is not None and sync_plan.mode == 'delta':
+            if not sync_plan.added:
+                raise Exception(f"No new tracks since job {sync_plan.previous_job}")
+            downloadable_tracks = sync_plan.added
+        
+        return playlist_data, downloadable_tracks, sync_plan, profile
+    
+    def process_download(self, job_id: str, track_range: Optional[Tuple[int, int]] = None,
+                         time_budget: Optional[float] = None) -> Dict:
+        """Main download processing logic.
+        
+        Tracks and a manifest of finished tracks are kept in the job's work dir
+        until the job completes, so calling this again for a job that died part
+        way through only downloads the remaining tracks.
+        
+        Passing a track_range (start, end) and/or a time_budget in seconds runs a
+        single chunk of the job instead; see _process_chunk.
+        """
+        try:
+            print(f"Starting download process for job {job_id}")
+            if self._last_sweep is None or time.monotonic() - self._last_sweep >= self.job_ttl:
+                self.sweep_stale_jobs()
             
-            # Filter downloadable tracks (TIDAL matches only)
-            downloadable_tracks = [
-                item for item in playlist_data['tracks']['items']
-                if item['track']['matchStatus'] == 'matched'
-            ]
+            playlist_data, downloadable_tracks, sync_plan, profile = self._load_job(job_id)
             
-            print(f"Found {len(downloadable_tracks)} downloadable tracks")
+            job_dir = self.job_work_dir(job_id)
+            download_dir = self._prepare_job_dir(job_id)
+            manifest = JobManifest(job_dir)
             
-            # Create temp directory for downloads
-            with tempfile.TemporaryDirectory() as temp_dir:
-                download_dir = os.path.join(temp_dir, 'tracks')
-                os.makedirs(download_dir)
-                
-                # Download tracks
+            if track_range is not None or time_budget is not None:
+                return self._process_chunk(
+                    job_id, playlist_data, downloadable_tracks, download_dir, manifest, track_range, time_budget,
+                    sync_plan, profile
+                )
+            
+            if self.delivery_mode == 'stream':
+                return self._process_stream_delivery(job_id, downloadable_tracks, download_dir, manifest, sync_plan,
+                                                     profile)
+            
+            if self.volume_splitter is not None:
+                return self._process_volumes(job_id, downloadable_tracks, download_dir, manifest, sync_plan, profile)
+            
+            zip_path = os.path.join(job_dir, self._zip_filename(playlist_data['name']))
+            
+            # Download tracks, zipping each one as soon as it lands
+            with StreamingZipPackager(zip_path) as packager:
                 successful_downloads, failed_tracks = self.download_tracks(
-                    downloadable_tracks, download_dir, job_id
+                    downloadable_tracks, download_dir, job_id, packager=packager, manifest=manifest,
+                    budget=DiskBudget(job_dir, cache=self.cache), profile=profile
                 )
                 
                 if not successful_downloads:
@@ -249,55 +3516,507 @@ class PlaylistDownloader:
                 
                 print(f"Successfully downloaded {len(successful_downloads)} tracks")
                 
-                # Update status to zipping
+                # Update status to zipping; only the central directory is left to write
                 self.update_job_status(job_id, 'zipping', len(successful_downloads), len(downloadable_tracks))
                 
-                # Create zip
-                zip_path = self.create_zip(successful_downloads, temp_dir, playlist_data['name'])
-                
-                # Move zip to /tmp for Next.js to serve
-                final_zip_path = f"/tmp/{job_id}.zip"
-                shutil.move(zip_path, final_zip_path)
-                
-                # Update job as completed
-                download_url = f"/api/download/file/{job_id}"
-                self.update_job_completion(job_id, download_url, failed_tracks)
-                
-                print(f"Download process completed for job {job_id}")
-                
-                return {
-                    'success': True,
-                    'downloadUrl': download_url,
-                    'successfulTracks': len(successful_downloads),
-                    'failedTracks': len(failed_tracks)
-                }
+                analysis = self._write_analysis(job_id, downloadable_tracks, download_dir, manifest)
+                with self.metrics.stage('zip', job_id=job_id):
+                    if analysis is not None:
+                        packager.add_files(download_dir, [ANALYSIS_MANIFEST])
+                    packager.close()
+            
+            self._record_sync_manifest(job_id, downloadable_tracks, download_dir, manifest, sync_plan)
+            return self._publish_archive(job_id, zip_path, successful_downloads, failed_tracks, sync_plan, analysis)
                 
         except Exception as e:
             print(f"Download process failed for job {job_id}: {e}")
+            self.metrics.increment('download_jobs_total', status='failed')
             # Update job as failed
             self.update_job_status(job_id, 'failed', 0, 0, None, str(e))
             raise
+    
+    def _process_chunk(self, job_id: str, playlist_data: Dict, downloadable_tracks: List[Dict], download_dir: str,
+                       manifest: JobManifest, track_range: Optional[Tuple[int, int]],
+                       time_budget: Optional[float], sync_plan: Optional[SyncPlan] = None,
+                       profile: Optional[OutputProfile] = None) -> Dict:
+        """Download as many tracks of track_range as fit in time_budget.
+        
+        Tracks already started when the budget runs out are allowed to finish, so
+        callers should leave at least TRACK_TIMEOUT of headroom below their own
+        duration limit. The result carries a continuation token for the tracks
+        left in the range. Whichever chunk finds no tracks left in the whole
+        playlist assembles the archive.
+        """
+        total = len(downloadable_tracks)
+        start, end = track_range if track_range is not None else (0, total)
+        start, end = max(0, start), min(total, end)
+        deadline = time.monotonic() + time_budget if time_budget is not None else None
+        
+        print(f"Processing tracks {start}-{end} of job {job_id}")
+        
+        # Progress covers the whole playlist, so count what other chunks already settled
+        settled = set(manifest.completed_tracks(download_dir)) | manifest.failed_keys()
+        settled_elsewhere = sum(
+            1 for i, item in enumerate(downloadable_tracks)
+            if not start <= i < end and track_key(item['track']) in settled
+        )
+        
+        successful_downloads, failed_tracks = self.download_tracks(
+            downloadable_tracks[start:end], download_dir, job_id, manifest=manifest, deadline=deadline,
+            budget=DiskBudget(self.job_work_dir(job_id), cache=self.cache), profile=profile,
+            progress_base=settled_elsewhere, progress_total=total
+        )
+        
+        done = set(manifest.completed_tracks(download_dir)) | manifest.failed_keys()
+        outstanding = [
+            i for i, item in enumerate(downloadable_tracks)
+            if track_key(item['track']) not in done
+        ]
+        remaining = [i for i in outstanding if start <= i < end]
+        
+        result = {
+            'success': True,
+            'complete': False,
+            'successfulTracks': len(successful_downloads),
+            'failedTracks': len(failed_tracks),
+            'remainingTracks': len(remaining),
+            'continuation': encode_continuation(job_id, remaining[0], end) if remaining else None
+        }
+        
+        if not outstanding and manifest.claim_finalize():
+            result.update(self._finalize(job_id, playlist_data, downloadable_tracks, download_dir, manifest, sync_plan))
+            result['complete'] = True
+        
+        return result
+    
+    def finalize_download(self, job_id: str) -> Dict:
+        """Assemble and publish the archive of a chunked job from the tracks finished so far"""
+        try:
+            playlist_data, downloadable_tracks, sync_plan, _ = self._load_job(job_id)
+            download_dir = self.job_tracks_dir(job_id)
+            manifest = JobManifest(self.job_work_dir(job_id))
+            
+            result = self._finalize(job_id, playlist_data, downloadable_tracks, download_dir, manifest, sync_plan)
+            result['complete'] = True
+            return result
+            
+        except Exception as e:
+            print(f"Download process failed for job {job_id}: {e}")
+            self.metrics.increment('download_jobs_total', status='failed')
+            self.update_job_status(job_id, 'failed', 0, 0, None, str(e))
+            raise
+    
+    def _finalize(self, job_id: str, playlist_data: Dict, downloadable_tracks: List[Dict], download_dir: str,
+                  manifest: JobManifest, sync_plan: Optional[SyncPlan] = None) -> Dict:
+        """Build the archive from every track the manifest records as finished"""
+        completed = manifest.completed_tracks(download_dir)
+        successful_downloads, failed_tracks, files = [], [], []
+        
+        for i, track_item in enumerate(downloadable_tracks):
+            track_name = self._track_name(track_item, i)
+            key = track_key(track_item['track'])
+            if key in completed:
+                successful_downloads.append(track_name)
+                files.extend(completed[key])
+            else:
+                failed_tracks.append(track_name)
+        
+        if not successful_downloads:
+            raise Exception("No tracks could be downloaded")
+        
+        self._record_sync_manifest(job_id, downloadable_tracks, download_dir, manifest, sync_plan)
+        analysis = self._write_analysis(job_id, downloadable_tracks, download_dir, manifest)
+        
+        if self.delivery_mode == 'stream':
+            return self._publish_stream(job_id, successful_downloads, failed_tracks, sync_plan, analysis)
+        
+        self.update_job_status(job_id, 'zipping', len(successful_downloads), len(downloadable_tracks))
+        
+        if self.volume_splitter is not None:
+            return self._finalize_volumes(job_id, downloadable_tracks, download_dir, completed,
+                                          successful_downloads, failed_tracks, sync_plan, analysis)
+        
+        zip_path = os.path.join(self.job_work_dir(job_id), self._zip_filename(playlist_data['name']))
+        files = [f for f in files if not f.endswith('.json')]
+        if analysis is not None:
+            files.append(ANALYSIS_MANIFEST)
+        budget = DiskBudget(self.job_work_dir(job_id), cache=self.cache)
+        # Without a budget the archive sits next to the tracks until it's done, and audio barely compresses
+        budget.ensure_room(0 if budget.limited else sum(os.path.getsize(os.path.join(download_dir, f)) for f in files))
+        with self.metrics.stage('zip', job_id=job_id):
+            # Under a budget each track is deleted as it's written, so the job dir doesn't double
+            write_zip_parallel(zip_path, download_dir, files, delete_sources=budget.limited)
+        
+        return self._publish_archive(job_id, zip_path, successful_downloads, failed_tracks, sync_plan, analysis)
+    
+    def _process_volumes(self, job_id: str, downloadable_tracks: List[Dict], download_dir: str,
+                         manifest: JobManifest, sync_plan: Optional[SyncPlan] = None,
+                         profile: Optional[OutputProfile] = None) -> Dict:
+        """Download into volumes, publishing each one as soon as it is sealed"""
+        job_dir = self.job_work_dir(job_id)
+        volumes: List[Dict] = []
+        
+        packager = VolumePackager(
+            lambda part: os.path.join(job_dir, f'part{part}.zip'),
+            self.volume_splitter,
+            lambda part, path, tracks: self._publish_volume(job_id, volumes, part, path, tracks)
+        )
+        with packager:
+            successful_downloads, failed_tracks = self.download_tracks(
+                downloadable_tracks, download_dir, job_id, packager=packager, manifest=manifest,
+                budget=DiskBudget(job_dir, cache=self.cache), profile=profile
+            )
+            
+            if not successful_downloads:
+                raise Exception("No tracks could be downloaded")
+            
+            self.update_job_status(job_id, 'zipping', len(successful_downloads), len(downloadable_tracks))
+            
+            analysis = self._write_analysis(job_id, downloadable_tracks, download_dir, manifest)
+            with self.metrics.stage('zip', job_id=job_id):
+                if analysis is not None:
+                    # Goes in the last volume
+                    packager.add_files(download_dir, [ANALYSIS_MANIFEST], track=False)
+                packager.close()
+        
+        self._record_sync_manifest(job_id, downloadable_tracks, download_dir, manifest, sync_plan)
+        return self._publish_volumes(job_id, volumes, successful_downloads, failed_tracks, sync_plan, analysis)
+    
+    def _finalize_volumes(self, job_id: str, downloadable_tracks: List[Dict], download_dir: str,
+                          completed: Dict[str, List[str]], successful_downloads: List[str],
+                          failed_tracks: List[str], sync_plan: Optional[SyncPlan] = None,
+                          analysis: Optional[List[Dict]] = None) -> Dict:
+        """Write and publish the volumes of a chunked job one at a time, in playlist order"""
+        tracks = []
+        for track_item in downloadable_tracks:
+            files = [f for f in completed.get(track_key(track_item['track']), []) if not f.endswith('.json')]
+            if files:
+                tracks.append((files, sum(os.path.getsize(os.path.join(download_dir, f)) for f in files)))
+        
+        groups = self.volume_splitter.group(tracks)
+        if not groups:
+            raise Exception("No tracks could be downloaded")
+        if analysis is not None:
+            # Goes in the last volume
+            groups[-1] = (groups[-1][0] + [ANALYSIS_MANIFEST], groups[-1][1])
+        
+        budget = DiskBudget(self.job_work_dir(job_id), cache=self.cache)
+        volumes: List[Dict] = []
+        for part, (files, track_count) in enumerate(groups, 1):
+            zip_path = os.path.join(self.job_work_dir(job_id), f'part{part}.zip')
+            with self.metrics.stage('zip', job_id=job_id, part=part):
+                write_zip_parallel(zip_path, download_dir, files, delete_sources=budget.limited)
+            self._publish_volume(job_id, volumes, part, zip_path, track_count)
+        
+        return self._publish_volumes(job_id, volumes, successful_downloads, failed_tracks, sync_plan, analysis)
+    
+    def _publish_volume(self, job_id: str, volumes: List[Dict], part: int, zip_path: str, tracks: int):
+        """Hand a sealed volume over to Next.js and publish its URL straight away"""
+        final_zip_path = f"/tmp/{job_id}.part{part}.zip"
+        with self.metrics.stage('move', job_id=job_id, part=part):
+            shutil.move(zip_path, final_zip_path)
+        
+        volumes.append({
+            'part': part,
+            'url': f"/api/download/file/{job_id}?part={part}",
+            'tracks': tracks,
+            'bytes': os.path.getsize(final_zip_path)
+        })
+        print(f"Published zip part {part} for job {job_id}")
+        self.update_job_volumes(job_id, volumes)
+    
+    def _publish_volumes(self, job_id: str, volumes: List[Dict], successful_downloads: List[str],
+                         failed_tracks: List[str], sync_plan: Optional[SyncPlan] = None,
+                         analysis: Optional[List[Dict]] = None) -> Dict:
+        """Mark a volume-split job completed once its last volume is published"""
+        if not volumes:
+            raise Exception("No tracks could be downloaded")
+        shutil.rmtree(self.job_work_dir(job_id), ignore_errors=True)
+        
+        sync = sync_plan.summary() if sync_plan is not None else None
+        self.update_job_completion(job_id, volumes[0]['url'], failed_tracks, sync=sync, volumes=volumes,
+                                   analysis=analysis)
+        self.metrics.increment('download_jobs_total', status='completed')
+        
+        print(f"Download process completed for job {job_id} in {len(volumes)} parts")
+        
+        result = {
+            'success': True,
+            'downloadUrl': volumes[0]['url'],
+            'volumes': volumes,
+            'successfulTracks': len(successful_downloads),
+            'failedTracks': len(failed_tracks)
+        }
+        if sync is not None:
+            result['sync'] = sync
+        return result
+    
+    def _publish_archive(self, job_id: str, zip_path: str, successful_downloads: List[str],
+                         failed_tracks: List[str], sync_plan: Optional[SyncPlan] = None,
+                         analysis: Optional[List[Dict]] = None) -> Dict:
+        """Hand the finished zip over to Next.js and mark the job completed"""
+        print(f"Zip created successfully: {zip_path}")
+        
+        # Move zip to /tmp for Next.js to serve
+        final_zip_path = f"/tmp/{job_id}.zip"
+        with self.metrics.stage('move', job_id=job_id):
+            shutil.move(zip_path, final_zip_path)
+        
+        # Finished; nothing left to resume
+        shutil.rmtree(self.job_work_dir(job_id), ignore_errors=True)
+        
+        # Update job as completed
+        download_url = f"/api/download/file/{job_id}"
+        sync = sync_plan.summary() if sync_plan is not None else None
+        self.update_job_completion(job_id, download_url, failed_tracks, sync=sync, analysis=analysis)
+        self.metrics.increment('download_jobs_total', status='completed')
+        
+        print(f"Download process completed for job {job_id}")
+        
+        result = {
+            'success': True,
+            'downloadUrl': download_url,
+            'successfulTracks': len(successful_downloads),
+            'failedTracks': len(failed_tracks)
+        }
+        if sync is not None:
+            result['sync'] = sync
+        return result
+    
+    def _process_stream_delivery(self, job_id: str, downloadable_tracks: List[Dict], download_dir: str,
+                                 manifest: JobManifest, sync_plan: Optional[SyncPlan] = None,
+                                 profile: Optional[OutputProfile] = None) -> Dict:
+        """Download into the job's kept tracks dir; the archive is only built when fetched"""
+        successful_downloads, failed_tracks = self.download_tracks(
+            downloadable_tracks, download_dir, job_id, manifest=manifest,
+            budget=DiskBudget(self.job_work_dir(job_id), cache=self.cache), profile=profile
+        )
+        
+        if not successful_downloads:
+            raise Exception("No tracks could be downloaded")
+        
+        print(f"Successfully downloaded {len(successful_downloads)} tracks")
+        
+        self._record_sync_manifest(job_id, downloadable_tracks, download_dir, manifest, sync_plan)
+        analysis = self._write_analysis(job_id, downloadable_tracks, download_dir, manifest)
+        return self._publish_stream(job_id, successful_downloads, failed_tracks, sync_plan, analysis)
+    
+    def _publish_stream(self, job_id: str, successful_downloads: List[str], failed_tracks: List[str],
+                        sync_plan: Optional[SyncPlan] = None, analysis: Optional[List[Dict]] = None) -> Dict:
+        """Mark a stream-delivery job completed; its tracks stay until the archive is fetched"""
+        download_url = f"/api/download/file/{job_id}"
+        sync = sync_plan.summary() if sync_plan is not None else None
+        self.update_job_completion(job_id, download_url, failed_tracks, delivery='stream', sync=sync,
+                                   analysis=analysis)
+        self.metrics.increment('download_jobs_total', status='completed')
+        
+        print(f"Download process completed for job {job_id}, archive will be streamed")
+        
+        result = {
+            'success': True,
+            'downloadUrl': download_url,
+            'successfulTracks': len(successful_downloads),
+            'failedTracks': len(failed_tracks)
+        }
+        if sync is not None:
+            result['sync'] = sync
+        return result
+
+
+def _parse_download_request(data: Dict) -> Tuple[str, Optional[Tuple[int, int]], bool, Optional[float]]:
+    """Job id, track range, finalize flag and time budget of a POST body. Raises ValueError when malformed."""
+    job_id = data.get('jobId')
+    track_range = data.get('trackRange')
+    time_budget = data.get('timeBudget')
+    
+    if 'timeBudget' in data and (
+        isinstance(time_budget, bool) or not isinstance(time_budget, (int, float)) or time_budget < 0
+    ):
+        raise ValueError(f"Invalid timeBudget: {time_budget!r}")
+    
+    if data.get('continuation'):
+        job_id, start, end = decode_continuation(data['continuation'])
+        track_range = (start, end)
+    
+    if not job_id:
+        raise ValueError("Missing jobId")
+    
+    track_range = tuple(track_range) if track_range is not None else None
+    return job_id, track_range, bool(data.get('finalize')), time_budget
+
+
+def download_request_key(data: Dict) -> str:
+    """Identity of a download request, so the same work isn't queued twice"""
+    job_id, track_range, finalize, _ = _parse_download_request(data)
+    if finalize:
+        return f"{job_id}:finalize"
+    if track_range is not None:
+        return f"{job_id}:{track_range[0]}-{track_range[1]}"
+    return job_id
+
+
+def run_download_request(downloader: PlaylistDownloader, data: Dict) -> Dict:
+    """Run the download action described by a POST body.
+    
+    Accepts {"jobId"} for a whole job, optionally with "trackRange": [start, end]
+    and/or "timeBudget" (seconds) to run one chunk, {"continuation": token} to
+    pick up where a chunk stopped, or {"jobId", "finalize": true} to assemble
+    the archive of a chunked job. Raises ValueError for malformed requests.
+    """
+    job_id, track_range, finalize, time_budget = _parse_download_request(data)
+    
+    if finalize:
+        return downloader.finalize_download(job_id)
+    
+    return downloader.process_download(job_id, track_range=track_range, time_budget=time_budget)
+
+
+class WorkerQueueFull(Exception):
+    """Raised when the worker queue has no room for another job"""
+
+
+class DownloadWorkerPool:
+    """Background workers draining a bounded local queue of download requests.
+    
+    At most max_jobs requests run at once. Submitting a request that is already
+    queued or running is a no-op, and a full queue raises WorkerQueueFull so the
+    HTTP layer can push back on the caller.
+    """
+    
+    def __init__(self, downloader: PlaylistDownloader, max_jobs: Optional[int] = None,
+                 max_queue: Optional[int] = None):
+        self.downloader = downloader
+        self.max_jobs = max(1, max_jobs or int(os.getenv('WORKER_MAX_JOBS', '2')))
+        self._queue = queue.Queue(maxsize=max_queue or int(os.getenv('WORKER_QUEUE_SIZE', '32')))
+        self._pending = set()  # keys of queued or running requests
+        self._lock = threading.Lock()
+        self._threads = []
+    
+    def start(self):
+        for i in range(self.max_jobs):
+            thread = threading.Thread(target=self._work, name=f"download-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def submit(self, data: Dict) -> bool:
+        """Queue a download request. Returns False if the same request is already pending."""
+        key = download_request_key(data)
+        
+        with self._lock:
+            if key in self._pending:
+                return False
+            try:
+                self._queue.put_nowait((key, data))
+            except queue.Full:
+                raise WorkerQueueFull(f"Download queue is full ({self._queue.maxsize} jobs)")
+            self._pending.add(key)
+        return True
+    
+    def _work(self):
+        while True:
+            key, data = self._queue.get()
+            try:
+                print(f"Worker {threading.current_thread().name} starting {key}")
+                run_download_request(self.downloader, data)
+            except Exception as e:
+                # process_download already reported the failure to Next.js
+                print(f"Queued download {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+
+_downloader: Optional[PlaylistDownloader] = None
+_downloader_lock = threading.Lock()
+# Set on the cold start until count_start() records it
+_cold_start_pending = False
+
+
+def _prewarm(downloader: PlaylistDownloader):
+    """Expire stale job dirs, load the cache index and log in to TIDAL while the first job talks to Next.js"""
+    try:
+        with downloader.metrics.stage('prewarm'):
+            downloader.sweep_stale_jobs()
+            if downloader.cache is not None:
+                downloader.cache.warm()
+            sessions = downloader.open_session_pool()
+            if sessions is not None:
+                sessions.warm()
+    except Exception as e:
+        print(f"Prewarm failed: {e}")
+
+
+def get_downloader() -> PlaylistDownloader:
+    """Process-wide downloader, so warm invocations reuse its HTTP session, cache index and config.
+    
+    The first call (the cold start) also prewarms OrpheusDL in the background
+    unless PREWARM is off.
+    """
+    global _downloader, _cold_start_pending
+    with _downloader_lock:
+        if _downloader is None:
+            with METRICS.stage('downloader_init'):
+                _downloader = PlaylistDownloader()
+            _cold_start_pending = True
+            if os.getenv('PREWARM', '1').lower() in ('1', 'true', 'yes'):
+                threading.Thread(target=_prewarm, args=(_downloader,), name='prewarm', daemon=True).start()
+    return _downloader
+
+
+def count_start():
+    """Count a download invocation as cold when it's the first since the downloader was created.
+    
+    Only called for invocations that run or serve a job, so /metrics scrapes
+    and other requests don't skew the cold/warm split.
+    """
+    global _cold_start_pending
+    with _downloader_lock:
+        start = 'cold' if _cold_start_pending else 'warm'
+        _cold_start_pending = False
+    METRICS.increment('handler_starts_total', start=start)
+
+
+_worker_pool: Optional[DownloadWorkerPool] = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> DownloadWorkerPool:
+    """Process-wide worker pool, started on first use"""
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = DownloadWorkerPool(get_downloader())
+            _worker_pool.start()
+        return _worker_pool
 
 
 class DownloadHandler(BaseHTTPRequestHandler):
+    # With worker mode on, POST queues the job and returns 202 instead of holding the connection
+    worker_mode = os.getenv('DOWNLOAD_WORKER_MODE', '').lower() in ('1', 'true', 'yes')
+    
     def __init__(self, request, client_address, server):
-        self.downloader = PlaylistDownloader()
+        self.downloader = get_downloader()
         super().__init__(request, client_address, server)
     
     def do_POST(self):
+        count_start()
         try:
             # Parse request
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
             data = json.loads(post_data.decode('utf-8'))
             
-            job_id = data.get('jobId')
-            if not job_id:
-                self.send_error(400, "Missing jobId")
+            if self.worker_mode:
+                self._enqueue(data)
                 return
             
             # Process the download
-            result = self.downloader.process_download(job_id)
+            try:
+                result = run_download_request(self.downloader, data)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
             
             # Send response
             self.send_response(200)
@@ -308,28 +4027,123 @@ class DownloadHandler(BaseHTTPRequestHandler):
         except Exception as e:
             print(f"Error in download handler: {e}")
             self.send_error(500, str(e))
+    
+    def _enqueue(self, data: Dict):
+        """Hand the request to the worker pool and answer straight away"""
+        try:
+            queued = get_worker_pool().submit(data)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        except WorkerQueueFull as e:
+            self.send_response(503)
+            self.send_header('Retry-After', '30')
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': str(e)}).encode())
+            return
+        
+        self.send_response(202)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({
+            'success': True,
+            'jobId': _parse_download_request(data)[0],
+            'status': 'queued' if queued else 'duplicate'
+        }).encode())
+    
+    def do_GET(self):
+        """Serve /metrics, or stream a job's archive (DELIVERY_MODE=stream) to the Next.js file route"""
+        if urlparse(self.path).path.rstrip('/').endswith('/metrics'):
+            self._send_metrics()
+            return
+        
+        job_id = parse_qs(urlparse(self.path).query).get('jobId', [None])[0]
+        if not job_id:
+            self.send_error(400, "Missing jobId")
+            return
+        
+        try:
+            chunks = self.downloader.stream_archive(job_id)
+            # Pull the first chunk before committing to a 200
+            first_chunk = next(chunks, b'')
+        except (ValueError, FileNotFoundError) as e:
+            self.send_error(404, str(e))
+            return
+        except Exception as e:
+            print(f"Error in download handler: {e}")
+            self.send_error(500, str(e))
+            return
+        
+        # No Content-Length: the archive size isn't known until it's built,
+        # so the body runs until the connection closes
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.end_headers()
+        
+        try:
+            self.wfile.write(first_chunk)
+            for chunk in chunks:
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"Client disconnected while streaming job {job_id}")
+    
+    def _send_metrics(self):
+        body = self.downloader.metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+STREAM_NEEDS_SERVER = "DELIVERY_MODE=stream needs the long-running server (serve()); use file delivery on Vercel"
 
 
 # Vercel serverless function handler
 def handler(req, res):
-    """Vercel serverless function entry point"""
+    """Vercel serverless function entry point.
+    
+    Stream delivery is refused: a serverless response can't be streamed, and
+    the fetch may land on an instance without the job's tracks. It needs serve().
+    """
     try:
         if req.method == 'POST':
-            # Use the business logic directly for serverless
-            downloader = PlaylistDownloader()
+            # Use the business logic directly for serverless; warm invocations reuse it
+            downloader = get_downloader()
+            if downloader.delivery_mode == 'stream':
+                return {
+                    'statusCode': 501,
+                    'body': json.dumps({'error': STREAM_NEEDS_SERVER})
+                }
+            count_start()
             data = json.loads(req.body if isinstance(req.body, str) else req.body.decode())
-            job_id = data.get('jobId')
             
-            if not job_id:
+            try:
+                result = run_download_request(downloader, data)
+            except ValueError as e:
                 return {
                     'statusCode': 400,
-                    'body': json.dumps({'error': 'Missing jobId'})
+                    'body': json.dumps({'error': str(e)})
                 }
             
-            result = downloader.process_download(job_id)
+            # Chunked runs hand back a continuation token for the follow-up invocation
+            body = {'success': True}
+            if 'continuation' in result:
+                body.update(
+                    complete=result['complete'],
+                    continuation=result['continuation'],
+                    remainingTracks=result['remainingTracks']
+                )
             return {
                 'statusCode': 200,
-                'body': json.dumps({'success': True})
+                'body': json.dumps(body)
+            }
+        elif req.method == 'GET':
+            # Only the Next.js file route GETs, to fetch a stream delivery archive
+            return {
+                'statusCode': 501,
+                'body': json.dumps({'error': STREAM_NEEDS_SERVER})
             }
         else:
             return {
@@ -342,4 +4156,19 @@ def handler(req, res):
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
+
+def serve(host: str = '0.0.0.0', port: Optional[int] = None):
+    """Run DownloadHandler on a threaded HTTP server, outside of Vercel"""
+    port = port or int(os.getenv('PORT', '8000'))
+    server = ThreadingHTTPServer((host, port), DownloadHandler)
+    print(f"Download service listening on {host}:{port} (worker mode: {DownloadHandler.worker_mode})")
+    server.serve_forever()
+
+
+METRICS.observe('module_import', time.perf_counter() - _IMPORT_STARTED)
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,127 @@
+"""Local stand-in for the Next.js API routes the download pipeline talks to.
+
+Serves generated playlists and job details, and accepts status updates, so the
+pipeline can be benchmarked without Next.js, Spotify or TIDAL.
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+def make_playlist(playlist_id: str, track_count: int, duration: int = 240) -> Dict:
+    """Enhanced playlist payload shaped like /api/playlist/{id}, every track TIDAL matched"""
+    items = []
+    for i in range(track_count):
+        isrc = f"BENCH{i:07d}"
+        items.append({
+            'track': {
+                'isrc': isrc,
+                'matchStatus': 'matched',
+                'spotify': {
+                    'name': f"Song {i}",
+                    'artists': [{'name': f"Artist {i}"}]
+                },
+                'tidal': {
+                    'id': str(100000 + i),
+                    'isrc': isrc,
+                    'title': f"Song {i}",
+                    'duration': duration,
+                    'audioQuality': 'LOSSLESS',
+                    'allowStreaming': True,
+                    'streamReady': True,
+                    'replayGain': -9.5,
+                    'peak': 0.98,
+                    'url': f"https://tidal.com/browse/track/{100000 + i}"
+                }
+            }
+        })
+    
+    return {
+        'id': playlist_id,
+        'name': f"Benchmark {playlist_id}",
+        'tracks': {'items': items, 'total': track_count}
+    }
+
+
+class FakeNextJS:
+    """Threaded HTTP server holding jobs, playlists and the status updates it received"""
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.jobs: Dict[str, Dict] = {}
+        self.playlists: Dict[str, Dict] = {}
+        self.updates: Dict[str, List[Dict]] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def add_job(self, job_id: str, track_count: int):
+        playlist_id = f"playlist-{job_id}"
+        with self._lock:
+            self.playlists[playlist_id] = make_playlist(playlist_id, track_count)
+            self.jobs[job_id] = {'id': job_id, 'playlistId': playlist_id, 'status': 'queued'}
+            self.updates[job_id] = []
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+    
+    def _handler_class(self):
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def _send_json(self, status: int, body: Dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def do_GET(self):
+                match = re.fullmatch(r'/api/download/status/([^/]+)', self.path)
+                if match and match.group(1) in fake.jobs:
+                    self._send_json(200, fake.jobs[match.group(1)])
+                    return
+                
+                match = re.fullmatch(r'/api/playlist/([^/]+)', self.path)
+                if match and match.group(1) in fake.playlists:
+                    self._send_json(200, fake.playlists[match.group(1)])
+                    return
+                
+                self._send_json(404, {'error': 'Not found'})
+            
+            def do_POST(self):
+                match = re.fullmatch(r'/api/download/update-status/([^/]+)', self.path)
+                if not match or match.group(1) not in fake.jobs:
+                    self._send_json(404, {'error': 'Job not found'})
+                    return
+                
+                length = int(self.headers.get('Content-Length', 0))
+                update = json.loads(self.rfile.read(length) or b'{}')
+                with fake._lock:
+                    fake.updates[match.group(1)].append(update)
+                    fake.jobs[match.group(1)].update(update)
+                self._send_json(200, {'success': True})
+        
+        return Handler
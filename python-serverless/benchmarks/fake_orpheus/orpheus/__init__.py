@@ -0,0 +1,30 @@
+"""Fake OrpheusDL for benchmarks.
+
+Writes a file of FAKE_ORPHEUS_SIZE bytes per track after FAKE_ORPHEUS_LATENCY
+seconds, either in-process (orpheus.core) or as `python -m orpheus`.
+"""
+import os
+import time
+
+_BLOCK = os.urandom(64 * 1024)
+
+
+def settings_from_env():
+    return {
+        'size': int(os.getenv('FAKE_ORPHEUS_SIZE', str(1024 * 1024))),
+        'latency': float(os.getenv('FAKE_ORPHEUS_LATENCY', '0.05')),
+        'login_latency': float(os.getenv('FAKE_ORPHEUS_LOGIN_LATENCY', '0.2')),
+    }
+
+
+def write_track(output_dir: str, track_id: str):
+    """Simulate downloading a track: wait, then write an incompressible file"""
+    settings = settings_from_env()
+    time.sleep(settings['latency'])
+    
+    remaining = settings['size']
+    with open(os.path.join(output_dir, f"Track {track_id}.flac"), 'wb') as f:
+        while remaining > 0:
+            chunk = _BLOCK[:remaining]
+            f.write(chunk)
+            remaining -= len(chunk)
@@ -0,0 +1,24 @@
+"""Command line entry point matching `python -m orpheus --config <path> <url>`"""
+import argparse
+import json
+import time
+
+from orpheus import settings_from_env, write_track
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', required=True)
+    parser.add_argument('url')
+    args = parser.parse_args()
+    
+    with open(args.config) as f:
+        config = json.load(f)
+    
+    # A subprocess logs in for every track
+    time.sleep(settings_from_env()['login_latency'])
+    write_track(config['global']['output'], args.url.rstrip('/').split('/')[-1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""In-process API surface of OrpheusDL used by OrpheusSessionPool"""
+import time
+from enum import Enum
+
+from orpheus import settings_from_env, write_track
+
+
+class DownloadTypeEnum(Enum):
+    track = 'track'
+
+
+class MediaIdentification:
+    def __init__(self, media_type, media_id):
+        self.media_type = media_type
+        self.media_id = media_id
+
+
+class Orpheus:
+    def __init__(self, private_mode: bool = False):
+        self.settings = {'global': {'general': {}}, 'modules': {}}
+        self.loaded_modules = {}
+    
+    def load_module(self, module: str):
+        # Stands in for the TIDAL login
+        time.sleep(settings_from_env()['login_latency'])
+        self.loaded_modules[module] = object()
+        return self.loaded_modules[module]
+
+
+def orpheus_core_download(orpheus_session, media_to_download, third_party_modules, separate_download_module,
+                          output_path):
+    for media_list in media_to_download.values():
+        for media in media_list:
+            write_track(output_path, media.media_id)
@@ -0,0 +1,318 @@
+"""Throughput benchmarks for the playlist download pipeline.
+
+Runs PlaylistDownloader.process_download end to end against a fake Next.js
+server (fake_nextjs.py) and a fake OrpheusDL (fake_orpheus/) that writes files
+of a configurable size after a configurable latency. Every scenario runs in its
+own child process so peak RSS is measured per scenario.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --tracks 10,100 --concurrency 1,8 --file-mb 1,20
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<earlier>.json
+
+Results are written to benchmarks/results/<timestamp>-<git sha>.json. With
+--compare, scenarios whose tracks/s dropped by more than --threshold percent
+against the earlier run are reported and the exit status is 1.
+
+--startup instead measures the serverless entry point: module import plus the
+first handler() call of a fresh process (cold) against later calls in the
+same process (warm), each running a one-track job.
+
+    python benchmarks/run_benchmarks.py --startup
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+FAKE_ORPHEUS_DIR = os.path.join(BENCH_DIR, 'fake_orpheus')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+class DiskSampler:
+    """Samples the bytes under a set of paths on a background thread and keeps the peak"""
+    
+    def __init__(self, paths: List[str], interval: float = 0.05):
+        self.paths = paths
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, sum(_tree_size(path) for path in self.paths))
+            self._stop.wait(self.interval)
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_scenario(scenario: Dict) -> Dict:
+    """Run one scenario in this process and return its measurements"""
+    work_dir = tempfile.mkdtemp(prefix='bench-work-')
+    archive_dir = '/tmp'
+    
+    os.environ.update({
+        'DOWNLOAD_WORK_DIR': work_dir,
+        'DOWNLOAD_CONCURRENCY': str(scenario['concurrency']),
+        'ORPHEUS_ENGINE': scenario['engine'],
+        'FAKE_ORPHEUS_SIZE': str(int(scenario['file_mb'] * 1024 * 1024)),
+        'FAKE_ORPHEUS_LATENCY': str(scenario['latency']),
+        # Measure downloads, not cache hits
+        'TRACK_CACHE_MAX_BYTES': '0',
+        # The fake provider never throttles, so don't let TIDAL's pacing cap the pipeline
+        'TIDAL_RATE_LIMIT': os.environ.get('TIDAL_RATE_LIMIT', '1000'),
+        'TIDAL_MAX_CONCURRENCY': str(max(scenario['concurrency'], int(os.environ.get('TIDAL_MAX_CONCURRENCY', '8')))),
+        # Fake tracks aren't decodable audio
+        'ANALYSIS': '0',
+        'PYTHONPATH': os.pathsep.join([FAKE_ORPHEUS_DIR, os.environ.get('PYTHONPATH', '')]),
+    })
+    sys.path.insert(0, FAKE_ORPHEUS_DIR)
+    
+    from fake_nextjs import FakeNextJS
+    from api.download_playlist import PlaylistDownloader, PipelineMetrics
+    
+    latencies = []
+    tracks_done = 0
+    bytes_done = 0
+    
+    try:
+        with FakeNextJS() as nextjs:
+            os.environ['NEXTJS_URL'] = nextjs.url
+            downloader = PlaylistDownloader(metrics=PipelineMetrics())
+            
+            with DiskSampler([work_dir]) as disk:
+                started = time.monotonic()
+                for run in range(scenario['jobs']):
+                    job_id = f"bench_{os.getpid()}_{run}"
+                    nextjs.add_job(job_id, scenario['tracks'])
+                    
+                    job_started = time.monotonic()
+                    result = downloader.process_download(job_id)
+                    latencies.append(time.monotonic() - job_started)
+                    
+                    archive_path = os.path.join(archive_dir, f"{job_id}.zip")
+                    if os.path.exists(archive_path):
+                        bytes_done += os.path.getsize(archive_path)
+                        os.remove(archive_path)
+                    tracks_done += result['successfulTracks']
+                elapsed = time.monotonic() - started
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    # ru_maxrss is in KiB on Linux; children covers the subprocess engine
+    peak_rss_kib = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    
+    return {
+        **scenario,
+        'tracks_per_second': tracks_done / elapsed,
+        'mb_per_second': bytes_done / (1024 * 1024) / elapsed,
+        'job_latency_p50': statistics.median(latencies),
+        'job_latency_p95': _percentile(latencies, 95),
+        'peak_rss_mb': peak_rss_kib / 1024,
+        'peak_disk_mb': disk.peak / (1024 * 1024),
+    }
+
+
+def run_startup(invocations: int) -> Dict:
+    """Time the import and handler() invocations of this (fresh) process"""
+    work_dir = tempfile.mkdtemp(prefix='bench-work-')
+    os.environ.update({
+        'DOWNLOAD_WORK_DIR': work_dir,
+        'TRACK_CACHE_MAX_BYTES': '0',
+        'TIDAL_RATE_LIMIT': os.environ.get('TIDAL_RATE_LIMIT', '1000'),
+        'ANALYSIS': '0',
+        'PYTHONPATH': os.pathsep.join([FAKE_ORPHEUS_DIR, os.environ.get('PYTHONPATH', '')]),
+    })
+    sys.path.insert(0, FAKE_ORPHEUS_DIR)
+    
+    from fake_nextjs import FakeNextJS
+    
+    durations = []
+    try:
+        with FakeNextJS() as nextjs:
+            os.environ['NEXTJS_URL'] = nextjs.url
+            
+            started = time.perf_counter()
+            from api.download_playlist import handler
+            import_seconds = time.perf_counter() - started
+            
+            for run in range(invocations):
+                job_id = f"startup_{os.getpid()}_{run}"
+                nextjs.add_job(job_id, 1)
+                request = type('Request', (), {'method': 'POST', 'body': json.dumps({'jobId': job_id})})()
+                
+                started = time.perf_counter()
+                response = handler(request, None)
+                durations.append(time.perf_counter() - started)
+                if response['statusCode'] != 200:
+                    raise RuntimeError(f"handler failed: {response['body']}")
+                
+                archive_path = f"/tmp/{job_id}.zip"
+                if os.path.exists(archive_path):
+                    os.remove(archive_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    return {
+        'import_seconds': import_seconds,
+        'cold_seconds': import_seconds + durations[0],
+        'warm_seconds_p50': statistics.median(durations[1:]) if len(durations) > 1 else None,
+    }
+
+
+def _run_isolated(scenario: Dict) -> Dict:
+    """Run a scenario in a child process so its peak RSS isn't inherited from earlier ones"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-scenario', json.dumps(scenario)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    # The pipeline logs to stdout; the result is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _scenario_id(scenario: Dict) -> str:
+    return (f"{scenario['engine']}-t{scenario['tracks']}-c{scenario['concurrency']}"
+            f"-{scenario['file_mb']}mb")
+
+
+def _git_sha() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=PROJECT_ROOT
+        ).stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float) -> List[str]:
+    """Scenarios whose tracks/s regressed by more than threshold percent against the baseline"""
+    with open(baseline_path) as f:
+        baseline = {_scenario_id(r): r for r in json.load(f)['results']}
+    
+    regressions = []
+    for result in results:
+        previous = baseline.get(_scenario_id(result))
+        if not previous:
+            continue
+        change = (result['tracks_per_second'] - previous['tracks_per_second']) / previous['tracks_per_second'] * 100
+        if change < -threshold:
+            regressions.append(
+                f"{_scenario_id(result)}: {previous['tracks_per_second']:.2f} -> "
+                f"{result['tracks_per_second']:.2f} tracks/s ({change:.1f}%)"
+            )
+    return regressions
+
+
+def _csv(cast):
+    return lambda value: [cast(v) for v in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=_csv(int), default=[10, 100, 1000])
+    parser.add_argument('--concurrency', type=_csv(int), default=[1, 4, 8])
+    parser.add_argument('--file-mb', type=_csv(float), default=[1.0])
+    parser.add_argument('--engine', type=_csv(str), default=['session'])
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per fake track download')
+    parser.add_argument('--jobs', type=int, default=3, help='jobs per scenario, for latency percentiles')
+    parser.add_argument('--compare', help='earlier results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed tracks/s drop in percent')
+    parser.add_argument('--startup', action='store_true', help='measure cold vs warm handler invocations')
+    parser.add_argument('--invocations', type=int, default=5, help='handler calls per --startup process')
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--run-startup', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.run_scenario:
+        print(json.dumps(run_scenario(json.loads(args.run_scenario))))
+        return
+    if args.run_startup:
+        print(json.dumps(run_startup(args.run_startup)))
+        return
+    
+    if args.startup:
+        # A fresh interpreter, so the first invocation really is cold
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-startup', str(max(2, args.invocations))],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"import {result['import_seconds']:.3f}s  cold {result['cold_seconds']:.3f}s  "
+            f"warm p50 {result['warm_seconds_p50']:.3f}s"
+        )
+        return
+    
+    results = []
+    for engine, tracks, concurrency, file_mb in itertools.product(
+        args.engine, args.tracks, args.concurrency, args.file_mb
+    ):
+        scenario = {
+            'engine': engine, 'tracks': tracks, 'concurrency': concurrency,
+            'file_mb': file_mb, 'latency': args.latency, 'jobs': args.jobs
+        }
+        result = _run_isolated(scenario)
+        results.append(result)
+        print(
+            f"{_scenario_id(scenario):<32} {result['tracks_per_second']:8.2f} tracks/s "
+            f"{result['mb_per_second']:8.2f} MB/s  p50 {result['job_latency_p50']:7.2f}s "
+            f"p95 {result['job_latency_p95']:7.2f}s  rss {result['peak_rss_mb']:6.1f} MB "
+            f"disk {result['peak_disk_mb']:8.1f} MB"
+        )
+    
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{_git_sha()}.json")
+    with open(results_path, 'w') as f:
+        json.dump({'version': _git_sha(), 'created': time.time(), 'results': results}, f, indent=2)
+    print(f"Results written to {results_path}")
+    
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,54 @@
 import unittest
-from unittest.mock import Mock, patch, MagicMock, mock_open
+from unittest.mock import Mock, patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor, wait
 import json
 import tempfile
 import os
 import io
 import sys
+import zipfile
+import threading
+import time
+import importlib.util
+import re
+import subprocess
 
 # Add the project root to Python path
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 
-from api.download_playlist import PlaylistDownloader, DownloadHandler, handler
+from api.download_playlist import (
+    PlaylistDownloader, PlaylistTrack, NextJSClient, CompressionPolicy, RawZipWriter, write_zip_parallel, ProgressReporter, OrpheusSessionPool, OrpheusConfigFile, TidalCredentials, DownloadThrottle, TrackScheduler, TrackPreflight, DiskBudget, DiskBudgetExceeded, VolumePackager, VolumeSplitter, TrackCache, StreamingZipPackager,
+    JobManifest, PipelineMetrics, DownloadWorkerPool, WorkerQueueFull, DownloadHandler, handler, decode_continuation, get_downloader,
+    encode_continuation, run_download_request, count_start, read_playlist, track_key, AudioAnalyzer, analyse_audio, analysis_key,
+    OutputProfile, Transcoder
+)
+
+
+def _write_track_file(download_dir, name):
+    """Stand-in for the file a successful OrpheusDL download leaves behind"""
+    with open(os.path.join(download_dir, f"{name}.flac"), 'wb') as f:
+        f.write(b'audio')
+    return True
+
+
+def setUpModule():
+    # Keep the process-wide throttle from pacing tests that aren't about throttling
+    patcher = patch('api.download_playlist._throttle', DownloadThrottle(rate=1000, max_concurrency=64))
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+    # Audio analysis has its own tests; elsewhere the fake tracks aren't real audio
+    env = patch.dict(os.environ, {'ANALYSIS': '0'})
+    env.start()
+    unittest.addModuleCleanup(env.stop)
 
 
 class TestPlaylistDownloader(unittest.TestCase):
     
     def setUp(self):
         self.downloader = PlaylistDownloader()
+        self.downloader.cache = None
+        self.downloader.retries = 0
         self.mock_job_id = "test-job-123"
         self.mock_playlist_data = {
             "name": "Test Playlist",
@@ -38,7 +70,7 @@ class TestPlaylistDownloader(unittest.TestCase):
             }
         }
     
-    @patch('api.download_playlist.requests.get')
+    @patch('api.download_playlist.requests.Session.get')
     def test_get_job_details_success(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 200
@@ -48,9 +80,9 @@ class TestPlaylistDownloader(unittest.TestCase):
         result = self.downloader.get_job_details(self.mock_job_id)
         
         self.assertEqual(result, {"playlistId": "test-playlist"})
-        mock_get.assert_called_once_with("http://localhost:3000/api/download/status/test-job-123")
+        mock_get.assert_called_once_with("http://localhost:3000/api/download/status/test-job-123", timeout=10)
     
-    @patch('api.download_playlist.requests.get')
+    @patch('api.download_playlist.requests.Session.get')
     def test_get_job_details_failure(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 404
@@ -60,19 +92,23 @@ class TestPlaylistDownloader(unittest.TestCase):
         
         self.assertIsNone(result)
     
-    @patch('api.download_playlist.requests.get')
+    @patch('api.download_playlist.requests.Session.get')
     def test_get_playlist_data_success(self, mock_get):
-        mock_response = Mock()
+        mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_response.json.return_value = self.mock_playlist_data
+        mock_response.encoding = None
+        body = json.dumps(self.mock_playlist_data).encode()
+        # Split mid-token, the way a streamed response arrives
+        mock_response.iter_content.return_value = [body[i:i + 7] for i in range(0, len(body), 7)]
         mock_get.return_value = mock_response
         
         result = self.downloader.get_playlist_data("test-playlist")
         
         self.assertEqual(result, self.mock_playlist_data)
-        mock_get.assert_called_once_with("http://localhost:3000/api/playlist/test-playlist")
+        self.assertIsInstance(result['tracks']['items'][0]['track'], PlaylistTrack)
+        mock_get.assert_called_once_with("http://localhost:3000/api/playlist/test-playlist", timeout=10, stream=True)
     
-    @patch('api.download_playlist.requests.get')
+    @patch('api.download_playlist.requests.Session.get')
     def test_get_playlist_data_failure(self, mock_get):
         mock_response = Mock()
         mock_response.status_code = 404
@@ -82,7 +118,7 @@ class TestPlaylistDownloader(unittest.TestCase):
         
         self.assertIsNone(result)
     
-    @patch('api.download_playlist.requests.post')
+    @patch('api.download_playlist.requests.Session.post')
     def test_update_job_status(self, mock_post):
         mock_response = Mock()
         mock_response.status_code = 200
@@ -104,7 +140,7 @@ class TestPlaylistDownloader(unittest.TestCase):
             timeout=10
         )
     
-    @patch('api.download_playlist.requests.post')
+    @patch('api.download_playlist.requests.Session.post')
     def test_update_job_completion(self, mock_post):
         mock_response = Mock()
         mock_response.status_code = 200
@@ -124,10 +160,12 @@ class TestPlaylistDownloader(unittest.TestCase):
             timeout=10
         )
     
-    @patch('builtins.open', new_callable=mock_open)
+    def _use_config_dir(self, config_dir):
+        credentials = TidalCredentials(username="user", password="secret")
+        self.downloader.orpheus_config = OrpheusConfigFile(config_dir, "hifi", credentials=credentials)
+    
     @patch('api.download_playlist.subprocess.run')
-    @patch('os.remove')
-    def test_download_single_track_success(self, mock_remove, mock_subprocess, mock_file):
+    def test_download_single_track_success(self, mock_subprocess):
         mock_result = Mock()
         mock_result.returncode = 0
         mock_result.stdout = "Download successful"
@@ -136,16 +174,37 @@ class TestPlaylistDownloader(unittest.TestCase):
         tidal_track = {"url": "https://tidal.com/test-track"}
         spotify_track = {"name": "Test Song", "artists": [{"name": "Test Artist"}]}
         
-        result = self.downloader.download_single_track(tidal_track, "/tmp/test", spotify_track)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self._use_config_dir(temp_dir)
+            result = self.downloader.download_single_track(tidal_track, temp_dir, spotify_track)
         
         self.assertTrue(result)
         mock_subprocess.assert_called_once()
-        mock_file.assert_called_once()
     
-    @patch('builtins.open', new_callable=mock_open)
     @patch('api.download_playlist.subprocess.run')
-    @patch('os.remove')
-    def test_download_single_track_failure(self, mock_remove, mock_subprocess, mock_file):
+    def test_subprocess_downloads_share_one_config_file(self, mock_subprocess):
+        mock_subprocess.return_value = Mock(returncode=0, stdout="")
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self._use_config_dir(temp_dir)
+            self.downloader.download_with_subprocess({"url": "https://tidal.com/browse/track/1"}, "/tmp/a")
+            self.downloader.download_with_subprocess({"url": "https://tidal.com/browse/track/2"}, "/tmp/b")
+            
+            config_paths = {call.args[0][call.args[0].index('--config') + 1] for call in mock_subprocess.call_args_list}
+            self.assertEqual(len(config_paths), 1)
+            config_path = config_paths.pop()
+            
+            # Kept for later tracks, readable only by this user
+            with open(config_path) as f:
+                config = json.load(f)
+            self.assertEqual(config["tidal"], {"username": "user", "password": "secret"})
+            self.assertEqual(os.stat(config_path).st_mode & 0o777, 0o600)
+            self.assertEqual(os.listdir(temp_dir), [os.path.basename(config_path)])
+        
+        self.assertEqual([call.kwargs['cwd'] for call in mock_subprocess.call_args_list], ["/tmp/a", "/tmp/b"])
+    
+    @patch('api.download_playlist.subprocess.run')
+    def test_download_single_track_failure(self, mock_subprocess):
         mock_result = Mock()
         mock_result.returncode = 1
         mock_result.stderr = "Download failed"
@@ -154,30 +213,132 @@ class TestPlaylistDownloader(unittest.TestCase):
         tidal_track = {"url": "https://tidal.com/test-track"}
         spotify_track = {"name": "Test Song", "artists": [{"name": "Test Artist"}]}
         
-        result = self.downloader.download_single_track(tidal_track, "/tmp/test", spotify_track)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self._use_config_dir(temp_dir)
+            result = self.downloader.download_single_track(tidal_track, temp_dir, spotify_track)
         
         self.assertFalse(result)
     
-    @patch('api.download_playlist.zipfile.ZipFile')
-    @patch('os.walk')
-    def test_create_zip(self, mock_walk, mock_zipfile):
-        mock_walk.return_value = [
-            ("/tmp/test/tracks", [], ["song1.mp3", "song2.mp3", "config.json"])
-        ]
+    def test_download_single_track_uses_session_pool(self):
+        fake_core = MagicMock()
+        with patch.dict(sys.modules, {'orpheus': MagicMock(core=fake_core), 'orpheus.core': fake_core}):
+            sessions = OrpheusSessionPool()
+            
+            tidal_track = {"id": "1234", "url": "https://tidal.com/browse/track/1234"}
+            spotify_track = {"name": "Test Song", "artists": [{"name": "Test Artist"}]}
+            
+            with patch('api.download_playlist.subprocess.run') as mock_subprocess, \
+                    tempfile.TemporaryDirectory() as temp_dir:
+                self.assertTrue(self.downloader.download_single_track(tidal_track, temp_dir, spotify_track, sessions=sessions))
+                self.assertTrue(self.downloader.download_single_track(tidal_track, temp_dir, spotify_track, sessions=sessions))
+                mock_subprocess.assert_not_called()
+        
+        # One login shared by both tracks
+        fake_core.Orpheus.return_value.load_module.assert_called_once_with('tidal')
+        self.assertEqual(fake_core.orpheus_core_download.call_count, 2)
+    
+    @patch.object(PlaylistDownloader, 'download_with_subprocess')
+    def test_hung_session_download_fails_the_attempt(self, mock_subprocess_download):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        fake_core = MagicMock()
+        fake_core.orpheus_core_download.side_effect = lambda *args: release.wait()
+        with patch.dict(sys.modules, {'orpheus': MagicMock(core=fake_core), 'orpheus.core': fake_core}):
+            sessions = OrpheusSessionPool()
+        self.downloader.track_timeout = 0.05
+        self.downloader.retries = 0
+        self.downloader.throttle = DownloadThrottle(rate=100, max_concurrency=4)
+        
+        tidal_track = {"id": "1234", "url": "https://tidal.com/browse/track/1234"}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            success, attempts = self.downloader.download_with_retries(tidal_track, temp_dir, {}, sessions=sessions)
+            
+            self.assertEqual((success, attempts), (False, 1))
+            mock_subprocess_download.assert_not_called()
+            self.assertEqual(os.listdir(temp_dir), [])
+        # The stuck session isn't handed out again
+        self.assertEqual(sessions._idle, [])
         
-        mock_zip = MagicMock()
-        mock_zipfile.return_value.__enter__.return_value = mock_zip
+        # The abandoned download keeps its throttle slot until it returns
+        self.assertEqual(self.downloader.throttle.active, 1)
+        release.set()
+        deadline = time.monotonic() + 5
+        while self.downloader.throttle.active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.downloader.throttle.active, 0)
+    
+    @patch.object(PlaylistDownloader, 'download_with_subprocess', return_value=True)
+    def test_download_single_track_falls_back_when_login_fails(self, mock_subprocess_download):
+        fake_core = MagicMock()
+        fake_core.Orpheus.return_value.load_module.side_effect = Exception("Login failed")
+        with patch.dict(sys.modules, {'orpheus': MagicMock(core=fake_core), 'orpheus.core': fake_core}):
+            sessions = OrpheusSessionPool()
         
-        successful_downloads = ["Test Artist - Test Song"]
-        result = self.downloader.create_zip(successful_downloads, "/tmp/test", "Test Playlist")
+        tidal_track = {"url": "https://tidal.com/browse/track/1234"}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            result = self.downloader.download_single_track(tidal_track, temp_dir, {}, sessions=sessions)
         
-        self.assertTrue(result.endswith(".zip"))
-        self.assertEqual(mock_zip.write.call_count, 2)  # Should skip config.json
+        self.assertTrue(result)
+        self.assertTrue(sessions.failed)
+        mock_subprocess_download.assert_called_once_with(tidal_track, temp_dir)
+    
+    def test_session_pool_logs_in_again_after_credentials_refresh(self):
+        credentials = TidalCredentials(username="user", password="secret")
+        fake_core = MagicMock()
+        fake_core.Orpheus.return_value.settings = {'global': {'general': {}}}
+        with patch.dict(sys.modules, {'orpheus': MagicMock(core=fake_core), 'orpheus.core': fake_core}):
+            sessions = OrpheusSessionPool(credentials=credentials)
+        
+        tidal_track = {"id": "1234", "url": "https://tidal.com/browse/track/1234"}
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        sessions.download(tidal_track, temp_dir.name)
+        sessions.download(tidal_track, temp_dir.name)
+        self.assertEqual(fake_core.Orpheus.call_count, 1)
+        
+        credentials.invalidate()
+        sessions.download(tidal_track, temp_dir.name)
+        self.assertEqual(fake_core.Orpheus.call_count, 2)
+        self.assertEqual(fake_core.Orpheus.return_value.settings['modules']['tidal']['username'], "user")
+    
+    def test_session_pool_is_shared_across_jobs(self):
+        fake_core = MagicMock()
+        with patch.dict(sys.modules, {'orpheus': MagicMock(core=fake_core), 'orpheus.core': fake_core}), \
+                patch.dict('api.download_playlist._session_pools', clear=True):
+            first = PlaylistDownloader().open_session_pool()
+            second = PlaylistDownloader().open_session_pool()
+            self.assertIs(first, second)
+            
+            # A failed login isn't cached for the next job
+            first.failed = True
+            self.assertIsNot(PlaylistDownloader().open_session_pool(), first)
+    
+    def test_create_zip(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tracks_dir = os.path.join(temp_dir, 'tracks')
+            os.makedirs(tracks_dir)
+            for name in ("song1.mp3", "song2.mp3", "config.json"):
+                with open(os.path.join(tracks_dir, name), 'wb') as f:
+                    f.write(b'audio')
+            
+            successful_downloads = ["Test Artist - Test Song"]
+            result = self.downloader.create_zip(successful_downloads, temp_dir, "Test Playlist")
+            
+            self.assertTrue(result.endswith(".zip"))
+            with zipfile.ZipFile(result) as zipf:
+                self.assertEqual(sorted(zipf.namelist()), ["song1.mp3", "song2.mp3"])  # Should skip config.json
     
     @patch.object(PlaylistDownloader, 'download_single_track')
     @patch.object(PlaylistDownloader, 'update_job_status')
     def test_download_tracks(self, mock_update_status, mock_download_single):
-        mock_download_single.side_effect = [True, False, True]
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            # Track 2 "succeeds" without writing anything
+            if tidal_track['url'] != 'url2':
+                _write_track_file(download_dir, tidal_track['url'])
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        self.downloader.cache = None
         
         tracks = [
             {"track": {"spotify": {"name": "Song1", "artists": [{"name": "Artist1"}]}, "tidal": {"url": "url1"}}},
@@ -185,15 +346,1709 @@ class TestPlaylistDownloader(unittest.TestCase):
             {"track": {"spotify": {"name": "Song3", "artists": [{"name": "Artist3"}]}, "tidal": {"url": "url3"}}}
         ]
         
-        successful, failed = self.downloader.download_tracks(tracks, "/tmp/test", self.mock_job_id)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            successful, failed = self.downloader.download_tracks(tracks, temp_dir, self.mock_job_id)
+            
+            self.assertEqual(sorted(os.listdir(temp_dir)), ["url1.flac", "url3.flac"])
         
-        self.assertEqual(len(successful), 2)
-        self.assertEqual(len(failed), 1)
+        self.assertEqual(successful, ["Artist1 - Song1", "Artist3 - Song3"])
+        self.assertEqual(failed, ["Artist2 - Song2"])
         self.assertEqual(mock_download_single.call_count, 3)
+    
+    @patch('api.download_playlist.time.sleep')
+    @patch('api.download_playlist.subprocess.run')
+    def test_download_with_retries_backs_off_and_retries(self, mock_subprocess, mock_sleep):
+        mock_subprocess.side_effect = [
+            Mock(returncode=1, stdout="", stderr="HTTP 429 Too Many Requests"),
+            Mock(returncode=1, stdout="", stderr="connection reset"),
+            Mock(returncode=0, stdout="done", stderr=""),
+        ]
+        self.downloader.retries = 2
+        self.downloader.throttle = DownloadThrottle(rate=100, max_concurrency=4)
+        self.downloader.throttle.COOLDOWN = 0
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self._use_config_dir(temp_dir)
+            download_dir = os.path.join(temp_dir, 'track')
+            os.makedirs(download_dir)
+            with open(os.path.join(download_dir, 'partial.flac'), 'wb') as f:
+                f.write(b'half')
+            
+            success, attempts = self.downloader.download_with_retries({"url": "https://tidal.com/browse/track/1"}, download_dir, {})
+            
+            # Partial files of the failed attempts were cleared
+            self.assertEqual(os.listdir(download_dir), [])
+        
+        self.assertTrue(success)
+        self.assertEqual(attempts, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+        # Throttling halved the concurrency limit
+        self.assertEqual(self.downloader.throttle.limit, 2)
+    
+    @patch('api.download_playlist.time.sleep')
+    @patch.object(PlaylistDownloader, 'download_single_track', return_value=False)
+    def test_download_with_retries_gives_up(self, mock_download_single, mock_sleep):
+        self.downloader.retries = 1
+        self.downloader.throttle = DownloadThrottle(rate=100)
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertEqual(self.downloader.download_with_retries({"url": "u"}, temp_dir, {}), (False, 2))
+        
+        self.assertEqual(mock_download_single.call_count, 2)
+    
+    def test_retry_delay_is_jittered_exponential_backoff(self):
+        self.downloader.retry_base_delay = 1
+        self.downloader.retry_max_delay = 5
+        
+        with patch('api.download_playlist.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([self.downloader.retry_delay(n) for n in (1, 2, 3, 4)], [1, 2, 4, 5])
+    
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    def test_download_tracks_concurrent_keeps_playlist_order(self, mock_update_status, mock_download_single):
+        import threading
+        import time
+        
+        active = []
+        peak = []
+        lock = threading.Lock()
+        
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with lock:
+                active.append(tidal_track['url'])
+                peak.append(len(active))
+            # Earlier tracks finish last
+            time.sleep(0.05 / int(tidal_track['url'][-1]))
+            with lock:
+                active.remove(tidal_track['url'])
+            _write_track_file(download_dir, tidal_track['url'])
+            return tidal_track['url'] != 'url2'
+        
+        mock_download_single.side_effect = fake_download
+        
+        tracks = [
+            {"track": {"spotify": {"name": f"Song{i}", "artists": [{"name": f"Artist{i}"}]}, "tidal": {"url": f"url{i}"}}}
+            for i in range(1, 5)
+        ]
+        
+        downloader = PlaylistDownloader(max_workers=2)
+        downloader.cache = None
+        with tempfile.TemporaryDirectory() as temp_dir:
+            successful, failed = downloader.download_tracks(tracks, temp_dir, self.mock_job_id)
+        
+        self.assertEqual(successful, ["Artist1 - Song1", "Artist3 - Song3", "Artist4 - Song4"])
+        self.assertEqual(failed, ["Artist2 - Song2"])
+        self.assertLessEqual(max(peak), 2)
+        # Progress is coalesced, but the final count is always reported
+        self.assertLessEqual(mock_update_status.call_count, 4)
+        self.assertEqual(mock_update_status.call_args[0][1:4], ('downloading', 4, 4))
+
+
+class TestNextJSClient(unittest.TestCase):
+    
+    def test_reuses_one_session_with_retries(self):
+        client = NextJSClient(base_url="http://nextjs.test", timeout=5, retries=2)
+        
+        adapter = client.session.get_adapter("http://nextjs.test/api")
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        
+        with patch.object(client.session, 'post') as mock_post:
+            client.post("/api/download/update-status/job", {"status": "zipping"})
+            client.post("/api/download/update-status/job", {"status": "completed"})
+        
+        self.assertEqual(mock_post.call_count, 2)
+        mock_post.assert_called_with(
+            "http://nextjs.test/api/download/update-status/job", json={"status": "completed"}, timeout=5
+        )
+
+
+class TestTidalCredentials(unittest.TestCase):
+    
+    @patch('api.download_playlist.requests.post')
+    def test_refresh_token_is_reused_until_it_expires(self, mock_post):
+        mock_post.return_value = Mock(status_code=200)
+        mock_post.return_value.json.return_value = {"access_token": "token-1", "expires_in": 3600}
+        credentials = TidalCredentials(refresh_token="refresh", client_id="client")
+        
+        generation, settings = credentials.current()
+        self.assertEqual(credentials.current(), (generation, settings))
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(settings["access_token"], "token-1")
+        self.assertEqual(mock_post.call_args.kwargs["data"]["grant_type"], "refresh_token")
+        
+        # Within the refresh margin of expiry a new token is requested
+        mock_post.return_value.json.return_value = {"access_token": "token-2", "expires_in": 3600}
+        credentials.expires_at = time.time() + 30
+        generation_after, settings = credentials.current()
+        
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(settings["access_token"], "token-2")
+        self.assertEqual(generation_after, generation + 1)
+    
+    @patch('api.download_playlist.requests.post')
+    def test_password_login_expires_after_session_ttl(self, mock_post):
+        credentials = TidalCredentials(username="user", password="secret", session_ttl=600)
+        
+        generation, settings = credentials.current()
+        self.assertEqual(credentials.current()[0], generation)
+        
+        credentials.expires_at = time.time()
+        self.assertEqual(credentials.current()[0], generation + 1)
+        mock_post.assert_not_called()
+
+
+class TestDownloadThrottle(unittest.TestCase):
+    
+    def setUp(self):
+        self.throttle = DownloadThrottle(rate=100, max_concurrency=8, metrics=PipelineMetrics())
+    
+    def test_throttling_in_stderr_halves_limit_and_rate_once_per_cooldown(self):
+        self.assertEqual(self.throttle.record(False, "HTTPError: 429 Client Error"), 'throttled')
+        self.assertEqual(self.throttle.record(False, "Rate limit exceeded"), 'throttled')
+        
+        self.assertEqual(self.throttle.limit, 4)
+        self.assertEqual(self.throttle.rate, 50)
+        self.assertGreater(self.throttle.paused_until, time.monotonic())
+    
+    def test_error_spike_backs_off(self):
+        for _ in range(5):
+            self.throttle.record(True)
+        for _ in range(4):
+            self.assertEqual(self.throttle.record(False, "track not found"), 'error')
+        self.assertEqual(self.throttle.limit, 8)
+        
+        self.throttle.record(False, "connection reset")
+        self.assertEqual(self.throttle.limit, 4)
+    
+    def test_recovers_after_success_streak(self):
+        self.throttle.record(False, "429")
+        self.throttle.paused_until = 0
+        
+        for _ in range(DownloadThrottle.RECOVERY_STREAK):
+            self.throttle.record(True)
+        
+        self.assertEqual(self.throttle.limit, 5)
+        self.assertEqual(self.throttle.rate, 60)
+    
+    def test_slot_caps_concurrency_at_limit(self):
+        import threading
+        self.throttle.limit = 2
+        running = []
+        peak = []
+        lock = threading.Lock()
+        
+        def attempt():
+            with self.throttle.slot():
+                with lock:
+                    running.append(1)
+                    peak.append(len(running))
+                time.sleep(0.02)
+                with lock:
+                    running.pop()
+        
+        threads = [threading.Thread(target=attempt) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(max(peak), 2)
+    
+    def test_token_bucket_paces_attempts(self):
+        throttle = DownloadThrottle(rate=20, max_concurrency=8, metrics=PipelineMetrics())
+        started = time.monotonic()
+        for _ in range(30):
+            with throttle.slot():
+                pass
+        
+        # 20 tokens of burst, then 10 more at 20/s
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+
+
+class TestPlaylistTrack(unittest.TestCase):
+    
+    def setUp(self):
+        self.item = {
+            "track": {
+                "isrc": "ISRC1",
+                "matchStatus": "matched",
+                "spotify": {"name": "Song", "artists": [{"name": "Artist"}, {"name": "Feat"}],
+                            "album": {"images": [{"url": "cover"}] * 3}, "available_markets": ["US"] * 100},
+                "tidal": {"id": 123, "url": "https://tidal.com/browse/track/123", "duration": 215,
+                          "audioQuality": "LOSSLESS", "allowStreaming": True, "album": {"cover": "x" * 500}}
+            }
+        }
+    
+    def test_record_keeps_only_pipeline_fields(self):
+        track = PlaylistTrack.from_track(self.item["track"])
+        
+        self.assertFalse(hasattr(track, '__dict__'))
+        self.assertEqual(dict(track), {
+            "isrc": "ISRC1",
+            "matchStatus": "matched",
+            "spotify": {"name": "Song", "artists": [{"name": "Artist"}]},
+            "tidal": {"id": "123", "url": "https://tidal.com/browse/track/123", "isrc": "ISRC1", "duration": 215,
+                      "audioQuality": "LOSSLESS", "allowStreaming": True}
+        })
+        self.assertEqual(track_key(track), "tidal:123")
+    
+    def test_read_playlist_streams_items_into_records(self):
+        body = json.dumps({
+            "id": "p1",
+            "tracks": {"items": [self.item, {"track": {"matchStatus": "unmatched", "spotify": {"name": "Gone"}}}],
+                       "total": 12345},
+            "name": "After Tracks"
+        })
+        
+        playlist = read_playlist(iter(body))
+        
+        self.assertEqual((playlist["id"], playlist["name"], playlist["tracks"]["total"]), ("p1", "After Tracks", 12345))
+        first, second = (item["track"] for item in playlist["tracks"]["items"])
+        self.assertEqual((first.artist, first.title, first.duration), ("Artist", "Song", 215))
+        self.assertEqual(second["matchStatus"], "unmatched")
+        self.assertIsNone(second.get("tidal"))
+    
+    def test_read_playlist_rejects_truncated_stream(self):
+        body = json.dumps({"tracks": {"items": [self.item]}})
+        
+        with self.assertRaises(ValueError):
+            read_playlist([body[:-40]])
+
+
+class TestTrackScheduler(unittest.TestCase):
+    
+    def test_jobs_take_turns_on_the_shared_workers(self):
+        scheduler = TrackScheduler(workers=1, metrics=PipelineMetrics())
+        gate = threading.Event()
+        order = []
+        
+        def task(name):
+            gate.wait(5)
+            order.append(name)
+        
+        futures = [scheduler.submit("big", task, f"big{i}") for i in range(4)]
+        futures += [scheduler.submit("small", task, f"small{i}") for i in range(2)]
+        gate.set()
+        wait(futures)
+        
+        # The small job doesn't wait for the big one to drain
+        self.assertEqual(order, ["big0", "small0", "big1", "small1", "big2", "big3"])
+    
+    def test_per_job_limit_leaves_workers_for_other_jobs(self):
+        scheduler = TrackScheduler(workers=4, metrics=PipelineMetrics())
+        lock = threading.Lock()
+        running = {"a": 0, "b": 0}
+        peak = {"a": 0, "b": 0}
+        
+        def task(job):
+            with lock:
+                running[job] += 1
+                peak[job] = max(peak[job], running[job])
+            time.sleep(0.02)
+            with lock:
+                running[job] -= 1
+        
+        futures = [scheduler.submit("a", task, "a", limit=2) for _ in range(6)]
+        futures += [scheduler.submit("b", task, "b", limit=2) for _ in range(6)]
+        wait(futures)
+        
+        self.assertEqual(peak, {"a": 2, "b": 2})
+    
+    def test_coalesce_runs_produce_once_and_hands_result_to_waiters(self):
+        scheduler = TrackScheduler(workers=1, metrics=PipelineMetrics())
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        
+        def produce():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "files"
+        
+        results = {}
+        leader = threading.Thread(target=lambda: results.setdefault("leader", scheduler.coalesce("k", produce, str.upper)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.setdefault("follower", scheduler.coalesce("k", produce, str.upper)))
+        follower.start()
+        while not scheduler._inflight["k"].followers:
+            time.sleep(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        
+        self.assertEqual(results, {"leader": "files", "follower": "FILES"})
+        self.assertEqual(len(calls), 1)
+    
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_concurrent_jobs_share_one_download_of_the_same_track(self, mock_download_single, mock_update_status):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            time.sleep(0.2)
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        downloader = PlaylistDownloader(max_workers=2, scheduler=TrackScheduler(workers=4, metrics=PipelineMetrics()))
+        downloader.cache = None
+        downloader.retries = 0
+        track = {"track": {"spotify": {"name": "Song", "artists": [{"name": "A"}]}, "tidal": {"id": 7, "url": "url7"}}}
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dirs = [os.path.join(temp_dir, job) for job in ("job_a", "job_b")]
+            results = {}
+            threads = [
+                threading.Thread(target=lambda d=d: results.setdefault(d, downloader.download_tracks([track], d, os.path.basename(d))))
+                for d in dirs
+            ]
+            for d, thread in zip(dirs, threads):
+                os.makedirs(d)
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+            
+            self.assertEqual(mock_download_single.call_count, 1)
+            for d in dirs:
+                self.assertEqual(results[d], (["A - Song"], []))
+                self.assertTrue(os.path.exists(os.path.join(d, "7.flac")))
+
+
+class TestTrackPreflight(unittest.TestCase):
+    
+    def _item(self, url, duration, **tidal):
+        return {"track": {"spotify": {"name": url, "artists": [{"name": "A"}]},
+                          "tidal": {"id": url[-1], "url": url, "duration": duration, **tidal}}}
+    
+    def test_skips_doomed_tracks_and_orders_longest_first(self):
+        preflight = TrackPreflight('hifi', probe=False, bandwidth=1000, track_overhead=1)
+        tracks = [
+            self._item("url1", 100, audioQuality='HIGH'),
+            self._item("url2", 300, allowStreaming=False),
+            self._item("url3", 200, audioQuality='HIGH'),
+            self._item("url4", 50, streamReady=False),
+        ]
+        
+        report = preflight.run(tracks)
+        
+        self.assertEqual(report.order, [2, 0])
+        self.assertEqual(report.skipped, {1: 'not streamable on TIDAL', 3: 'not stream ready on TIDAL'})
+        self.assertEqual(report.estimated_bytes, 300 * 320_000 // 8)
+        self.assertAlmostEqual(report.estimated_seconds, report.estimated_bytes / 1000 + 2)
+    
+    def test_estimate_is_capped_by_download_quality(self):
+        track = self._item("url1", 60, audioQuality='HI_RES_LOSSLESS')["track"]
+        
+        self.assertEqual(TrackPreflight('hifi').estimate_bytes(track), 60 * 2_500_000 // 8)
+        self.assertEqual(TrackPreflight('high').estimate_bytes(track), 60 * 320_000 // 8)
+    
+    def test_probe_skips_tracks_tidal_no_longer_serves(self):
+        credentials = Mock(refresh_token='refresh')
+        credentials.current.return_value = (1, {'access_token': 'token'})
+        preflight = TrackPreflight('hifi', probe=True, credentials=credentials)
+        responses = {
+            '1': Mock(status_code=200, json=Mock(return_value={'allowStreaming': True})),
+            '2': Mock(status_code=404),
+            '3': Mock(status_code=200, json=Mock(return_value={'streamReady': False})),
+            '4': Mock(status_code=429),
+        }
+        
+        def fake_get(url, **kwargs):
+            return responses[url.rsplit('/', 1)[1]]
+        
+        with patch('api.download_playlist.requests.Session.get', side_effect=fake_get):
+            report = preflight.run([self._item(f"url{i}", 100) for i in range(1, 5)])
+        
+        self.assertEqual(sorted(report.order), [0, 3])
+        self.assertEqual(report.skipped, {1: 'no longer available on TIDAL', 2: 'not stream ready on TIDAL'})
+    
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    def test_download_tracks_fails_doomed_tracks_without_attempting_them(self, mock_update_status, mock_download_single):
+        mock_download_single.side_effect = lambda tidal_track, download_dir, *args, **kwargs: _write_track_file(
+            download_dir, tidal_track['url']
+        )
+        downloader = PlaylistDownloader(max_workers=1)
+        downloader.cache = None
+        downloader.preflight = TrackPreflight('hifi', probe=False)
+        tracks = [self._item("url1", 100), self._item("url2", 100, allowStreaming=False), self._item("url3", 300)]
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            successful, failed = downloader.download_tracks(tracks, temp_dir, "job_1")
+        
+        self.assertEqual(successful, ["A - url1", "A - url3"])
+        self.assertEqual(failed, ["A - url2"])
+        # One worker, so the longest track went first
+        self.assertEqual([c[0][0]['url'] for c in mock_download_single.call_args_list], ["url3", "url1"])
+        estimate = mock_update_status.call_args_list[0][1]['estimate']
+        self.assertEqual((estimate['tracks'], estimate['skipped']), (2, 1))
+
+
+class TestProgressReporter(unittest.TestCase):
+    
+    def test_coalesces_updates_by_count(self):
+        send = Mock()
+        reporter = ProgressReporter(send, interval=3600, every=3)
+        
+        for i in range(1, 8):
+            reporter.update(i, 7, f"Track {i}")
+        reporter.flush()
+        
+        self.assertEqual(
+            [c[0] for c in send.call_args_list],
+            [(1, 7, "Track 1"), (4, 7, "Track 4"), (7, 7, "Track 7")]
+        )
+    
+    def test_flush_sends_latest_pending_update(self):
+        send = Mock()
+        reporter = ProgressReporter(send, interval=3600, every=10)
+        
+        reporter.update(1, 5, "Track 1")
+        reporter.update(2, 5, "Track 2")
+        reporter.update(3, 5, "Track 3")
+        reporter.flush()
+        reporter.flush()
+        
+        self.assertEqual([c[0] for c in send.call_args_list], [(1, 5, "Track 1"), (3, 5, "Track 3")])
+
+
+class TestPipelineMetrics(unittest.TestCase):
+    
+    @patch('builtins.print')
+    def test_stage_logs_and_renders_histogram(self, mock_print):
+        metrics = PipelineMetrics()
+        
+        with metrics.stage('track_download', track="Artist - Song") as fields:
+            fields['bytes'] = 1000
+        with self.assertRaises(RuntimeError):
+            with metrics.stage('track_download'):
+                raise RuntimeError("boom")
+        metrics.increment('download_track_failures_total')
+        metrics.increment('download_jobs_total', status='completed')
+        
+        log = json.loads(mock_print.call_args_list[0][0][0])
+        self.assertEqual(log['stage'], 'track_download')
+        self.assertEqual(log['status'], 'ok')
+        self.assertEqual(log['bytes'], 1000)
+        self.assertIn('bytes_per_second', log)
+        self.assertEqual(json.loads(mock_print.call_args_list[1][0][0])['status'], 'error')
+        
+        text = metrics.render_prometheus()
+        self.assertIn('# TYPE download_stage_seconds histogram', text)
+        self.assertIn('download_stage_seconds_bucket{stage="track_download",le="+Inf"} 2', text)
+        self.assertIn('download_stage_seconds_count{stage="track_download"} 2', text)
+        self.assertIn('download_track_failures_total 1', text)
+        self.assertIn('download_jobs_total{status="completed"} 1', text)
+    
+    @patch.object(PlaylistDownloader, 'get_playlist_data', return_value=None)
+    @patch.object(PlaylistDownloader, 'get_job_details', return_value={"playlistId": "test-playlist"})
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    def test_process_download_records_stages_and_failures(self, mock_update_status, mock_job, mock_playlist):
+        metrics = PipelineMetrics()
+        downloader = PlaylistDownloader(metrics=metrics)
+        
+        with self.assertRaises(Exception):
+            downloader.process_download("job_1")
+        
+        text = metrics.render_prometheus()
+        self.assertIn('download_stage_seconds_count{stage="fetch_job"} 1', text)
+        self.assertIn('download_stage_seconds_count{stage="fetch_playlist"} 1', text)
+        self.assertIn('download_jobs_total{status="failed"} 1', text)
+
+
+class TestTrackCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def _make_track_dir(self, name: str, size: int) -> str:
+        track_dir = os.path.join(self.temp_dir.name, name)
+        os.makedirs(track_dir)
+        with open(os.path.join(track_dir, f"{name}.flac"), 'wb') as f:
+            f.write(b'x' * size)
+        return track_dir
+    
+    def test_key_prefers_tidal_id(self):
+        self.assertEqual(TrackCache.key({"id": 42, "isrc": "GBX"}, "GBX", "hifi"), "tidal-42-hifi")
+        self.assertEqual(TrackCache.key({}, "GB/X1", "hifi"), "isrc-GB_X1-hifi")
+        self.assertIsNone(TrackCache.key({}, None, "hifi"))
+    
+    def test_default_cap_fits_a_small_tmp(self):
+        with patch.dict(os.environ, clear=True), \
+                patch('api.download_playlist.shutil.disk_usage', return_value=Mock(total=512 * 1024 ** 2)):
+            self.assertEqual(TrackCache(self.cache_dir).max_bytes, 128 * 1024 ** 2)
+    
+    def test_insert_and_fetch(self):
+        cache = TrackCache(self.cache_dir, max_bytes=1024)
+        cache.insert("tidal-1-hifi", self._make_track_dir("one", 10))
+        
+        dest = os.path.join(self.temp_dir.name, 'dest')
+        os.makedirs(dest)
+        
+        self.assertTrue(cache.fetch("tidal-1-hifi", dest))
+        self.assertEqual(os.listdir(dest), ["one.flac"])
+        self.assertFalse(cache.fetch("tidal-2-hifi", dest))
+    
+    def test_evicts_least_recently_used(self):
+        cache = TrackCache(self.cache_dir, max_bytes=25)
+        cache.insert("a", self._make_track_dir("a", 10))
+        cache.insert("b", self._make_track_dir("b", 10))
+        
+        # Touch "a" so "b" becomes the eviction candidate
+        dest = os.path.join(self.temp_dir.name, 'dest')
+        os.makedirs(dest)
+        cache.fetch("a", dest)
+        
+        cache.insert("c", self._make_track_dir("c", 10))
+        
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["a", "c"])
+    
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_download_tracks_serves_cache_hits(self, mock_download_single, mock_update_status):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        
+        downloader = PlaylistDownloader(cache=TrackCache(self.cache_dir, max_bytes=1024))
+        tracks = [
+            {"track": {"isrc": "ISRC1", "spotify": {"name": "Song1", "artists": [{"name": "Artist1"}]}, "tidal": {"id": 1, "url": "url1"}}}
+        ]
+        
+        for job in ("job-1", "job-2"):
+            download_dir = os.path.join(self.temp_dir.name, job)
+            os.makedirs(download_dir)
+            successful, failed = downloader.download_tracks(tracks, download_dir, job)
+            
+            self.assertEqual(successful, ["Artist1 - Song1"])
+            self.assertEqual(os.listdir(download_dir), ["1.flac"])
+        
+        # Second job was served from the cache
+        self.assertEqual(mock_download_single.call_count, 1)
+
+
+class TestOutputProfile(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, 'cache')
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_from_job(self):
+        self.assertIsNone(OutputProfile.from_job({}))
+        self.assertIsNone(OutputProfile.from_job({"profile": "original"}))
+        
+        profile = OutputProfile.from_job({"profile": "MP3-320", "normalize": True})
+        self.assertEqual((profile.name, profile.extension, profile.cache_suffix), ("mp3-320", ".mp3", "mp3-320-rg"))
+        
+        with self.assertRaises(ValueError):
+            OutputProfile.from_job({"profile": "wma"})
+    
+    def test_gain_is_limited_by_peak(self):
+        profile = OutputProfile('aiff', normalize=True)
+        
+        self.assertEqual(profile.gain_db({"replayGain": -8.2, "peak": 0.99}), -8.2)
+        # +6 dB would push a 0.9 peak past full scale
+        self.assertEqual(profile.gain_db({"replayGain": 6.0, "peak": 0.9}), 0.92)
+        self.assertIsNone(profile.gain_db({}))
+        self.assertIsNone(OutputProfile('aiff').gain_db({"replayGain": -8.2, "peak": 0.99}))
+    
+    def test_command(self):
+        command = OutputProfile('aiff').command('in.flac', 'out.aiff', sample_rate=192000, bits=24, gain_db=-3.5)
+        
+        self.assertEqual(command[-1], 'out.aiff')
+        self.assertIn('-map_metadata', command)
+        self.assertEqual(command[command.index('-c:a') + 1], 'pcm_s24be')
+        self.assertEqual(command[command.index('-ar') + 1], '48000')
+        self.assertEqual(command[command.index('-af') + 1], 'volume=-3.5dB')
+        
+        # Sample rates are halved, staying in the 44.1 kHz family
+        command = OutputProfile('mp3-320').command('in.flac', 'out.mp3', sample_rate=176400, bits=24)
+        self.assertEqual(command[command.index('-c:a') + 1], 'libmp3lame')
+        self.assertEqual(command[command.index('-ar') + 1], '44100')
+        self.assertNotIn('-af', command)
+        
+        self.assertEqual(OutputProfile('alac').command('in.flac', 'out.m4a', sample_rate=192000)[-3:],
+                         ['-ar', '96000', 'out.m4a'])
+        self.assertNotIn('-ar', OutputProfile('alac').command('in.flac', 'out.m4a', sample_rate=44100))
+    
+    def test_profile_reaches_python_through_status_route(self):
+        stored = {"id": "job_1", "playlistId": "playlist", "status": "queued", "profile": "alac", "normalize": True}
+        
+        profile = OutputProfile.from_job(_status_response(stored))
+        
+        self.assertEqual((profile.name, profile.normalize), ("alac", True))
+    
+    @patch.object(Transcoder, 'probe', return_value=(44100, 16))
+    @patch('api.download_playlist.subprocess.run')
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_transcodes_are_cached_by_profile(self, mock_download_single, mock_update_status, mock_run, mock_probe):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return True
+        
+        def fake_ffmpeg(command, **kwargs):
+            with open(command[-1], 'wb') as f:
+                f.write(b'mp3')
+            return Mock(returncode=0)
+        
+        mock_download_single.side_effect = fake_download
+        mock_run.side_effect = fake_ffmpeg
+        
+        cache = TrackCache(self.cache_dir, max_bytes=1024)
+        downloader = PlaylistDownloader(cache=cache)
+        tracks = [
+            {"track": {"isrc": "ISRC1", "spotify": {"name": "Song1", "artists": [{"name": "Artist1"}]}, "tidal": {"id": 1, "url": "url1"}}}
+        ]
+        
+        for job in ("job-1", "job-2"):
+            download_dir = os.path.join(self.temp_dir.name, job)
+            os.makedirs(download_dir)
+            successful, failed = downloader.download_tracks(
+                tracks, download_dir, job, profile=OutputProfile('mp3-320')
+            )
+            
+            self.assertEqual(successful, ["Artist1 - Song1"])
+            self.assertEqual(os.listdir(download_dir), ["1.mp3"])
+        
+        # Second job was served the transcode from the cache
+        self.assertEqual(mock_download_single.call_count, 1)
+        self.assertEqual(mock_run.call_count, 1)
+        # The original is cached too, for jobs without a profile
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         [f"isrc-ISRC1-{downloader.quality}-mp3-320", f"tidal-1-{downloader.quality}"])
+    
+    @patch.object(Transcoder, 'probe', return_value=(None, None))
+    @patch('api.download_playlist.subprocess.run')
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_failed_transcode_fails_track(self, mock_download_single, mock_update_status, mock_run, mock_probe):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        mock_run.side_effect = subprocess.CalledProcessError(1, 'ffmpeg', stderr='Invalid data')
+        
+        downloader = PlaylistDownloader()
+        tracks = [
+            {"track": {"spotify": {"name": "Song1", "artists": [{"name": "Artist1"}]}, "tidal": {"id": 1, "url": "url1"}}}
+        ]
+        download_dir = os.path.join(self.temp_dir.name, 'job')
+        os.makedirs(download_dir)
+        
+        successful, failed = downloader.download_tracks(tracks, download_dir, 'job', profile=OutputProfile('aiff'))
+        
+        self.assertEqual(failed, ["Artist1 - Song1"])
+        self.assertEqual(os.listdir(download_dir), [])
+    
+    @patch('api.download_playlist.subprocess.run')
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_transcode_needs_room_in_the_disk_budget(self, mock_download_single, mock_update_status, mock_run):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'a' * 100)
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        downloader = PlaylistDownloader()
+        downloader.cache = None
+        tracks = [
+            {"track": {"spotify": {"name": "Song1", "artists": [{"name": "Artist1"}]}, "tidal": {"id": 1, "url": "url1"}}}
+        ]
+        download_dir = os.path.join(self.temp_dir.name, 'job')
+        os.makedirs(download_dir)
+        # Room for the download, but not for its transcode alongside it
+        budget = DiskBudget(self.temp_dir.name, max_bytes=150, min_free_bytes=0, track_estimate=100, wait=0)
+        
+        with self.assertRaises(DiskBudgetExceeded):
+            downloader.download_tracks(tracks, download_dir, 'job', budget=budget, profile=OutputProfile('aiff'))
+        mock_run.assert_not_called()
+
+
+class TestStreamingZipPackager(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.tracks_dir = os.path.join(self.temp_dir.name, 'tracks')
+        os.makedirs(self.tracks_dir)
+        self.zip_path = os.path.join(self.temp_dir.name, 'playlist.zip')
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def _write(self, name: str, content: bytes = b'a' * 100):
+        with open(os.path.join(self.tracks_dir, name), 'wb') as f:
+            f.write(content)
+    
+    def test_stores_audio_and_deflates_other_files(self):
+        self._write("song.flac")
+        self._write("song.lrc")
+        self._write("temp_config.json")
+        
+        with StreamingZipPackager(self.zip_path) as packager:
+            packager.add_files(self.tracks_dir, ["song.flac", "song.lrc", "temp_config.json"])
+            packager.add_files(self.tracks_dir, ["song.flac"])
+        
+        with zipfile.ZipFile(self.zip_path) as zipf:
+            infos = {info.filename: info for info in zipf.infolist()}
+        
+        self.assertEqual(sorted(infos), ["song.flac", "song.lrc"])
+        self.assertEqual(infos["song.flac"].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(infos["song.lrc"].compress_type, zipfile.ZIP_DEFLATED)
+    
+    def test_write_zip_parallel_applies_policy(self):
+        self._write("a.wav", b'wave' * 5000)
+        self._write("b.cue", b'cue ' * 5000)
+        self._write("c.flac", b'flac' * 5000)
+        self._write("d.bin", os.urandom(5000))
+        
+        policy = CompressionPolicy({'.wav': (zipfile.ZIP_DEFLATED, 1), '.cue': (zipfile.ZIP_DEFLATED, 9)})
+        write_zip_parallel(self.zip_path, self.tracks_dir, ["a.wav", "b.cue", "c.flac", "d.bin"], policy, workers=3)
+        
+        with zipfile.ZipFile(self.zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            infos = {info.filename: info for info in zipf.infolist()}
+            self.assertEqual(zipf.namelist(), ["a.wav", "b.cue", "c.flac", "d.bin"])
+            self.assertEqual(zipf.read("b.cue"), b'cue ' * 5000)
+        
+        self.assertEqual(infos["a.wav"].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(infos["c.flac"].compress_type, zipfile.ZIP_STORED)
+        # Incompressible data falls back to stored
+        self.assertEqual(infos["d.bin"].compress_type, zipfile.ZIP_STORED)
+    
+    def test_compression_policy_from_env(self):
+        with patch.dict(os.environ, {'ZIP_COMPRESSION_POLICY': 'wav=deflate:1,flac=deflate,*=store'}):
+            policy = CompressionPolicy.from_env()
+        
+        self.assertEqual(policy.for_file("a.WAV"), (zipfile.ZIP_DEFLATED, 1))
+        self.assertEqual(policy.for_file("a.flac"), (zipfile.ZIP_DEFLATED, 6))
+        self.assertEqual(policy.for_file("a.mp3"), (zipfile.ZIP_STORED, 0))
+        self.assertEqual(policy.for_file("a.txt"), (zipfile.ZIP_STORED, 0))
+    
+    @patch.object(RawZipWriter, 'ZIP64_COUNT_LIMIT', 2)
+    @patch.object(RawZipWriter, 'ZIP64_LIMIT', 150)
+    def test_raw_zip_writer_zip64_records(self):
+        self._write("big.bin", b'x' * 200)
+        self._write("small.txt", b'y' * 10)
+        self._write("third.txt", b'z' * 10)
+        
+        write_zip_parallel(self.zip_path, self.tracks_dir, ["big.bin", "small.txt", "third.txt"],
+                           CompressionPolicy(default=(zipfile.ZIP_STORED, 0)))
+        
+        with zipfile.ZipFile(self.zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.getinfo("big.bin").file_size, 200)
+            self.assertEqual(zipf.read("third.txt"), b'z' * 10)
+    
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_download_tracks_packages_as_tracks_complete(self, mock_download_single, mock_update_status):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['url']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return tidal_track['url'] != 'url2'
+        
+        mock_download_single.side_effect = fake_download
+        
+        downloader = PlaylistDownloader()
+        downloader.cache = None
+        downloader.retries = 0
+        tracks = [
+            {"track": {"spotify": {"name": f"Song{i}", "artists": [{"name": f"Artist{i}"}]}, "tidal": {"url": f"url{i}"}}}
+            for i in range(1, 4)
+        ]
+        
+        with StreamingZipPackager(self.zip_path) as packager:
+            successful, failed = downloader.download_tracks(tracks, self.tracks_dir, "job-1", packager=packager)
+        
+        self.assertEqual(failed, ["Artist2 - Song2"])
+        with zipfile.ZipFile(self.zip_path) as zipf:
+            self.assertEqual(sorted(zipf.namelist()), ["url1.flac", "url3.flac"])
+
+
+class TestDiskBudget(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = self.temp_dir.name
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def _write(self, name: str, size: int):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(b'a' * size)
+    
+    def test_fails_fast_once_budget_is_exhausted(self):
+        self._write("track.flac", 900)
+        budget = DiskBudget(self.path, max_bytes=1000, min_free_bytes=0, track_estimate=200, wait=0)
+        
+        with self.assertRaisesRegex(DiskBudgetExceeded, "Disk budget exceeded: 1100 bytes needed, budget is 1000"):
+            with budget.reserve():
+                pass
+        
+        # Other downloads don't wait out the timeout again
+        budget.wait = 60
+        with self.assertRaises(DiskBudgetExceeded):
+            with budget.reserve():
+                pass
+    
+    def test_waits_for_packed_tracks_to_be_deleted(self):
+        import threading
+        self._write("packed.flac", 900)
+        budget = DiskBudget(self.path, max_bytes=1000, min_free_bytes=0, track_estimate=200, wait=10)
+        
+        def pack():
+            time.sleep(0.05)
+            os.remove(os.path.join(self.path, "packed.flac"))
+            budget.released()
+        
+        thread = threading.Thread(target=pack)
+        thread.start()
+        with budget.reserve():
+            pass
+        thread.join()
+    
+    def test_estimate_follows_largest_track_and_in_flight_downloads(self):
+        budget = DiskBudget(self.path, max_bytes=1000, min_free_bytes=0, track_estimate=10, wait=0)
+        budget.record_track(400)
+        
+        with budget.reserve():
+            with budget.reserve():
+                with self.assertRaises(DiskBudgetExceeded):
+                    with budget.reserve():
+                        pass
+    
+    @patch('api.download_playlist.shutil.disk_usage')
+    def test_checks_free_disk_space(self, mock_disk_usage):
+        mock_disk_usage.return_value = Mock(free=100 * 1024 ** 2)
+        budget = DiskBudget(self.path, max_bytes=0, min_free_bytes=64 * 1024 ** 2, track_estimate=50 * 1024 ** 2, wait=0)
+        
+        with self.assertRaisesRegex(DiskBudgetExceeded, "Not enough free disk space"):
+            with budget.reserve():
+                pass
+    
+    def test_evicts_track_cache_before_running_out_of_disk(self):
+        cache = TrackCache(os.path.join(self.path, 'cache'), max_bytes=1024)
+        for key in ("a", "b"):
+            entry = os.path.join(self.path, key)
+            os.makedirs(entry)
+            self._write(os.path.join(key, f"{key}.flac"), 10)
+            cache.insert(key, entry)
+        
+        # Evicting the cache frees 20 MiB, enough for the next track
+        def disk_usage(path):
+            cached = os.path.exists(os.path.join(self.path, 'cache', 'a'))
+            return Mock(free=(100 if cached else 120) * 1024 ** 2)
+        
+        budget = DiskBudget(self.path, max_bytes=0, min_free_bytes=64 * 1024 ** 2, track_estimate=50 * 1024 ** 2,
+                            wait=0, cache=cache)
+        with patch('api.download_playlist.shutil.disk_usage', side_effect=disk_usage):
+            with budget.reserve():
+                pass
+        
+        self.assertEqual(os.listdir(cache.cache_dir), [])
+    
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_packed_tracks_are_deleted_under_a_budget(self, mock_download_single, mock_update_status):
+        tracks_dir = os.path.join(self.path, 'tracks')
+        os.makedirs(tracks_dir)
+        
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['url']}.flac"), 'wb') as f:
+                f.write(b'a' * 300)
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        downloader = PlaylistDownloader(max_workers=1)
+        downloader.cache = None
+        downloader.delete_packed = True
+        tracks = [
+            {"track": {"spotify": {"name": f"Song{i}", "artists": [{"name": "Artist"}]}, "tidal": {"url": f"url{i}"}}}
+            for i in range(1, 6)
+        ]
+        zip_path = os.path.join(self.path, 'playlist.zip')
+        budget = DiskBudget(self.path, max_bytes=3000, min_free_bytes=0, track_estimate=300, wait=0)
+        
+        # Five 300 byte tracks only fit a 3000 byte budget because each is deleted once packed
+        with StreamingZipPackager(zip_path, CompressionPolicy(default=(zipfile.ZIP_STORED, 0))) as packager:
+            successful, failed = downloader.download_tracks(tracks, tracks_dir, "job-1", packager=packager, budget=budget)
+        
+        self.assertEqual((len(successful), failed), (5, []))
+        self.assertEqual(os.listdir(tracks_dir), [])
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertEqual(len(zipf.namelist()), 5)
+    
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_packed_tracks_wait_for_analysis_without_blocking_workers(self, mock_download_single, mock_update_status):
+        tracks_dir = os.path.join(self.path, 'tracks')
+        os.makedirs(tracks_dir)
+        
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['url']}.flac"), 'wb') as f:
+                f.write(b'a' * 300)
+            return True
+        
+        release = threading.Event()
+        self.addCleanup(release.set)
+        analyzer = AudioAnalyzer(os.path.join(self.path, 'analysis'), analyse=lambda path: release.wait() and {})
+        analyzer._executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(analyzer.close)
+        mock_download_single.side_effect = fake_download
+        downloader = PlaylistDownloader(max_workers=1)
+        downloader.cache = None
+        downloader.analyzer = analyzer
+        downloader.delete_packed = True
+        tracks = [
+            {"track": {"spotify": {"name": f"Song{i}", "artists": [{"name": "Artist"}]}, "tidal": {"url": f"url{i}"}}}
+            for i in range(1, 3)
+        ]
+        
+        with StreamingZipPackager(os.path.join(self.path, 'playlist.zip')) as packager:
+            successful, failed = downloader.download_tracks(tracks, tracks_dir, "job-1", packager=packager)
+        
+        # Both tracks went through a single worker while their analysis was still running
+        self.assertEqual((len(successful), failed), (2, []))
+        self.assertEqual(sorted(os.listdir(tracks_dir)), ["url1.flac", "url2.flac"])
+        
+        release.set()
+        deadline = time.monotonic() + 5
+        while os.listdir(tracks_dir) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(os.listdir(tracks_dir), [])
+    
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_job_fails_with_clear_error_when_budget_runs_out(self, mock_download_single, mock_update_status):
+        mock_download_single.return_value = True
+        downloader = PlaylistDownloader(max_workers=2)
+        downloader.cache = None
+        downloader.work_dir = self.path
+        playlist = {"name": "Mix", "tracks": {"items": [
+            {"track": {"matchStatus": "matched", "spotify": {"name": f"Song{i}", "artists": [{"name": "A"}]},
+                       "tidal": {"id": i, "url": f"url{i}"}}}
+            for i in range(10)
+        ]}}
+        
+        env = {'DISK_BUDGET_BYTES': '100', 'DISK_TRACK_ESTIMATE_BYTES': '1000', 'DISK_WAIT_SECONDS': '0'}
+        with patch.dict(os.environ, env), \
+                patch.object(PlaylistDownloader, '_load_job', return_value=(playlist, playlist['tracks']['items'], None, None)):
+            with self.assertRaisesRegex(DiskBudgetExceeded, "Disk budget exceeded"):
+                downloader.process_download("job_1")
+        
+        mock_download_single.assert_not_called()
+        self.assertEqual(mock_update_status.call_args[0][:5], ("job_1", 'failed', 0, 0, None))
+        self.assertIn("Disk budget exceeded", mock_update_status.call_args[0][5])
+
+
+class TestVolumeSplitting(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.tracks_dir = os.path.join(self.temp_dir.name, 'tracks')
+        os.makedirs(self.tracks_dir)
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def _write(self, name: str, size: int = 100):
+        with open(os.path.join(self.tracks_dir, name), 'wb') as f:
+            f.write(os.urandom(size))
+    
+    def test_splitter_groups_by_track_count_and_size(self):
+        tracks = [(["a.flac", "a.lrc"], 100), (["b.flac"], 100), (["c.flac"], 500), (["d.flac"], 100)]
+        
+        self.assertEqual(VolumeSplitter(max_tracks=2).group(tracks), [
+            (["a.flac", "a.lrc", "b.flac"], 2), (["c.flac", "d.flac"], 2)
+        ])
+        # An oversized track gets a volume of its own
+        self.assertEqual(VolumeSplitter(max_bytes=300).group(tracks), [
+            (["a.flac", "a.lrc", "b.flac"], 2), (["c.flac"], 1), (["d.flac"], 1)
+        ])
+        
+        with patch.dict(os.environ, {'ARCHIVE_VOLUME_BYTES': '0', 'ARCHIVE_VOLUME_TRACKS': '0'}):
+            self.assertIsNone(VolumeSplitter.from_env())
+    
+    def test_packager_publishes_each_volume_when_sealed(self):
+        sealed = []
+        packager = VolumePackager(
+            lambda part: os.path.join(self.temp_dir.name, f'part{part}.zip'),
+            VolumeSplitter(max_tracks=2),
+            lambda part, path, tracks: sealed.append((part, tracks))
+        )
+        
+        for name in ("1.flac", "2.flac", "3.flac", "4.flac", "5.flac"):
+            self._write(name)
+        
+        with packager:
+            packager.add_files(self.tracks_dir, ["1.flac"])
+            packager.add_files(self.tracks_dir, ["2.flac"])
+            self.assertEqual(sealed, [])
+            packager.add_files(self.tracks_dir, ["3.flac"])
+            # Part 1 is out before the rest of the playlist is done
+            self.assertEqual(sealed, [(1, 2)])
+            packager.add_files(self.tracks_dir, ["4.flac"])
+            packager.add_files(self.tracks_dir, ["5.flac"])
+        
+        self.assertEqual(sealed, [(1, 2), (2, 2), (3, 1)])
+        with zipfile.ZipFile(os.path.join(self.temp_dir.name, 'part3.zip')) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.namelist(), ["5.flac"])
+    
+    @patch.object(PlaylistDownloader, 'update_job_completion')
+    def test_no_sealed_volumes_fails_the_job(self, mock_completion):
+        downloader = PlaylistDownloader()
+        downloader.work_dir = self.temp_dir.name
+        downloader.volume_splitter = VolumeSplitter(max_tracks=2)
+        
+        with self.assertRaisesRegex(Exception, "No tracks could be downloaded"):
+            downloader._finalize_volumes("job_1", [], self.temp_dir.name, {}, [], [])
+        with self.assertRaisesRegex(Exception, "No tracks could be downloaded"):
+            downloader._publish_volumes("job_1", [], [], [])
+        mock_completion.assert_not_called()
+    
+    @patch.object(PlaylistDownloader, 'update_job_completion')
+    @patch.object(PlaylistDownloader, 'update_job_volumes')
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_process_download_publishes_volumes(self, mock_download_single, mock_update_status,
+                                                mock_update_volumes, mock_completion):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        downloader = PlaylistDownloader(max_workers=1)
+        downloader.cache = None
+        downloader.work_dir = self.temp_dir.name
+        downloader.volume_splitter = VolumeSplitter(max_tracks=2)
+        playlist = {"name": "Mix", "tracks": {"items": [
+            {"track": {"matchStatus": "matched", "spotify": {"name": f"Song{i}", "artists": [{"name": "A"}]},
+                       "tidal": {"id": i, "url": f"url{i}"}}}
+            for i in range(3)
+        ]}}
+        job_id = f"job_volumes_{os.getpid()}"
+        self.addCleanup(lambda: [os.remove(f"/tmp/{job_id}.part{part}.zip") for part in (1, 2)
+                                 if os.path.exists(f"/tmp/{job_id}.part{part}.zip")])
+        
+        with patch.object(PlaylistDownloader, '_load_job', return_value=(playlist, playlist['tracks']['items'], None, None)):
+            result = downloader.process_download(job_id)
+        
+        volumes = result['volumes']
+        self.assertEqual([(v['part'], v['tracks']) for v in volumes], [(1, 2), (2, 1)])
+        self.assertEqual(volumes[0]['url'], f"/api/download/file/{job_id}?part=1")
+        self.assertEqual(mock_update_volumes.call_count, 2)
+        mock_completion.assert_called_once_with(job_id, volumes[0]['url'], [], sync=None, volumes=volumes,
+                                                analysis=None)
+        with zipfile.ZipFile(f"/tmp/{job_id}.part2.zip") as zipf:
+            self.assertEqual(zipf.namelist(), ["2.flac"])
+
+
+def _fake_analysis(path):
+    # Module level so analysis worker processes can unpickle it; logs each call next to the file
+    with open(f"{path}.analysed", 'a') as f:
+        f.write("x")
+    return {'bpm': 124.0, 'key': 'A minor', 'camelot': '8A', 'lufs': -8.5, 'sections': [0.0]}
+
+
+def _write_wav(path, samples, sample_rate):
+    import numpy as np
+    import wave
+    pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.repeat(pcm[:, None], 2, axis=1).tobytes())
+
+
+@unittest.skipUnless(importlib.util.find_spec('numpy'), "NumPy not installed")
+class TestAudioAnalysis(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_disabled_without_ffmpeg(self):
+        with patch.dict(os.environ, {'ANALYSIS': '1'}):
+            with patch.object(Transcoder, 'available', return_value=False):
+                self.assertIsNone(AudioAnalyzer.from_env(self.temp_dir.name))
+            with patch.object(Transcoder, 'available', return_value=True):
+                self.assertIsNotNone(AudioAnalyzer.from_env(self.temp_dir.name))
+    
+    def test_analyse_audio_measures_tempo_key_and_sections(self):
+        import numpy as np
+        sample_rate = 22050
+        t = np.arange(64 * sample_rate) / sample_rate
+        
+        def chord(*freqs):
+            return sum(np.sin(2 * np.pi * f * t) for f in freqs) / len(freqs)
+        
+        # A minor, then D minor from 32s, over a kick on every beat at 120 BPM
+        music = np.where(t < 32, 0.3 * chord(220, 261.63, 329.63), 0.5 * chord(293.66, 349.23, 440))
+        kick = np.exp(-(t % 0.5) * 60) * np.sin(2 * np.pi * 80 * t) * 0.6
+        path = os.path.join(self.temp_dir.name, "track.wav")
+        _write_wav(path, music + kick, sample_rate)
+        
+        analysis = analyse_audio(path)
+        
+        self.assertAlmostEqual(analysis['bpm'], 120, delta=1)
+        self.assertEqual(analysis['duration'], 64)
+        self.assertIn(analysis['camelot'], ('8A', '7A'))
+        self.assertEqual(analysis['sections'][0], 0.0)
+        self.assertTrue(any(abs(start - 32) <= 2 for start in analysis['sections'][1:]))
+    
+    def test_integrated_loudness_matches_bs1770_reference(self):
+        import numpy as np
+        sample_rate = 48000
+        t = np.arange(5 * sample_rate) / sample_rate
+        # A 997 Hz tone at -20 dBFS on both channels reads -20 LUFS
+        path = os.path.join(self.temp_dir.name, "tone.wav")
+        _write_wav(path, 0.1 * np.sin(2 * np.pi * 997 * t), sample_rate)
+        
+        self.assertAlmostEqual(analyse_audio(path)['lufs'], -20.0, delta=0.2)
+    
+    def test_analysis_key_is_safe_as_a_file_name(self):
+        self.assertEqual(analysis_key({"isrc": "GB/../X1", "tidal": {"id": 1}}), "isrc-GB_.._X1")
+        self.assertEqual(analysis_key({"tidal": {"id": 1}}), "tidal_1")
+    
+    def test_analyzer_caches_results_by_isrc(self):
+        analyzer = AudioAnalyzer(os.path.join(self.temp_dir.name, "cache"), workers=2, analyse=_fake_analysis)
+        self.addCleanup(analyzer.close)
+        with open(os.path.join(self.temp_dir.name, "a.flac"), 'wb') as f:
+            f.write(b'audio')
+        key = analysis_key({"isrc": "ISRC1", "tidal": {"id": 1}})
+        
+        analyzer.submit(key, self.temp_dir.name, ["a.flac", "a.lrc"])
+        first = analyzer.result(key)
+        analyzer.submit(key, self.temp_dir.name, ["a.flac"])
+        
+        self.assertEqual(first['bpm'], 124.0)
+        self.assertEqual(analyzer.result(key), first)
+        with open(os.path.join(self.temp_dir.name, "a.flac.analysed")) as f:
+            self.assertEqual(f.read(), "x")
+        self.assertEqual(key, "isrc-ISRC1")
+    
+    @patch.object(PlaylistDownloader, 'update_job_completion')
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_process_download_ships_analysis_in_archive_and_completion(self, mock_download_single,
+                                                                       mock_update_status, mock_completion):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        downloader = PlaylistDownloader(max_workers=2)
+        downloader.cache = None
+        downloader.work_dir = self.temp_dir.name
+        downloader.analyzer = AudioAnalyzer(os.path.join(self.temp_dir.name, "cache"), workers=2,
+                                            analyse=_fake_analysis)
+        self.addCleanup(downloader.analyzer.close)
+        playlist = {"name": "Mix", "tracks": {"items": [
+            {"track": {"isrc": f"ISRC{i}", "matchStatus": "matched",
+                       "spotify": {"name": f"Song{i}", "artists": [{"name": "A"}]},
+                       "tidal": {"id": i, "url": f"url{i}"}}}
+            for i in range(2)
+        ]}}
+        job_id = f"job_analysis_{os.getpid()}"
+        self.addCleanup(lambda: os.path.exists(f"/tmp/{job_id}.zip") and os.remove(f"/tmp/{job_id}.zip"))
+        
+        with patch.object(PlaylistDownloader, '_load_job', return_value=(playlist, playlist['tracks']['items'], None, None)):
+            downloader.process_download(job_id)
+        
+        analysis = mock_completion.call_args[1]['analysis']
+        self.assertEqual([(a['track'], a['isrc'], a['bpm']) for a in analysis],
+                         [("A - Song0", "ISRC0", 124.0), ("A - Song1", "ISRC1", 124.0)])
+        with zipfile.ZipFile(f"/tmp/{job_id}.zip") as zipf:
+            self.assertEqual(sorted(zipf.namelist()), ["0.flac", "1.flac", "analysis.json"])
+            self.assertEqual(json.loads(zipf.read("analysis.json"))['tracks'], analysis)
+
+
+class TestStreamDelivery(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.downloader = PlaylistDownloader()
+        self.downloader.cache = None
+        self.downloader.delivery_mode = 'stream'
+        self.downloader.work_dir = self.temp_dir.name
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    @patch.object(PlaylistDownloader, 'update_job_completion')
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    @patch.object(PlaylistDownloader, 'get_playlist_data')
+    @patch.object(PlaylistDownloader, 'get_job_details')
+    def test_stream_mode_keeps_tracks_and_streams_archive(self, mock_job, mock_playlist, mock_download_single,
+                                                          mock_update_status, mock_completion):
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, "Test Artist - Test Song.flac"), 'wb') as f:
+                f.write(b'audio' * 1000)
+            return True
+        
+        mock_job.return_value = {"playlistId": "test-playlist"}
+        mock_playlist.return_value = {
+            "name": "Test Playlist",
+            "tracks": {"items": [{"track": {
+                "matchStatus": "matched",
+                "spotify": {"name": "Test Song", "artists": [{"name": "Test Artist"}]},
+                "tidal": {"url": "https://tidal.com/test-track"}
+            }}]}
+        }
+        mock_download_single.side_effect = fake_download
+        
+        result = self.downloader.process_download("job_1")
+        
+        self.assertTrue(result['success'])
+        mock_completion.assert_called_once_with("job_1", "/api/download/file/job_1", [], delivery='stream', sync=None,
+                                                analysis=None)
+        self.assertFalse(any(f.endswith('.zip') for _, _, files in os.walk(self.temp_dir.name) for f in files))
+        
+        archive = b''.join(self.downloader.stream_archive("job_1"))
+        
+        with zipfile.ZipFile(io.BytesIO(archive)) as zipf:
+            self.assertEqual(zipf.namelist(), ["Test Artist - Test Song.flac"])
+            self.assertEqual(zipf.read("Test Artist - Test Song.flac"), b'audio' * 1000)
+        
+        # Tracks are kept until the job expires, so the link can be fetched again
+        self.assertEqual(b''.join(self.downloader.stream_archive("job_1")), archive)
+    
+    def test_stream_archive_rejects_unknown_or_invalid_jobs(self):
+        with self.assertRaises(FileNotFoundError):
+            next(self.downloader.stream_archive("job_missing"))
+        with self.assertRaises(ValueError):
+            next(self.downloader.stream_archive("../etc"))
+
+
+class TestJobManifest(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.downloader = PlaylistDownloader()
+        self.downloader.cache = None
+        self.downloader.retries = 0
+        self.downloader.work_dir = self.temp_dir.name
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_completed_tracks_requires_files_on_disk(self):
+        base_dir = os.path.join(self.temp_dir.name, 'tracks')
+        os.makedirs(base_dir)
+        for name in ("a.flac", "b.flac"):
+            with open(os.path.join(base_dir, name), 'wb') as f:
+                f.write(b'audio')
+        
+        manifest = JobManifest(self.temp_dir.name)
+        manifest.record_track("tidal:1", "A", base_dir, ["a.flac"])
+        manifest.record_track("tidal:2", "B", base_dir, ["b.flac"])
+        
+        entry = manifest.load()['tracks']['tidal:1']
+        self.assertEqual(entry['files'][0], {'path': "a.flac", 'size': 5})
+        
+        # A truncated file means the track has to be downloaded again
+        with open(os.path.join(base_dir, "b.flac"), 'wb') as f:
+            f.write(b'au')
+        
+        self.assertEqual(manifest.completed_tracks(base_dir), {"tidal:1": ["a.flac"]})
+    
+    @patch.object(PlaylistDownloader, 'update_job_status')
+    @patch.object(PlaylistDownloader, 'download_single_track')
+    def test_download_tracks_resumes_from_manifest(self, mock_download_single, mock_update_status):
+        attempts = []
+        
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            attempts.append(tidal_track['id'])
+            # Track 2 fails the first time round, as if the instance was recycled
+            if tidal_track['id'] == 2 and attempts.count(2) == 1:
+                return False
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return True
+        
+        mock_download_single.side_effect = fake_download
+        tracks = [
+            {"track": {"spotify": {"name": f"Song{i}", "artists": [{"name": f"Artist{i}"}]}, "tidal": {"id": i, "url": f"url{i}"}}}
+            for i in (1, 2)
+        ]
+        
+        download_dir = self.downloader._prepare_job_dir("job_1")
+        manifest = JobManifest(self.downloader.job_work_dir("job_1"))
+        
+        _, failed = self.downloader.download_tracks(tracks, download_dir, "job_1", manifest=manifest)
+        self.assertEqual(failed, ["Artist2 - Song2"])
+        
+        successful, failed = self.downloader.download_tracks(tracks, download_dir, "job_1", manifest=manifest)
+        
+        self.assertEqual(successful, ["Artist1 - Song1", "Artist2 - Song2"])
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(attempts), [1, 2, 2])
+    
+    def test_sweep_deletes_stale_job_dirs(self):
+        for job_id in ("job_old", "job_new"):
+            download_dir = self.downloader._prepare_job_dir(job_id)
+            JobManifest(self.downloader.job_work_dir(job_id)).record_track("tidal:1", "A", download_dir, [])
+        os.makedirs(os.path.join(self.temp_dir.name, '.sync'))
+        for job_id in ("job_old", "job_new"):
+            with open(self.downloader.sync_manifest_path(job_id), 'w') as f:
+                f.write('{}')
+        
+        stale = time.time() - self.downloader.job_ttl - 60
+        for path in (".sync", ".sync/job_old.json", "job_old", "job_old/tracks", "job_old/manifest.json"):
+            os.utime(os.path.join(self.temp_dir.name, path), (stale, stale))
+        
+        self.assertEqual(self.downloader.sweep_stale_jobs(), 2)
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), [".sync", "job_new"])
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir.name, '.sync')), ["job_new.json"])
+
+
+class TestChunkedExecution(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.downloader = PlaylistDownloader(max_workers=1)
+        self.downloader.retries = 0
+        self.downloader.cache = None
+        self.downloader.work_dir = self.temp_dir.name
+        self.playlist_data = {
+            "name": "Test Playlist",
+            "tracks": {"items": [
+                {"track": {
+                    "matchStatus": "matched",
+                    "spotify": {"name": f"Song{i}", "artists": [{"name": f"Artist{i}"}]},
+                    "tidal": {"id": i, "url": f"url{i}"}
+                }}
+                for i in range(1, 5)
+            ]}
+        }
+        
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return tidal_track['id'] != 3
+        
+        for name, kwargs in (
+            ('get_job_details', {'return_value': {"playlistId": "test-playlist"}}),
+            ('get_playlist_data', {'return_value': self.playlist_data}),
+            ('download_single_track', {'side_effect': fake_download}),
+            ('update_job_status', {}),
+            ('update_job_completion', {}),
+        ):
+            patcher = patch.object(PlaylistDownloader, name, **kwargs)
+            setattr(self, f"mock_{name}", patcher.start())
+            self.addCleanup(patcher.stop)
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_continuation_token_round_trip(self):
+        self.assertEqual(decode_continuation(encode_continuation("job_1", 3, 9)), ("job_1", 3, 9))
+        with self.assertRaises(ValueError):
+            decode_continuation("not-a-token")
+    
+    def test_exhausted_time_budget_defers_tracks(self):
+        result = self.downloader.process_download("job_1", time_budget=0)
+        
+        self.assertFalse(result['complete'])
+        self.assertEqual(result['remainingTracks'], 4)
+        self.assertEqual(decode_continuation(result['continuation']), ("job_1", 0, 4))
+        self.mock_download_single_track.assert_not_called()
+    
+    @patch('api.download_playlist.shutil.move')
+    def test_parallel_ranges_then_last_chunk_assembles_archive(self, mock_move):
+        first = self.downloader.process_download("job_1", track_range=(0, 2))
+        
+        self.assertFalse(first['complete'])
+        self.assertIsNone(first['continuation'])
+        mock_move.assert_not_called()
+        
+        second = self.downloader.process_download("job_1", track_range=(2, 4))
+        
+        self.assertTrue(second['complete'])
+        self.assertEqual(second['successfulTracks'], 3)
+        self.assertEqual(second['failedTracks'], 1)
+        self.mock_update_job_completion.assert_called_once_with(
+            "job_1", "/api/download/file/job_1", ["Artist3 - Song3"], sync=None, analysis=None
+        )
+        
+        zip_path = mock_move.call_args[0][0]
+        self.assertEqual(mock_move.call_args[0][1], "/tmp/job_1.zip")
+        self.assertFalse(os.path.exists(zip_path))  # work dir cleaned up after the (mocked) move
+    
+    @patch('api.download_playlist.shutil.move')
+    def test_chunk_progress_counts_the_whole_playlist(self, mock_move):
+        self.downloader.process_download("job_1", track_range=(0, 2))
+        self.mock_update_job_status.reset_mock()
+        
+        self.downloader.process_download("job_1", track_range=(2, 4))
+        
+        progress = [c.args[2:4] for c in self.mock_update_job_status.call_args_list if c.args[1] == 'downloading']
+        self.assertEqual(progress[0], (2, 4))
+        self.assertEqual(progress[-1], (4, 4))
+    
+    def test_run_download_request_dispatches_continuation(self):
+        token = encode_continuation("job_1", 2, 4)
+        
+        with patch.object(PlaylistDownloader, 'process_download', return_value={}) as mock_process:
+            run_download_request(self.downloader, {"continuation": token, "timeBudget": 60})
+        
+        mock_process.assert_called_once_with("job_1", track_range=(2, 4), time_budget=60)
+        
+        with self.assertRaises(ValueError):
+            run_download_request(self.downloader, {"trackRange": [0, 2]})
+        for time_budget in ("60", None, -1):
+            with self.assertRaises(ValueError):
+                run_download_request(self.downloader, {"jobId": "job_1", "timeBudget": time_budget})
+
+
+STATUS_ROUTE = os.path.join(
+    os.path.dirname(project_root), 'next-ui', 'src', 'app', 'api', 'download', 'status', '[jobId]', 'route.ts'
+)
+
+
+def _status_response(job):
+    """What the Next.js status route, which get_job_details reads, returns for a stored job"""
+    with open(STATUS_ROUTE) as f:
+        fields = re.findall(r'^\s*(\w+): job\.(\w+),$', f.read(), re.M)
+    # Undefined fields are left out of the JSON
+    return {name: job[source] for name, source in fields if job.get(source) is not None}
+
+
+class TestDeltaSync(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.downloader = PlaylistDownloader(max_workers=1)
+        self.downloader.retries = 0
+        self.downloader.cache = TrackCache(os.path.join(self.temp_dir.name, 'cache'), max_bytes=1024 ** 2)
+        self.downloader.work_dir = self.temp_dir.name
+        self.jobs = {"job_1": {"playlistId": "playlist"}}
+        self.playlist = [(1, "ISRC1"), (2, "ISRC2"), (3, "ISRC3")]
+        
+        def playlist_data(playlist_id):
+            return {"name": "Mix", "tracks": {"items": [
+                {"track": {
+                    "matchStatus": "matched",
+                    "isrc": isrc,
+                    "spotify": {"name": f"Song{isrc[-1]}", "artists": [{"name": "Artist"}]},
+                    "tidal": {"id": tidal_id, "url": f"url{tidal_id}"}
+                }}
+                for tidal_id, isrc in self.playlist
+            ]}}
+        
+        def fake_download(tidal_track, download_dir, spotify_track, sessions=None):
+            with open(os.path.join(download_dir, f"{tidal_track['id']}.flac"), 'wb') as f:
+                f.write(b'audio')
+            return True
+        
+        for name, kwargs in (
+            ('get_job_details', {'side_effect': lambda job_id: self.jobs[job_id]}),
+            ('get_playlist_data', {'side_effect': playlist_data}),
+            ('download_single_track', {'side_effect': fake_download}),
+            ('update_job_status', {}),
+            ('update_job_completion', {}),
+            ('_publish_archive', {'side_effect': self._capture_archive}),
+        ):
+            patcher = patch.object(PlaylistDownloader, name, **kwargs)
+            setattr(self, f"mock_{name}", patcher.start())
+            self.addCleanup(patcher.stop)
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def _capture_archive(self, job_id, zip_path, successful_downloads, failed_tracks, sync_plan=None,
+                         analysis=None):
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.archived = sorted(zipf.namelist())
+        return {'success': True, 'sync': sync_plan.summary() if sync_plan else None}
+    
+    def _edit_playlist(self):
+        # Drop track 2, add track 4, and TIDAL re-issued track 3 under a new id
+        self.playlist = [(1, "ISRC1"), (30, "ISRC3"), (4, "ISRC4")]
+    
+    def test_delta_sync_downloads_and_archives_only_new_tracks(self):
+        self.downloader.process_download("job_1")
+        self._edit_playlist()
+        self.mock_download_single_track.reset_mock()
+        self.jobs["job_2"] = {"playlistId": "playlist", "syncFrom": "job_1"}
+        
+        result = self.downloader.process_download("job_2")
+        
+        self.assertEqual([c.args[0]['id'] for c in self.mock_download_single_track.call_args_list], [4])
+        self.assertEqual(self.archived, ["4.flac"])
+        self.assertEqual(result['sync'], {
+            'from': "job_1", 'mode': 'delta', 'added': 1, 'retained': 2, 'removed': ["Artist - Song2"]
+        })
+        
+        # The new manifest still covers the whole playlist, so the next sync can diff against it
+        manifest = self.downloader.load_sync_manifest("job_2")
+        self.assertEqual(sorted(manifest['tracks']), ["tidal:1", "tidal:30", "tidal:4"])
+        self.assertEqual(manifest['tracks']["tidal:30"]['files'], ["3.flac"])
+    
+    def test_full_sync_rebuilds_from_cached_tracks(self):
+        self.downloader.process_download("job_1")
+        self._edit_playlist()
+        self.playlist[1] = (3, "ISRC3")
+        self.mock_download_single_track.reset_mock()
+        self.jobs["job_2"] = {"playlistId": "playlist", "syncFrom": "job_1", "syncMode": "full"}
+        
+        result = self.downloader.process_download("job_2")
+        
+        self.assertEqual([c.args[0]['id'] for c in self.mock_download_single_track.call_args_list], [4])
+        self.assertEqual(self.archived, ["1.flac", "3.flac", "4.flac"])
+        self.assertEqual(result['sync']['mode'], 'full')
+        self.assertEqual(result['sync']['cached'], 2)
+    
+    def test_unchanged_playlist_fails_delta_sync_clearly(self):
+        self.downloader.process_download("job_1")
+        self.jobs["job_2"] = {"playlistId": "playlist", "syncFrom": "job_1"}
+        
+        with self.assertRaisesRegex(Exception, "No new tracks since job job_1"):
+            self.downloader.process_download("job_2")
+    
+    def test_sync_fields_reach_python_through_status_route(self):
+        self.downloader.process_download("job_1")
+        self._edit_playlist()
+        self.mock_download_single_track.reset_mock()
+        stored = {
+            "id": "job_2", "playlistId": "playlist", "playlistName": "Mix", "status": "queued",
+            "syncFrom": "job_1", "syncMode": "full"
+        }
+        self.mock_get_job_details.side_effect = lambda job_id: _status_response(stored)
+        
+        result = self.downloader.process_download("job_2")
+        
+        self.assertEqual(result['sync']['from'], "job_1")
+        self.assertEqual(result['sync']['mode'], 'full')
+        self.assertEqual(self.archived, ["1.flac", "30.flac", "4.flac"])
+    
+    def test_missing_previous_manifest_downloads_everything(self):
+        self.jobs["job_2"] = {"playlistId": "playlist", "syncFrom": "job_0"}
+        
+        self.downloader.process_download("job_2")
+        
+        self.assertEqual(self.mock_download_single_track.call_count, 3)
+        self.assertEqual(self.archived, ["1.flac", "2.flac", "3.flac"])
+
+
+class TestDownloadWorkerPool(unittest.TestCase):
+    
+    def test_deduplicates_and_applies_backpressure(self):
+        downloader = Mock()
+        pool = DownloadWorkerPool(downloader, max_jobs=1, max_queue=2)
+        
+        # Workers not started, so everything stays queued
+        self.assertTrue(pool.submit({"jobId": "job_1"}))
+        self.assertFalse(pool.submit({"jobId": "job_1"}))
+        self.assertTrue(pool.submit({"jobId": "job_1", "trackRange": [0, 10]}))
+        
+        with self.assertRaises(WorkerQueueFull):
+            pool.submit({"jobId": "job_2"})
+        with self.assertRaises(ValueError):
+            pool.submit({})
+    
+    def test_workers_drain_queue_with_bounded_concurrency(self):
+        import threading
+        import time
+        
+        running = []
+        peak = []
+        lock = threading.Lock()
+        
+        def fake_process(job_id, track_range=None, time_budget=None):
+            with lock:
+                running.append(job_id)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(job_id)
+            return {"success": True}
+        
+        downloader = Mock()
+        downloader.process_download.side_effect = fake_process
+        pool = DownloadWorkerPool(downloader, max_jobs=2, max_queue=10)
+        
+        for i in range(5):
+            pool.submit({"jobId": f"job_{i}"})
+        pool.start()
+        pool._queue.join()
+        
+        self.assertEqual(downloader.process_download.call_count, 5)
+        self.assertLessEqual(max(peak), 2)
+        # Finished jobs can be submitted again
+        self.assertTrue(pool.submit({"jobId": "job_0"}))
+
+
+class TestBenchmarkHarness(unittest.TestCase):
+    
+    def setUp(self):
+        sys.path.insert(0, os.path.join(project_root, 'benchmarks'))
+        self.addCleanup(sys.path.remove, os.path.join(project_root, 'benchmarks'))
+    
+    def test_fake_nextjs_serves_pipeline_endpoints(self):
+        from fake_nextjs import FakeNextJS
+        
+        with FakeNextJS() as nextjs:
+            nextjs.add_job("job_1", 3)
+            downloader = PlaylistDownloader(client=NextJSClient(base_url=nextjs.url))
+            
+            job = downloader.get_job_details("job_1")
+            playlist = downloader.get_playlist_data(job['playlistId'])
+            downloader.update_job_status("job_1", "downloading", 1, 3, "Artist 0 - Song 0")
+        
+        self.assertEqual(len(playlist['tracks']['items']), 3)
+        self.assertEqual(playlist['tracks']['items'][0]['track']['matchStatus'], 'matched')
+        self.assertEqual(nextjs.updates["job_1"][0]['progress']['current'], 1)
+    
+    def test_compare_reports_throughput_regressions(self):
+        from run_benchmarks import compare
+        
+        scenario = {'engine': 'session', 'tracks': 10, 'concurrency': 4, 'file_mb': 1.0}
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump({'results': [{**scenario, 'tracks_per_second': 100.0}]}, f)
+        self.addCleanup(os.remove, f.name)
+        
+        self.assertEqual(compare([{**scenario, 'tracks_per_second': 95.0}], f.name, threshold=10), [])
+        regressions = compare([{**scenario, 'tracks_per_second': 50.0}], f.name, threshold=10)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('session-t10-c4-1.0mb', regressions[0])
 
 
 class TestVercelHandler(unittest.TestCase):
     
+    def setUp(self):
+        # Every test starts cold
+        for patcher in (patch('api.download_playlist._downloader', None),
+                        patch('api.download_playlist._cold_start_pending', False),
+                        patch.dict(os.environ, {'PREWARM': '0'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
     def test_handler_success(self):
         mock_req = Mock()
         mock_req.method = 'POST'
@@ -212,7 +2067,7 @@ class TestVercelHandler(unittest.TestCase):
     
     def test_handler_method_not_allowed(self):
         mock_req = Mock()
-        mock_req.method = 'GET'
+        mock_req.method = 'DELETE'
         mock_res = Mock()
         
         result = handler(mock_req, mock_res)
@@ -220,6 +2075,21 @@ class TestVercelHandler(unittest.TestCase):
         self.assertEqual(result['statusCode'], 405)
         self.assertIn('error', json.loads(result['body']))
     
+    def test_handler_refuses_stream_delivery(self):
+        get_req = Mock(method='GET', path='/api/python/download-playlist?jobId=job_1')
+        post_req = Mock(method='POST', body='{"jobId": "job_1"}')
+        
+        with patch('api.download_playlist.PlaylistDownloader') as mock_downloader_class:
+            mock_downloader_class.return_value.delivery_mode = 'stream'
+            
+            for req in (get_req, post_req):
+                result = handler(req, Mock())
+                self.assertEqual(result['statusCode'], 501)
+                self.assertIn("serve()", json.loads(result['body'])['error'])
+        
+        mock_downloader_class.return_value.process_download.assert_not_called()
+        mock_downloader_class.return_value.stream_archive.assert_not_called()
+    
     def test_handler_exception(self):
         mock_req = Mock()
         mock_req.method = 'POST'
@@ -233,6 +2103,49 @@ class TestVercelHandler(unittest.TestCase):
             
             self.assertEqual(result['statusCode'], 500)
             self.assertIn('error', json.loads(result['body']))
+    
+    def test_warm_invocations_reuse_the_downloader(self):
+        mock_req = Mock()
+        mock_req.method = 'POST'
+        mock_req.body = '{"jobId": "test-job-123"}'
+        metrics = PipelineMetrics()
+        
+        with patch('api.download_playlist.PlaylistDownloader') as mock_downloader_class, \
+                patch('api.download_playlist.METRICS', metrics):
+            mock_downloader_class.return_value.process_download.return_value = {"success": True}
+            
+            for _ in range(3):
+                self.assertEqual(handler(mock_req, Mock())['statusCode'], 200)
+        
+        mock_downloader_class.assert_called_once_with()
+        self.assertEqual(mock_downloader_class.return_value.process_download.call_count, 3)
+        prometheus = metrics.render_prometheus()
+        self.assertIn('handler_starts_total{start="cold"} 1', prometheus)
+        self.assertIn('handler_starts_total{start="warm"} 2', prometheus)
+    
+    def test_metrics_scrapes_are_not_counted_as_starts(self):
+        metrics = PipelineMetrics()
+        with patch('api.download_playlist.PlaylistDownloader'), patch('api.download_playlist.METRICS', metrics):
+            get_downloader()
+            get_downloader()
+            count_start()
+            count_start()
+        
+        prometheus = metrics.render_prometheus()
+        self.assertIn('handler_starts_total{start="cold"} 1', prometheus)
+        self.assertIn('handler_starts_total{start="warm"} 1', prometheus)
+    
+    def test_cold_start_prewarms_cache_and_orpheus_session(self):
+        with patch('api.download_playlist.PlaylistDownloader') as mock_downloader_class, \
+                patch.dict(os.environ, {'PREWARM': '1'}):
+            downloader = get_downloader()
+            prewarm = [thread for thread in threading.enumerate() if thread.name == 'prewarm']
+            for thread in prewarm:
+                thread.join()
+        
+        self.assertIs(downloader, mock_downloader_class.return_value)
+        downloader.cache.warm.assert_called_once_with()
+        downloader.open_session_pool.return_value.warm.assert_called_once_with()
 
 
 if __name__ == '__main__':